@@ -1,54 +1,504 @@
 import os
-from stardict import Dictionary
+import shutil
+import threading
+import instrumentation
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from stardict import Dictionary, DEFAULT_RESOURCE_CACHE_SIZE
+from dictzip import DEFAULT_CACHE_SIZE
 from dictutils import find_dictionary_filepaths
+from fulltext import FULLTEXT_EXT, FULLTEXT_VERSION, FullTextIndex, FullTextIndexBuilder
+from lrucache import LRUCache
+from search_index import SearchIndex
+from snapshot import get_source_key, read_snapshot, write_snapshot
+from sqlite_store import SqliteDictionary, get_store_filename
+
+SEARCH_INDEX_SNAPSHOT_FILENAME = 'search_index.snapshot'
+SETTINGS_FILENAMES = ('installed_dictionaries_settings.txt', 'index_group_settings.txt',
+                      'text_capture_group_settings.txt')
+# Seconds between two polls of DictionaryWatcher
+DEFAULT_WATCH_INTERVAL = 2.0
+
+# Dictionary loading modes
+LOAD_EAGER = 'eager'        # load each dictionary in turn at construction
+LOAD_LAZY = 'lazy'          # read .ifo files only, load each dictionary on its first lookup, and build the
+                            # search index on its first use unless its snapshot is up to date
+LOAD_PARALLEL = 'parallel'  # load all dictionaries at construction on a thread pool
+
+
+def sizeof_definitions(dictionaries_definitions):
+    """Estimate the memory used by [(dictionary, definitions), ...], as the size of the entry data.
+
+    """
+    return 1 + sum(entry.size for dictionary, definitions in dictionaries_definitions
+                   for entry in definitions)
+
+
+class StarDictState(object):
+    """The settings, dictionaries and search index a StarDict answers from, swapped as a whole.
+    Not modified once published: install_dictionary and reload publish a new one.
+    """
+    __slots__ = ('settings', 'dictionaries', 'content_keys', 'search_index')
+
+    def __init__(self, settings, dictionaries, content_keys, search_index):
+        """Constructor.
+
+        Arguments:
+        - `settings`: DictionarySettings object.
+        - `dictionaries`: {name: Dictionary object} of the enabled dictionaries.
+        - `content_keys`: {name: key} of the files of the dictionaries when opened, see StarDict._get_content_key.
+        - `search_index`: SearchIndex object of the index group dictionaries, or None until built in lazy mode.
+        """
+        self.settings = settings
+        self.dictionaries = dictionaries
+        self.content_keys = content_keys
+        self.search_index = search_index
 
 
 class StarDict():
+    """Look up words in the enabled dictionaries.
+    Lookups and search index queries are safe to run from concurrent threads on one instance: readers are not
+    modified once loaded, lazy loading is serialized per dictionary, and install_dictionary and reload swap in new
+    dictionaries and a new search index only once they are complete. The settings, the dictionaries and the search
+    index are held together in a StarDictState object, read once by each lookup and replaced as a whole.
+    Definitions can be cached by word and set of looked up dictionaries. The cache is dropped by install_dictionary,
+    reload and invalidate_definition_cache; a change of the enabled dictionaries changes the cache keys.
+    """
+
+    def __init__(self, dictionary_settings, compact_index=False, dictzip_cache_size=DEFAULT_CACHE_SIZE,
+                 snapshot_dirpath=None, load_mode=LOAD_EAGER, max_workers=None, definition_cache_size=0,
+                 definition_cache_max_items=None, definition_cache_ttl=None, unified_lookup=False,
+                 memory_budget=None, resource_cache_size=DEFAULT_RESOURCE_CACHE_SIZE, store_dirpath=None):
+        """Constructor.
+
+        Arguments:
+        - `dictionary_settings`: DictionarySettings object.
+        - `compact_index`: use the compact .idx and .syn readers.
+        - `dictzip_cache_size`: the budget in bytes of the decompressed chunk cache of each .dict.dz file.
+        - `snapshot_dirpath`: directory of the index snapshots of each dictionary and of the search index.
+        - `load_mode`: LOAD_EAGER, LOAD_LAZY or LOAD_PARALLEL.
+        - `max_workers`: the maximum number of dictionaries loaded at the same time in lazy and parallel modes.
+        - `definition_cache_size`: the budget in bytes of the definition cache, see sizeof_definitions.
+        - `definition_cache_max_items`: the maximum number of words in the definition cache.
+        The definition cache is disabled unless one of these two bounds is given.
+        - `definition_cache_ttl`: the number of seconds definitions stay cached, or None for no expiry.
+        - `unified_lookup`: resolve headwords and synonyms together with Dictionary.resolve, so that an entry named
+        both by a word and by its synonym is returned once.
+        - `memory_budget`: the budget in bytes of the heap memory of the loaded dictionaries (see
+        Dictionary.get_memory_usage), or None for no budget. Past it, the least recently used dictionaries are
+        closed, and read again on their next lookup: give a `snapshot_dirpath` with `compact_index`, or compile
+        packages, so that reopening them costs little.
+        - `resource_cache_size`: the budget in bytes of the resource cache of each dictionary, see
+        stardict.ResourceStorage.
+        - `store_dirpath`: directory of the SQLite stores imported by sqlite_store.py. Dictionaries with an up to
+        date store there are looked up in it, with the other options not applying to them.
+        """
+        if load_mode not in (LOAD_EAGER, LOAD_LAZY, LOAD_PARALLEL):
+            raise ValueError('Unknown load mode {!r}'.format(load_mode))
+        self.compact_index = compact_index
+        self.dictzip_cache_size = dictzip_cache_size
+        self.snapshot_dirpath = snapshot_dirpath
+        self.load_mode = load_mode
+        self.max_workers = max_workers
+        self.unified_lookup = unified_lookup
+        self._load_semaphore = threading.BoundedSemaphore(
+            max_workers) if max_workers else None
+        if definition_cache_size or definition_cache_max_items:
+            self._definition_cache = LRUCache(definition_cache_size or None, sizeof=sizeof_definitions,
+                                              max_items=definition_cache_max_items, ttl=definition_cache_ttl)
+        else:
+            self._definition_cache = None
+        self.memory_budget = memory_budget
+        self.resource_cache_size = resource_cache_size
+        self.store_dirpath = store_dirpath
+        # Dictionary: heap bytes of the loaded dictionaries, least recently used first
+        self._resident = OrderedDict()
+        self._resident_lock = threading.Lock()
+        self._evictions = 0
+        # Serializes install_dictionary and reload
+        self._reload_lock = threading.Lock()
+        # Serializes the publications of a new state
+        self._state_lock = threading.Lock()
+        self._state_version = 0
+        # name: (Dictionary, FullTextIndex)
+        self._fulltext_indexes = {}
+        dictionaries = {}
+        content_keys = {}
+        self._load_dictionaries(dictionary_settings, dictionaries, content_keys)
+        self._state = StarDictState(dictionary_settings, dictionaries, content_keys, self._make_search_index(
+            self._get_index_group_names(dictionary_settings, dictionaries), dictionaries,
+            build=self.load_mode != LOAD_LAZY))
+
+    @property
+    def state_version(self):
+        """A number changed each time the settings, dictionaries or search index change (install_dictionary,
+        reload...), to tell results computed before the change, cached by a caller, from current ones.
+
+        """
+        return self._state_version
+
+    @property
+    def settings(self):
+        """The DictionarySettings object of the current state.
 
-    def __init__(self, dictionary_settings):
-        self.settings = dictionary_settings
-        self._dictionaries = {}
-        self._load_dictionaries()
-        self._build_search_index()
+        """
+        return self._state.settings
 
-    def _load_dictionaries(self):
-        names = self.settings.find_enabled_dictionaries()
+    def _load_dictionaries(self, settings, dictionaries, content_keys):
+        names = settings.find_enabled_dictionaries()
         for name in names:
             dictionary_path = os.path.join(
-                self.settings.dicts_dirpath, name)
-            self._load_dictionary(dictionary_path)
+                settings.dicts_dirpath, name)
+            self._load_dictionary(
+                dictionary_path, dictionaries, content_keys, lazy=self.load_mode != LOAD_EAGER)
 
-    def _load_dictionary(self, dictionary_path):
-        try:
-            dictionary = Dictionary(dictionary_path)
-        except:
-            dictionary = None
+        if self.load_mode == LOAD_PARALLEL:
+            loading = list(dictionaries.values())
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(dictionary.open)
+                           for dictionary in loading]
+            for dictionary, future in zip(loading, futures):
+                if future.exception() is not None:
+                    print('Cannot load dictionary {}'.format(dictionary.name))
+                    del dictionaries[dictionary.name]
+                    del content_keys[dictionary.name]
+
+    def _load_dictionary(self, dictionary_path, dictionaries, content_keys, lazy=False):
+        """Open a dictionary into mappings not published yet.
+
+        Arguments:
+        - `dictionary_path`: the dictionary directory.
+        - `dictionaries`, `content_keys`: the mappings of the next StarDictState.
+        - `lazy`: read the .ifo file only, see Dictionary.
+        """
+        dictionary = self._open_dictionary(dictionary_path, lazy)
         if dictionary:
-            self._dictionaries[dictionary.name] = dictionary
+            replaced = dictionaries.get(dictionary.name)
+            if replaced is not None:
+                with self._resident_lock:
+                    # A reinstalled dictionary replaces the one accounted for
+                    self._resident.pop(replaced, None)
+            dictionaries[dictionary.name] = dictionary
+            content_keys[dictionary.name] = self._get_content_key(dictionary)
+            if dictionary.loaded:
+                self._touch(dictionary)
+
+    def _get_content_key(self, dictionary):
+        try:
+            return [type(dictionary).__name__, dictionary.get_content_key()]
+        except OSError:
+            return None
+
+    def _open_dictionary(self, dictionary_path, lazy=False):
+        """Open a dictionary from its SQLite store if it has an up to date one, else from its files.
+
+        Arguments:
+        - `dictionary_path`: the dictionary directory.
+        - `lazy`: read the .ifo file only, see Dictionary.
+        Return:
+        The Dictionary or SqliteDictionary object, or None if the dictionary cannot be opened.
+        """
+        dictionary = None
+        if self.store_dirpath is not None:
+            try:
+                dictionary = SqliteDictionary(
+                    dictionary_path, get_store_filename(self.store_dirpath, os.path.basename(dictionary_path)),
+                    resource_cache_size=self.resource_cache_size)
+            except ValueError:
+                # No up to date store: read the dictionary files
+                pass
+        if dictionary is None:
+            try:
+                dictionary = Dictionary(
+                    dictionary_path, compact_index=self.compact_index,
+                    dictzip_cache_size=self.dictzip_cache_size,
+                    snapshot_dirpath=self.snapshot_dirpath,
+                    lazy=lazy, load_semaphore=self._load_semaphore,
+                    unified_lookup=self.unified_lookup,
+                    resource_cache_size=self.resource_cache_size)
+            except:
+                dictionary = None
+        return dictionary
+
+    def _get_dictionary(self, name, dictionaries=None):
+        """Get a dictionary by name, loading it first in lazy mode.
+
+        Arguments:
+        - `name`: dictionary name.
+        - `dictionaries`: the {name: dictionary} mapping to look in, by default the current one. Lookups pass the
+        mapping they started with, so that a reload swapping in another one does not change their dictionaries.
+        Return:
+        The Dictionary object, or None if it is not enabled or cannot be loaded.
+        """
+        if dictionaries is None:
+            dictionaries = self._state.dictionaries
+        dictionary = dictionaries.get(name)
+        if dictionary is None:
+            return None
+        if not dictionary.loaded:
+            try:
+                dictionary.open()
+            except:
+                print('Cannot load dictionary {}'.format(name))
+                self._discard_dictionary(dictionary)
+                return None
+        self._touch(dictionary)
+        return dictionary
+
+    def _discard_dictionary(self, dictionary):
+        """Publish a state without a dictionary that cannot be loaded, if it is still in the current one.
+
+        """
+        with self._state_lock:
+            state = self._state
+            if state.dictionaries.get(dictionary.name) is not dictionary:
+                return
+            dictionaries = {name: other for name, other in state.dictionaries.items() if other is not dictionary}
+            content_keys = {name: key for name, key in state.content_keys.items() if name in dictionaries}
+            self._state = StarDictState(state.settings, dictionaries, content_keys, state.search_index)
+            self._state_version += 1
+
+    def _touch(self, dictionary):
+        """Mark a loaded dictionary as used, and close the least recently used ones past the memory budget.
+
+        Arguments:
+        - `dictionary`: the Dictionary object.
+        """
+        if self.memory_budget is None:
+            return
+        evicted = []
+        with self._resident_lock:
+            if dictionary in self._resident:
+                self._resident.move_to_end(dictionary)
+                return
+            self._resident[dictionary] = sum(
+                usage['heap_bytes'] for usage in dictionary.get_memory_usage().values())
+            # Keep the dictionary in use, even alone over the budget
+            while sum(self._resident.values()) > self.memory_budget and len(self._resident) > 1:
+                evicted_dictionary, heap_bytes = self._resident.popitem(last=False)
+                evicted.append(evicted_dictionary)
+            self._evictions += len(evicted)
+        # The definition cache holds copies of the entries (see Entry.detach), not the buffers of the readers
+        for evicted_dictionary in evicted:
+            evicted_dictionary.close()
+
+    def get_memory_budget_stats(self):
+        """Get the state of the memory budget.
+
+        Return:
+        A dictionary {'budget_bytes', 'resident_bytes', 'resident', 'evictions'}, resident being the names of
+        the loaded dictionaries from the least recently used, or None if there is no budget.
+        """
+        if self.memory_budget is None:
+            return None
+        with self._resident_lock:
+            return {
+                'budget_bytes': self.memory_budget,
+                'resident_bytes': sum(self._resident.values()),
+                'resident': [dictionary.name for dictionary in self._resident],
+                'evictions': self._evictions,
+            }
+
+    def get_resources(self, name):
+        """Get the resource storage of a dictionary, without loading its indexes.
+
+        Arguments:
+        - `name`: dictionary name.
+        Return:
+        The stardict.ResourceStorage object, or None if the dictionary is not enabled or has no resources.
+        """
+        dictionary = self._state.dictionaries.get(name)
+        if dictionary is None:
+            return None
+        return dictionary.resources
+
+    def get_load_times(self):
+        """Get the time spent loading each dictionary.
+
+        Return:
+        A dictionary {dictionary_name: seconds}, without the dictionaries not loaded yet.
+        """
+        return {name: dictionary.load_time for name, dictionary in self._state.dictionaries.items()
+                if dictionary.loaded}
 
     def get_definitions_from_enabled_dictionaries(self, word_str, text_capture_mode=False):
+        state = self._state
         if text_capture_mode:
-            names = self.settings.enabled_dictionaries_in_text_capture_mode
+            names = state.settings.enabled_dictionaries_in_text_capture_mode
         else:
-            names = self.settings.enabled_dictionaries_in_normal_mode
+            names = state.settings.enabled_dictionaries_in_normal_mode
+        return self._get_cached_definitions(word_str, names, state)
 
-        enabled_dictionaries_definitions = []
+    def get_definitions_from_dictionary_name(self, word_str, dictionary_name):
+        result = self._get_cached_definitions(word_str, [dictionary_name], self._state)
+        if not result:
+            return None
+        return result[0]
+
+    def _get_cached_definitions(self, word_str, names, state):
+        """Get the definitions of a word from some dictionaries, through the definition cache.
+
+        Arguments:
+        - `word_str`: the word.
+        - `names`: the names of the dictionaries, skipped when they cannot be loaded.
+        - `state`: the StarDictState read at the start of the lookup.
+        Return:
+        A list [(dictionary, definitions), ...]
+        """
+        if self._definition_cache is not None:
+            cache_key = (word_str, tuple(names))
+            cached = self._definition_cache.get(cache_key)
+            if cached is not None:
+                # Copy the lists so that callers cannot alter the cached ones
+                return [(dictionary, list(definitions)) for dictionary, definitions in cached]
+
+        dictionaries_definitions = []
+        may_contain = self._get_word_filter(word_str, state.search_index)
         for name in names:
-            if name not in self._dictionaries:
+            dictionary = self._get_dictionary(name, state.dictionaries)
+            if dictionary is None:
                 continue
-            dictionary = self._dictionaries[name]
-            definitions = self._get_definitions(
-                word_str, dictionary)
-            enabled_dictionaries_definitions.append((dictionary, definitions))
-        return enabled_dictionaries_definitions
+            if may_contain(dictionary):
+                definitions = self._get_definitions(
+                    word_str, dictionary)
+            else:
+                definitions = []
+            dictionaries_definitions.append((dictionary, definitions))
 
-    def get_definitions_from_dictionary_name(self, word_str, dictionary_name):
-        if dictionary_name not in self._dictionaries:
+        if self._definition_cache is not None:
+            # Detached entries do not keep the buffers of the readers alive once a dictionary is closed
+            self._definition_cache.put(cache_key, [(dictionary, [entry.detach() for entry in definitions])
+                                                   for dictionary, definitions in dictionaries_definitions])
+        return dictionaries_definitions
+
+    def _get_word_filter(self, word_str, search_index):
+        """Get a filter of the dictionaries that may contain a word, from the search index.
+        The headwords of the index group dictionaries are all in the search index, so a dictionary of the group
+        without synonyms cannot contain a word the index does not list for it.
+
+        Arguments:
+        - `word_str`: the word.
+        - `search_index`: the SearchIndex of the StarDictState the dictionaries come from, or None if not built yet.
+        Return:
+        A function telling whether a Dictionary object has to be searched for the word.
+        """
+        if search_index is None or (not self.compact_index and self.snapshot_dirpath is None):
+            # Probing the hash tables of the dictionaries is cheaper than searching the index
+            return lambda dictionary: True
+        containing = None
+
+        def may_contain(dictionary):
+            nonlocal containing
+            if dictionary.name not in search_index.names or dictionary.syn_reader is not None:
+                return True
+            if containing is None:
+                containing = search_index.get_word_dictionaries(word_str)
+            return dictionary.name in containing
+        return may_contain
+
+    def get_definition_cache_stats(self):
+        """Get the usage counters of the definition cache, see LRUCache.stats.
+
+        Return:
+        A dictionary of counters, or None if the cache is disabled.
+        """
+        if self._definition_cache is None:
             return None
-        dictionary = self._dictionaries[dictionary_name]
-        return (dictionary, self._get_definitions(word_str, dictionary))
+        return self._definition_cache.stats()
+
+    def stats(self, memory=True):
+        """Get the instrumentation measures (see instrumentation.stats) and the state of the dictionaries.
+
+        Arguments:
+        - `memory`: estimate the memory used by the readers.
+        Return:
+        A dictionary {'enabled', 'timers', 'counters', 'definition_cache': LRUCache.stats() or None,
+        'memory_budget': get_memory_budget_stats(), 'dictionaries': {name: {'loaded', 'load_time_s', 'load_phases_s', 'memory', 'chunk_cache'}}}, memory
+        being {reader name: {'heap_bytes', 'mapped_bytes'}} and chunk_cache the counters of the dictzip or
+        package chunk cache, or None.
+        """
+        stats = instrumentation.stats()
+        stats['definition_cache'] = self.get_definition_cache_stats()
+        stats['memory_budget'] = self.get_memory_budget_stats()
+        stats['dictionaries'] = {}
+        for name, dictionary in self._state.dictionaries.items():
+            loaded = dictionary.loaded
+            stats['dictionaries'][name] = {
+                'loaded': loaded,
+                'load_time_s': dictionary.load_time,
+                'load_phases_s': dict(dictionary.load_phases),
+                'memory': dictionary.get_memory_usage() if memory else {},
+                'chunk_cache': dictionary.dict_reader.cache_stats() if loaded else None,
+            }
+        return stats
+
+    def invalidate_definition_cache(self):
+        """Drop all cached definitions.
+
+        """
+        if self._definition_cache is not None:
+            self._definition_cache.clear()
+
+    def lookup_many(self, words, dictionaries=None, text_capture_mode=False):
+        """Look up many words at once.
+        Duplicate words are looked up once. In each dictionary, the index and synonym hits of all the words are
+        resolved first, then the entries are read in .dict file order.
+
+        Arguments:
+        - `words`: an iterable of words.
+        - `dictionaries`: the names of the dictionaries to look up, by default the enabled ones.
+        - `text_capture_mode`: by default, use the dictionaries enabled in text capture mode instead of the
+        ones enabled in normal mode.
+        Return:
+        A dictionary {word: [(dictionary, definitions), ...]}, with the definitions of each word as returned
+        by get_definitions_from_enabled_dictionaries.
+        """
+        words = list(dict.fromkeys(words))
+        state = self._state
+        if dictionaries is None:
+            if text_capture_mode:
+                dictionaries = state.settings.enabled_dictionaries_in_text_capture_mode
+            else:
+                dictionaries = state.settings.enabled_dictionaries_in_normal_mode
+
+        results = {word_str: [] for word_str in words}
+        filters = {word_str: self._get_word_filter(word_str, state.search_index) for word_str in words}
+        for name in dictionaries:
+            dictionary = self._get_dictionary(name, state.dictionaries)
+            if dictionary is None:
+                continue
+            locations = []
+            owners = []
+            for word_str in words:
+                if not filters[word_str](dictionary):
+                    continue
+                if self.unified_lookup:
+                    for number in dictionary.resolve(word_str):
+                        locations.append(dictionary.idx_reader.get_index_by_num(number)[1:])
+                        owners.append(word_str)
+                    continue
+                for location in dictionary.idx_reader.get_index_by_word(word_str):
+                    locations.append(location)
+                    owners.append(word_str)
+                if dictionary.syn_reader:
+                    for index in dictionary.syn_reader.get_syn(word_str):
+                        synonym, offset, size = dictionary.idx_reader.get_index_by_num(
+                            index)
+                        locations.append((offset, size))
+                        owners.append(word_str)
+            definitions = {word_str: [] for word_str in words}
+            entries = dictionary.dict_reader.get_dicts_by_locations(locations)
+            for word_str, entry in zip(owners, entries):
+                definitions[word_str].append(entry)
+            for word_str in words:
+                results[word_str].append((dictionary, definitions[word_str]))
+        return results
 
     def _get_definitions(self, word_str, dictionary):
+        if self.unified_lookup:
+            locations = [dictionary.idx_reader.get_index_by_num(number)[1:]
+                         for number in dictionary.resolve(word_str)]
+            return dictionary.dict_reader.get_dicts_by_locations(locations)
         definitions = dictionary.dict_reader.get_dict_by_word(word_str)
         if dictionary.syn_reader:
             indexes = dictionary.syn_reader.get_syn(word_str)
@@ -59,20 +509,323 @@ class StarDict():
         return definitions
 
     def install_dictionary(self, dictionary_path):
-        self.settings.install_dictionary(dictionary_path)
-        self._load_dictionary(dictionary_path)
-        self._build_search_index()
+        with self._reload_lock:
+            return self._install_dictionary(dictionary_path)
+
+    def _install_dictionary(self, dictionary_path):
+        state = self._state
+        # The settings of the current state are not modified: install into a copy
+        settings = DictionarySettings(state.settings.dicts_dirpath, state.settings.settings_dirpath)
+        if not settings.install_dictionary(dictionary_path):
+            return False
+        # Loaded from the dictionaries directory, where reload finds it too
+        dictionary_path = os.path.join(settings.dicts_dirpath, os.path.basename(os.path.normpath(dictionary_path)))
+        dictionaries = dict(state.dictionaries)
+        content_keys = dict(state.content_keys)
+        self._load_dictionary(
+            dictionary_path, dictionaries, content_keys, lazy=self.load_mode != LOAD_EAGER)
+
+        # Merge the new dictionary into the search index when it comes after the indexed ones
+        name = os.path.basename(dictionary_path)
+        names = self._get_index_group_names(settings, dictionaries)
+        search_index = state.search_index
+        dictionary = None
+        if search_index is not None and names == search_index.names + [name]:
+            dictionary = self._get_dictionary(name, dictionaries)
+        # Merging a dictionary about the size of the index costs more than rebuilding it
+        if dictionary is not None and (
+                len(dictionary.idx_reader) * 4 < len(search_index.words)):
+            key = self._get_search_index_key(names, dictionaries)
+            search_index = search_index.merge(name, dictionary.idx_reader.iter_words(), key)
+            self._write_search_index_snapshot(search_index)
+        else:
+            search_index = self._make_search_index(names, dictionaries, build=self.load_mode != LOAD_LAZY)
+        self._publish(StarDictState(settings, dictionaries, content_keys, search_index))
+        self.invalidate_definition_cache()
+        self._fulltext_indexes.pop(name, None)
+        return True
+
+    def _publish(self, state):
+        """Swap in a new state: lookups started from then on answer from it.
+
+        """
+        with self._state_lock:
+            self._state = state
+            self._state_version += 1
+
+    def reload(self):
+        """Read the settings files again, open the new and changed dictionaries, and swap them in.
+        The dictionaries are loaded, and the search index built, in the calling thread while lookups go on: lookups
+        started before the swap answer from the previous dictionaries and search index. Unchanged dictionaries,
+        compared by the size and modification time of their files, are kept as they are. The dropped ones are not
+        closed, so that running lookups can finish with them; they are freed once no longer referenced.
+
+        Return:
+        A dictionary {'added': [...], 'changed': [...], 'removed': [...]} of dictionary names.
+        """
+        with self._reload_lock:
+            state = self._state
+            settings = DictionarySettings(state.settings.dicts_dirpath, state.settings.settings_dirpath)
+            previous = state.dictionaries
+            dictionaries = {}
+            content_keys = {}
+            opened = []
+            for name in settings.find_enabled_dictionaries():
+                dictionary_path = os.path.join(settings.dicts_dirpath, name)
+                candidate = self._open_dictionary(dictionary_path, lazy=True)
+                if candidate is None:
+                    if name in previous and os.path.isdir(dictionary_path):
+                        # Files being replaced, like a half copied .ifo file: keep the working dictionary until
+                        # they load
+                        print('Cannot load the new files of dictionary {}, keeping the previous ones'.format(name))
+                        dictionaries[name] = previous[name]
+                        content_keys[name] = state.content_keys.get(name)
+                    else:
+                        print('Cannot load dictionary {}'.format(name))
+                    continue
+                content_key = self._get_content_key(candidate)
+                if name in previous and content_key is not None and content_key == state.content_keys.get(name):
+                    candidate.close()
+                    dictionaries[name] = previous[name]
+                else:
+                    dictionaries[name] = candidate
+                    opened.append(candidate)
+                content_keys[name] = content_key
+
+            if self.load_mode != LOAD_LAZY:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [executor.submit(dictionary.open) for dictionary in opened]
+                for dictionary, future in zip(list(opened), futures):
+                    if future.exception() is None:
+                        continue
+                    name = dictionary.name
+                    opened.remove(dictionary)
+                    if name in previous:
+                        # Like a half copied .idx file: the previous dictionary, and its content key, stay until
+                        # the new files load, so that the next reload tries them again
+                        print('Cannot load the new files of dictionary {}, keeping the previous ones'.format(name))
+                        dictionaries[name] = previous[name]
+                        content_keys[name] = state.content_keys.get(name)
+                    else:
+                        print('Cannot load dictionary {}'.format(name))
+                        del dictionaries[name]
+                        del content_keys[name]
+
+            with self._resident_lock:
+                # Account for the dictionaries replacing the dropped ones as they are loaded
+                for name, dictionary in previous.items():
+                    if dictionaries.get(name) is not dictionary:
+                        self._resident.pop(dictionary, None)
+
+            names = self._get_index_group_names(settings, dictionaries)
+            search_index = state.search_index
+            if (search_index is None or names != search_index.names or
+                    self._get_search_index_key(names, dictionaries) != search_index.key):
+                search_index = self._make_search_index(names, dictionaries, build=self.load_mode != LOAD_LAZY)
+
+            # Lookups running meanwhile go on with the state they started with
+            self._publish(StarDictState(settings, dictionaries, content_keys, search_index))
+            changes = {
+                'added': sorted(dictionary.name for dictionary in opened if dictionary.name not in previous),
+                'changed': sorted(dictionary.name for dictionary in opened if dictionary.name in previous),
+                'removed': sorted(name for name in previous if name not in dictionaries),
+            }
+            if not any(changes.values()):
+                return changes
+            for name in changes['changed'] + changes['removed']:
+                self._fulltext_indexes.pop(name, None)
+            self.invalidate_definition_cache()
+            for dictionary in opened:
+                if dictionary.loaded:
+                    self._touch(dictionary)
+            return changes
+
+    def _get_fulltext_filepath(self, name):
+        if self.snapshot_dirpath is None:
+            raise ValueError('The full-text indexes are stored in the snapshot directory')
+        return os.path.join(self.snapshot_dirpath, name + FULLTEXT_EXT)
+
+    def build_fulltext_index(self, name, callback=None):
+        """Start building the full-text index of a dictionary in a background thread.
+        The index is saved in the snapshot directory, which must be set, and used by search_fulltext once built.
+
+        Arguments:
+        - `name`: dictionary name.
+        - `callback`: function called with the (done, total) numbers of indexed entries, see
+        FullTextIndexBuilder.
+        Return:
+        The started FullTextIndexBuilder thread, or None if there is no such dictionary.
+        """
+        dictionary = self._get_dictionary(name)
+        if dictionary is None:
+            return None
+        builder = FullTextIndexBuilder(dictionary, self._get_fulltext_filepath(name), callback=callback)
+        builder.start()
+        return builder
+
+    def _get_fulltext_index(self, dictionary):
+        if isinstance(dictionary, SqliteDictionary):
+            # Searched in the fulltext table of the store, if it has one
+            return dictionary.fulltext_index
+        cached = self._fulltext_indexes.get(dictionary.name)
+        # The index of a replaced dictionary of the same name does not apply
+        index = cached[1] if cached is not None and cached[0] is dictionary else None
+        if index is None and self.snapshot_dirpath is not None:
+            index = FullTextIndex.open(self._get_fulltext_filepath(dictionary.name),
+                                       dictionary.get_content_key(fulltext_version=FULLTEXT_VERSION))
+            if index is not None:
+                self._fulltext_indexes[dictionary.name] = (dictionary, index)
+        return index
+
+    def search_fulltext(self, query, dictionaries=None, limit=None):
+        """Find the entries whose definitions match a query, in the dictionaries with a full-text index.
+
+        Arguments:
+        - `query`: words, and phrases in double quotes, all of them required, see FullTextIndex.search.
+        - `dictionaries`: the names of the dictionaries to search, by default the ones enabled in normal mode.
+        - `limit`: the maximum number of entries per dictionary, or None for all of them.
+        Return:
+        A list [(dictionary, [(word, definition), ...]), ...] of the dictionaries with a full-text index,
+        with the headword and the Entry object of each matching entry.
+        """
+        state = self._state
+        if dictionaries is None:
+            dictionaries = state.settings.enabled_dictionaries_in_normal_mode
+        results = []
+        for name in dictionaries:
+            dictionary = self._get_dictionary(name, state.dictionaries)
+            if dictionary is None:
+                continue
+            index = self._get_fulltext_index(dictionary)
+            if index is None:
+                continue
+            indexes = [dictionary.idx_reader.get_index_by_num(number)
+                       for number in index.search(query, limit)]
+            entries = dictionary.dict_reader.get_dicts_by_locations([index[1:] for index in indexes])
+            results.append((dictionary, [(index[0], entry) for index, entry in zip(indexes, entries)]))
+        return results
+
+    def _get_index_group_names(self, settings, dictionaries):
+        return [name for name in settings.enabled_dictionaries_in_index_group
+                if name in dictionaries]
+
+    def _get_search_index_key(self, names, dictionaries):
+        return get_source_key([], order='stardict', dictionaries=[
+            [name, dictionaries[name].source_key] for name in names])
 
     def _build_search_index(self):
-        search_index = set()
-        names = self.settings.enabled_dictionaries_in_index_group
-        for name in names:
-            if name not in self._dictionaries:
+        """Build the SearchIndex of the index group dictionaries, and swap it in.
+
+        """
+        with self._reload_lock:
+            state = self._state
+            search_index = self._make_search_index(
+                self._get_index_group_names(state.settings, state.dictionaries), state.dictionaries)
+            self._publish(StarDictState(state.settings, state.dictionaries, state.content_keys, search_index))
+
+    def _get_search_index(self):
+        """Get the SearchIndex of the current state, building it first if it was left for its first use (lazy mode).
+
+        """
+        search_index = self._state.search_index
+        if search_index is not None:
+            return search_index
+        with self._reload_lock:
+            state = self._state
+            if state.search_index is None:
+                search_index = self._make_search_index(
+                    self._get_index_group_names(state.settings, state.dictionaries), state.dictionaries)
+                self._publish(StarDictState(state.settings, state.dictionaries, state.content_keys, search_index))
+            return self._state.search_index
+
+    def _make_search_index(self, names, dictionaries, build=True):
+        """Read the SearchIndex of some dictionaries from its snapshot, or build it and write its snapshot.
+        The words of the dictionaries are merged k-way in .idx order.
+
+        Arguments:
+        - `names`: the names of the index group dictionaries, in index order.
+        - `dictionaries`: the {name: dictionary} mapping holding them.
+        - `build`: build the index when its snapshot is missing or stale, which loads all the dictionaries.
+        Return:
+        The SearchIndex object, or None if not built.
+        """
+        key = self._get_search_index_key(names, dictionaries)
+        if self.snapshot_dirpath is not None:
+            snapshot_filepath = os.path.join(
+                self.snapshot_dirpath, SEARCH_INDEX_SNAPSHOT_FILENAME)
+            snapshot = read_snapshot(snapshot_filepath, key)
+            if snapshot and 'postings' in snapshot:
+                words = snapshot.get_bytes('words').decode('utf-8')
+                return SearchIndex(names, words.split('\x00') if words else [],
+                                   snapshot.get_array('postings'), key, self.snapshot_dirpath)
+        if not build:
+            return None
+
+        streams = []
+        for number, name in enumerate(names):
+            dictionary = self._get_dictionary(name, dictionaries)
+            if dictionary is None:
                 continue
-            dictionary = self._dictionaries[name]
-            words = dictionary.idx_reader.get_all_words()
-            search_index = search_index.union(words)
-        self.search_index = sorted(search_index)
+            streams.append((number, dictionary.idx_reader.iter_words()))
+        search_index = SearchIndex.build(
+            names, streams, key, self.snapshot_dirpath)
+        self._write_search_index_snapshot(search_index)
+        return search_index
+
+    def _write_search_index_snapshot(self, search_index):
+        if self.snapshot_dirpath is None:
+            return
+        words = '\x00'.join(search_index.words).encode('utf-8')
+        try:
+            write_snapshot(os.path.join(self.snapshot_dirpath, SEARCH_INDEX_SNAPSHOT_FILENAME), search_index.key,
+                           {'words': words, 'postings': search_index.get_postings()})
+        except OSError:
+            print('Cannot write the search index snapshot')
+
+    @property
+    def search_index(self):
+        """The list of the words of the index group dictionaries, in .idx (stardict_strcmp) order.
+
+        """
+        return self._get_search_index().words
+
+    def complete(self, prefix, limit=10, fold=False):
+        """Complete a prefix with the words of the search index.
+
+        Arguments:
+        - `prefix`: the beginning of the words.
+        - `limit`: the maximum number of completions, or None for all of them.
+        - `fold`: case- and diacritic-insensitive completion, see dictutils.fold_word.
+        Return:
+        A list of tuples (word, [name of each index group dictionary containing the word]), in index order.
+        """
+        return self._get_search_index().complete(prefix, limit, fold)
+
+    def iter_range(self, low, high=None, fold=False):
+        """Iterate over the words of the search index between two words.
+
+        Arguments:
+        - `low`: the first word of the range (included).
+        - `high`: the last word of the range (excluded), or None to go to the end of the index.
+        - `fold`: compare the folded words instead of the words, see dictutils.fold_word.
+        Return:
+        An iterator of tuples (word, [name of each index group dictionary containing the word]).
+        """
+        return self._get_search_index().iter_range(low, high, fold)
+
+    def suggest(self, word_str, max_distance=2, limit=10):
+        """Find the words of the search index close to a possibly misspelled word ("did you mean").
+        The distance is measured between folded words (see dictutils.fold_word), so that case, umlauts and
+        "ß" against "ss" do not count as edits.
+
+        Arguments:
+        - `word_str`: the word.
+        - `max_distance`: the maximum Levenshtein distance, usually 1 or 2.
+        - `limit`: the maximum number of suggestions, or None for all of them.
+        Return:
+        A list of tuples (word, distance), by increasing distance.
+        """
+        return self._get_search_index().suggest(word_str, max_distance, limit)
 
 
 class DictionarySettings():
@@ -142,31 +895,137 @@ class DictionarySettings():
         return list(enabled_dictionaries)
 
     def install_dictionary(self, dictionary_path):
+        """Install a dictionary and enable it in all the settings files.
+        A dictionary outside the dictionaries directory is copied into it first, so that it is found there like
+        the other installed dictionaries.
+
+        Arguments:
+        - `dictionary_path`: the dictionary directory.
+        Return:
+        True if the dictionary has been installed, else False.
+        """
         filepaths = find_dictionary_filepaths(dictionary_path)
         if not filepaths:
             print('Install dictionary failed. Invalid dictionary')
             return False
 
+        dictionary_path = os.path.abspath(os.path.normpath(dictionary_path))
         dictionary_name = os.path.basename(dictionary_path)
         for setting in self.installed_dictionaries_settings:
             if dictionary_name == setting[0]:
                 print('This dictionary has been already installed')
                 return False
 
-        # TODO:Move file to dicts location
+        if os.path.dirname(dictionary_path) != self.dicts_dirpath:
+            target_path = os.path.join(self.dicts_dirpath, dictionary_name)
+            if os.path.exists(target_path):
+                print('Install dictionary failed. {} already exists'.format(target_path))
+                return False
+            # Copied aside and renamed, so that a reload never sees a partial copy
+            temp_path = os.path.join(self.dicts_dirpath, '.{}.{:d}.tmp'.format(dictionary_name, os.getpid()))
+            try:
+                shutil.copytree(dictionary_path, temp_path)
+                os.rename(temp_path, target_path)
+            except OSError as e:
+                shutil.rmtree(temp_path, ignore_errors=True)
+                print('Install dictionary failed. Cannot copy {}: {}'.format(dictionary_path, e))
+                return False
 
         order = len(self.installed_dictionaries_settings)
-        with open('./settings/installed_dictionaries_settings.txt', mode='a', encoding='utf-8') as f:
-            setting = '{} {} {}\n'.format(dictionary_name, 1, order)
-            f.write(setting)
-
-        with open('./settings/index_group_settings.txt', mode='a', encoding='utf-8') as f:
-            setting = '{} {} {}\n'.format(dictionary_name, 1, order)
-            f.write(setting)
-
-        with open('./settings/text_capture_group_settings.txt', mode='a', encoding='utf-8') as f:
-            setting = '{} {} {}\n'.format(dictionary_name, 1, order)
-            f.write(setting)
+        for filename in SETTINGS_FILENAMES:
+            with open(os.path.join(self.settings_dirpath, filename), mode='a', encoding='utf-8') as f:
+                setting = '{} {} {}\n'.format(dictionary_name, 1, order)
+                f.write(setting)
 
         self._load_settings()
         print('Install dictionary successfully')
+        return True
+
+
+def get_watch_state(dictionary_settings):
+    """Identify the state of the settings files and of the files of the dictionaries directory.
+
+    Arguments:
+    - `dictionary_settings`: DictionarySettings object.
+    Return:
+    A list of tuples (path, size, modification time), equal for two calls as long as no file is added, removed,
+    resized or modified: the settings files, and the entries of the dictionaries directory with the files of its
+    subdirectories.
+    """
+    state = []
+    for filename in SETTINGS_FILENAMES:
+        filepath = os.path.join(dictionary_settings.settings_dirpath, filename)
+        try:
+            stat = os.stat(filepath)
+            state.append((filepath, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            state.append((filepath, None, None))
+    try:
+        entries = sorted(os.scandir(dictionary_settings.dicts_dirpath), key=lambda entry: entry.name)
+    except OSError:
+        return state
+    for entry in entries:
+        try:
+            if not entry.is_dir():
+                stat = entry.stat()
+                state.append((entry.path, stat.st_size, stat.st_mtime_ns))
+                continue
+            for file_entry in sorted(os.scandir(entry.path), key=lambda file_entry: file_entry.name):
+                if file_entry.is_file():
+                    stat = file_entry.stat()
+                    state.append((file_entry.path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            # Removed while scanning: seen on the next poll
+            state.append((entry.path, None, None))
+    return state
+
+
+class DictionaryWatcher(threading.Thread):
+    """Reload a StarDict object in a background thread when its settings or dictionaries change.
+    The settings directory and the dictionaries directory are polled every `interval` seconds (see
+    get_watch_state). A change is acted on once the files have stayed the same for one more poll, so that a
+    dictionary still being copied is not loaded half written; StarDict.reload then loads the new and changed
+    dictionaries and swaps them in while lookups go on.
+    """
+
+    def __init__(self, stardict, interval=DEFAULT_WATCH_INTERVAL, callback=None):
+        """Constructor.
+
+        Arguments:
+        - `stardict`: the StarDict object.
+        - `interval`: the number of seconds between two polls.
+        - `callback`: function called with the result of StarDict.reload after each reload, from the watching
+        thread.
+        """
+        super().__init__(name='dictionary-watcher', daemon=True)
+        self.stardict = stardict
+        self.interval = interval
+        self.callback = callback
+        self.reloads = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop watching after the current poll or reload.
+
+        """
+        self._stop_event.set()
+
+    def run(self):
+        state = get_watch_state(self.stardict.settings)
+        pending = None
+        while not self._stop_event.wait(self.interval):
+            current = get_watch_state(self.stardict.settings)
+            if current == state or current != pending:
+                # Unchanged, or still changing
+                pending = None if current == state else current
+                continue
+            state = current
+            pending = None
+            try:
+                changes = self.stardict.reload()
+            except Exception as e:
+                print('Cannot reload the dictionaries: {}'.format(e))
+                continue
+            self.reloads += 1
+            if self.callback is not None:
+                self.callback(changes)
@@ -0,0 +1,216 @@
+"""Synthetic StarDict dictionary generator.
+
+Usage: python -m benchmarks.generate DIRPATH ENTRIES [--idx-gz] [--dictzip] [--no-syn] [--sametypesequence tm]
+
+Headwords are built so that they come out sorted in .idx order: each one starts with a distinct fixed-width
+prefix, drawn in increasing order, and goes on with a random suffix (some with umlauts, some capitalized).
+The files are written as they are generated, so that 10M entries do not need to fit in memory.
+"""
+import argparse
+import gzip
+import os
+import random
+import shutil
+import struct
+import tempfile
+import zlib
+
+LOWERCASE = 'abcdefghijklmnopqrstuvwxyz'
+SUFFIX_CHARS = LOWERCASE * 3 + 'äöüß'
+FILLER_WORDS = ('der', 'die', 'das', 'und', 'in', 'zu', 'den', 'von', 'mit', 'sich', 'des', 'auf', 'für',
+                'nicht', 'als', 'auch', 'es', 'an', 'werden', 'aus', 'er', 'hat', 'dass', 'sie', 'nach')
+
+# Entries per synonym and per capitalized duplicate headword
+SYN_INTERVAL = 3
+CAPITALIZED_INTERVAL = 50
+DICTZIP_CHUNK_LENGTH = 58315
+DICTZIP_MAX_CHUNKS = (0xffff - 10) // 2
+
+
+def _encode_prefix(number, width):
+    chars = []
+    for i in range(width):
+        number, digit = divmod(number, len(LOWERCASE))
+        chars.append(LOWERCASE[digit])
+    return ''.join(reversed(chars))
+
+
+def iter_headwords(entries, seed=0):
+    """Generate headwords in .idx order.
+
+    Arguments:
+    - `entries`: the number of headwords.
+    - `seed`: the random seed.
+    """
+    rng = random.Random(seed)
+    width = 1
+    while len(LOWERCASE) ** width < entries * 4:
+        width += 1
+    number = -1
+    count = 0
+    while count < entries:
+        number += 1 + rng.randrange(3)
+        word = _encode_prefix(number, width) + ''.join(
+            rng.choice(SUFFIX_CHARS) for i in range(rng.randrange(7)))
+        if count % CAPITALIZED_INTERVAL == 1 and count + 1 < entries:
+            # "Xyz" comes before "xyz" in .idx order
+            yield word.capitalize()
+            count += 1
+        yield word
+        count += 1
+
+
+def make_definition(rng, word):
+    return '{}: {}'.format(word, ' '.join(rng.choice(FILLER_WORDS) for i in range(rng.randint(3, 30))))
+
+
+def encode_entry(rng, word, sametypesequence):
+    """Encode the .dict data of an entry.
+
+    Arguments:
+    - `rng`: random.Random object.
+    - `word`: the headword.
+    - `sametypesequence`: the sametypesequence of the dictionary, None or '' if it has none.
+    """
+    if sametypesequence:
+        fields = []
+        for type_identifier in sametypesequence:
+            if type_identifier == 't':
+                data = word.encode('utf-8')
+            elif type_identifier.isupper():
+                data = rng.randbytes(rng.randint(8, 64))
+            else:
+                data = make_definition(rng, word).encode('utf-8')
+            if type_identifier.isupper():
+                data = struct.pack('!I', len(data)) + data
+            elif len(fields) < len(sametypesequence) - 1:
+                data += b'\x00'
+            fields.append(data)
+        # The size of the last field is given by the entry size
+        if sametypesequence[-1].isupper():
+            fields[-1] = fields[-1][4:]
+        return b''.join(fields)
+
+    entry = b't' + word.encode('utf-8') + b'\x00' + b'm' + make_definition(rng, word).encode('utf-8') + b'\x00'
+    if rng.randrange(100) == 0:
+        data = rng.randbytes(rng.randint(8, 64))
+        entry += b'P' + struct.pack('!I', len(data)) + data
+    return entry
+
+
+def write_dictzip(filename, source):
+    """Compress a file in dictzip format: gzip with a table of independently inflatable chunks.
+
+    Arguments:
+    - `filename`: the .dict.dz file to write.
+    - `source`: the .dict file to compress.
+    """
+    chunk_sizes = []
+    crc = 0
+    length = 0
+    with open(source, 'rb') as f, tempfile.TemporaryFile() as body:
+        while True:
+            data = f.read(DICTZIP_CHUNK_LENGTH)
+            if not data:
+                break
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            chunk = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+            chunk_sizes.append(len(chunk))
+            body.write(chunk)
+            crc = zlib.crc32(data, crc)
+            length += len(data)
+        if len(chunk_sizes) > DICTZIP_MAX_CHUNKS:
+            raise ValueError('Too much data for a single dictzip member')
+        if chunk_sizes:
+            # An empty final block ends the deflate stream
+            body.write(b'\x03\x00')
+            chunk_sizes[-1] += 2
+
+        ra = struct.pack('<HHH', 1, DICTZIP_CHUNK_LENGTH, len(chunk_sizes)) + \
+            b''.join(struct.pack('<H', size) for size in chunk_sizes)
+        extra = b'RA' + struct.pack('<H', len(ra)) + ra
+        body.seek(0)
+        with open(filename, 'wb') as out:
+            out.write(b'\x1f\x8b\x08\x04' + struct.pack('<I', 0) + b'\x02\x03' +
+                      struct.pack('<H', len(extra)) + extra)
+            shutil.copyfileobj(body, out)
+            out.write(struct.pack('<II', crc, length & 0xffffffff))
+
+
+def generate_dictionary(dirpath, entries, idx_gz=False, dictzip=False, syn=True, sametypesequence='m', seed=0,
+                        name=None):
+    """Write a StarDict dictionary.
+
+    Arguments:
+    - `dirpath`: the dictionary directory, created if needed.
+    - `entries`: the number of headwords.
+    - `idx_gz`: write a gzipped .idx.gz file.
+    - `dictzip`: write a dictzip .dict.dz file.
+    - `syn`: write a .syn file, with a synonym for one entry in SYN_INTERVAL.
+    - `sametypesequence`: the sametypesequence of the dictionary, None or '' for none.
+    - `seed`: the random seed.
+    - `name`: the file names, by default the directory name.
+    Return:
+    The dictionary directory.
+    """
+    os.makedirs(dirpath, exist_ok=True)
+    name = name or os.path.basename(os.path.normpath(dirpath))
+    basepath = os.path.join(dirpath, name)
+    rng = random.Random(seed + 1)
+
+    dict_filename = basepath + '.dict'
+    idx_file = gzip.open(basepath + '.idx.gz', 'wb') if idx_gz else open(basepath + '.idx', 'wb')
+    syn_file = open(basepath + '.syn', 'wb') if syn else None
+    idx_size = 0
+    syn_count = 0
+    offset = 0
+    try:
+        with open(dict_filename, 'wb') as dict_file:
+            for number, word in enumerate(iter_headwords(entries, seed)):
+                data = encode_entry(rng, word, sametypesequence)
+                dict_file.write(data)
+                record = word.encode('utf-8') + b'\x00' + struct.pack('!II', offset, len(data))
+                idx_file.write(record)
+                idx_size += len(record)
+                offset += len(data)
+                if syn_file and number % SYN_INTERVAL == 0:
+                    syn_file.write((word.lower() + '-syn').encode('utf-8') + b'\x00' + struct.pack('!I', number))
+                    syn_count += 1
+    finally:
+        idx_file.close()
+        if syn_file:
+            syn_file.close()
+
+    if dictzip:
+        write_dictzip(dict_filename + '.dz', dict_filename)
+        os.remove(dict_filename)
+
+    with open(basepath + '.ifo', 'w', encoding='utf-8') as f:
+        f.write("StarDict's dict ifo file\n")
+        f.write('version=2.4.2\n')
+        f.write('wordcount={:d}\n'.format(entries))
+        if syn:
+            f.write('synwordcount={:d}\n'.format(syn_count))
+        f.write('idxfilesize={:d}\n'.format(idx_size))
+        f.write('bookname={}\n'.format(name))
+        if sametypesequence:
+            f.write('sametypesequence={}\n'.format(sametypesequence))
+    return dirpath
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic StarDict dictionary.')
+    parser.add_argument('dirpath')
+    parser.add_argument('entries', type=int)
+    parser.add_argument('--idx-gz', action='store_true')
+    parser.add_argument('--dictzip', action='store_true')
+    parser.add_argument('--no-syn', action='store_true')
+    parser.add_argument('--sametypesequence', default='m', help="'' for none")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_dictionary(args.dirpath, args.entries, idx_gz=args.idx_gz, dictzip=args.dictzip,
+                        syn=not args.no_syn, sametypesequence=args.sametypesequence, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
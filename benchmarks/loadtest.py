@@ -0,0 +1,115 @@
+"""Load test of a running lookup server (see server.py).
+
+Usage: python -m benchmarks.loadtest [--url http://127.0.0.1:8080] [--connections 16] [--requests 10000]
+
+Opens keep-alive connections, sends /lookup requests for words taken from /complete (or from --words,
+one word per line) and prints the throughput and latency percentiles as json.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote, urlsplit
+
+
+async def request(reader, writer, host, target):
+    """Send a GET request on a kept-alive connection.
+
+    Return:
+    (status, body)
+    """
+    writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(
+        target, host).encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, colon, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def fetch_words(host, port, count):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        status, body = await request(reader, writer, host, '/complete?limit={:d}'.format(count))
+    finally:
+        writer.close()
+    return [completion['word'] for completion in json.loads(body)['completions']]
+
+
+async def worker(host, port, targets, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while targets:
+            target = targets.pop()
+            start_time = time.perf_counter()
+            status, body = await request(reader, writer, host, target)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run(url, connections, requests, words_filename, seed):
+    split_url = urlsplit(url)
+    host, port = split_url.hostname, split_url.port or 80
+    if words_filename:
+        with open(words_filename, encoding='utf-8') as f:
+            words = [line.strip() for line in f if line.strip()]
+    else:
+        words = await fetch_words(host, port, 10000)
+    if not words:
+        raise SystemExit('No words to look up')
+
+    rng = random.Random(seed)
+    targets = ['/lookup?word=' + quote(rng.choice(words))
+               for i in range(requests)]
+    latencies = []
+    errors = []
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, targets, latencies, errors) for i in range(connections)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'connections': connections,
+        'errors': len(errors),
+        'elapsed_s': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p90_ms': percentile(latencies, 0.90),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test a running lookup server.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--words', default=None,
+                        help='file of words to look up, one per line')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.connections,
+          args.requests, args.words, args.seed)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
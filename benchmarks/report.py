@@ -0,0 +1,122 @@
+"""Benchmark of the HTML report rendering modes against the number of entries.
+
+Usage: python -m benchmarks.report [--counts 1000,10000,100000] [--modes render,stream,paginated] [--output results.json]
+
+Modes:
+- render: Template.render into one string, written at once (html_convertor.build_report).
+- stream: html_convertor.stream_report into a single file.
+- paginated: html_convertor.stream_report into pages of --page-size entries.
+Each measure runs in its own process and reports the rendering time and the peak resident memory.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import make_definition
+from benchmarks.run import REPOSITORY_DIRPATH, get_commit, peak_rss
+
+MODES = ('render', 'stream', 'paginated')
+
+
+def iter_entries(count, seed=0):
+    """Generate report entries (header, definition).
+
+    """
+    rng = random.Random(seed)
+    for number in range(count):
+        word = 'word{:d}'.format(number)
+        yield word, make_definition(rng, word)
+
+
+def measure(mode, count, page_size, seed):
+    """Render a report in the current process.
+
+    Return:
+    A dictionary of the measures.
+    """
+    from html_output.html_convertor import env, stream_report
+
+    results = {'baseline_rss_bytes': peak_rss()}
+    with tempfile.TemporaryDirectory() as dirpath:
+        filename = os.path.join(dirpath, 'report.html')
+        start_time = time.perf_counter()
+        if mode == 'render':
+            template = env.get_template('report.html')
+            with open(filename, mode='w', encoding='utf8') as f:
+                f.write(template.render(text=iter_entries(count, seed)))
+            filenames = [filename]
+        else:
+            filenames = stream_report(iter_entries(count, seed), filename,
+                                      page_size=page_size if mode == 'paginated' else None)
+        results['time_s'] = time.perf_counter() - start_time
+        results['files'] = len(filenames)
+        results['output_bytes'] = sum(os.path.getsize(name) for name in filenames)
+    results['peak_rss_bytes'] = peak_rss()
+    return results
+
+
+def run_measure(mode, count, page_size, seed):
+    arguments = json.dumps([mode, count, page_size, seed])
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.report', '--child', arguments],
+                             cwd=REPOSITORY_DIRPATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        lines = process.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        return {'error': lines[-1] if lines else 'exit status {:d}'.format(process.returncode)}
+    return json.loads(process.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HTML report rendering modes.')
+    parser.add_argument('--counts', default='1000,10000,100000',
+                        help='comma separated numbers of entries')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='comma separated modes among {}'.format(', '.join(MODES)))
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='json file of the results, printed by default')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*json.loads(args.child))))
+        return
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('Unknown mode {}'.format(mode))
+    results = []
+    for count in [int(count) for count in args.counts.split(',')]:
+        for mode in modes:
+            print('Measuring {} with {:d} entries'.format(mode, count), file=sys.stderr)
+            result = {'mode': mode, 'entries': count}
+            result.update(run_measure(mode, count, args.page_size, args.seed))
+            results.append(result)
+    report = {
+        'meta': {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'page_size': args.page_size,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
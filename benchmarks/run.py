@@ -0,0 +1,193 @@
+"""Performance benchmark suite on synthetic dictionaries (see benchmarks/generate.py).
+
+Usage: python -m benchmarks.run [--sizes 10000,100000] [--variants plain,compressed,nosts] [--output results.json]
+
+Each measure runs in its own process, so that load times and peak RSS are not affected by the previous ones.
+For every dictionary variant, size and index reader (original or compact), it reports:
+- load_time_s: Dictionary construction time.
+- load_peak_rss_bytes: peak resident memory of the process once the dictionary is loaded.
+- lookup_p50_ms, lookup_p99_ms: DictFileReader.get_dict_by_word latency (one sample in ten misses).
+- build_search_index_s: StarDict._build_search_index time.
+- batch_words_per_s: StarDict.lookup_many throughput.
+- peak_rss_bytes: peak resident memory of the whole measure.
+Generated dictionaries are kept in the data directory and reused by the next runs.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate_dictionary
+
+REPOSITORY_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: generate_dictionary arguments
+VARIANTS = {
+    'plain': dict(sametypesequence='m'),
+    'compressed': dict(idx_gz=True, dictzip=True, sametypesequence='tm'),
+    'nosts': dict(sametypesequence=None),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(dictionary_path, compact_index, samples, batch_size, seed):
+    """Run the measures of one dictionary, in the current process.
+
+    Return:
+    A dictionary of the measures.
+    """
+    from app import StarDict, DictionarySettings
+    from stardict import Dictionary
+
+    results = {}
+    start_time = time.perf_counter()
+    dictionary = Dictionary(dictionary_path, compact_index=compact_index)
+    results['load_time_s'] = time.perf_counter() - start_time
+    results['load_peak_rss_bytes'] = peak_rss()
+
+    rng = random.Random(seed)
+    # The entries of the .idx file: the wordcount of the .ifo file may be missing or wrong
+    count = len(dictionary.idx_reader)
+    words = []
+    for i in range(samples):
+        word_str = dictionary.idx_reader.get_index_by_num(rng.randrange(count))[0]
+        words.append(word_str + '#' if i % 10 == 9 else word_str)
+
+    latencies = []
+    for word_str in words:
+        start_time = time.perf_counter()
+        dictionary.dict_reader.get_dict_by_word(word_str)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+    results['lookup_p50_ms'] = percentile(latencies, 0.50)
+    results['lookup_p99_ms'] = percentile(latencies, 0.99)
+    del dictionary
+
+    with tempfile.TemporaryDirectory() as settings_dirpath:
+        name = os.path.basename(dictionary_path)
+        for filename in ('installed_dictionaries_settings.txt', 'index_group_settings.txt',
+                         'text_capture_group_settings.txt'):
+            with open(os.path.join(settings_dirpath, filename), mode='w', encoding='utf-8') as f:
+                f.write('{} 1 0\n'.format(name))
+        settings = DictionarySettings(os.path.dirname(dictionary_path), settings_dirpath)
+        stardict = StarDict(settings, compact_index=compact_index)
+
+    start_time = time.perf_counter()
+    stardict._build_search_index()
+    results['build_search_index_s'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for i in range(0, len(words), batch_size):
+        stardict.lookup_many(words[i:i + batch_size])
+    elapsed = time.perf_counter() - start_time
+    results['batch_words_per_s'] = len(words) / elapsed if elapsed else 0.0
+    results['peak_rss_bytes'] = peak_rss()
+    return results
+
+
+def run_measure(dictionary_path, compact_index, samples, batch_size, seed):
+    """Run the measures of one dictionary in a new process.
+
+    """
+    arguments = json.dumps([dictionary_path, compact_index, samples, batch_size, seed])
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--child', arguments],
+                             cwd=REPOSITORY_DIRPATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        lines = process.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        return {'error': lines[-1] if lines else 'exit status {:d}'.format(process.returncode)}
+    return json.loads(process.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIRPATH,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, variants, data_dirpath, samples, batch_size, seed, readers):
+    results = []
+    for variant in variants:
+        for size in sizes:
+            dictionary_path = os.path.join(data_dirpath, '{}-{:d}-{:d}'.format(variant, size, seed))
+            if not os.path.exists(os.path.join(dictionary_path, os.path.basename(dictionary_path) + '.ifo')):
+                print('Generating {}'.format(dictionary_path), file=sys.stderr)
+                generate_dictionary(dictionary_path, size, seed=seed, **VARIANTS[variant])
+            for compact_index in readers:
+                print('Measuring {} ({} index)'.format(dictionary_path, 'compact' if compact_index else 'original'),
+                      file=sys.stderr)
+                result = {'variant': variant, 'entries': size, 'compact_index': compact_index}
+                result.update(run_measure(dictionary_path, compact_index, samples, batch_size, seed))
+                results.append(result)
+    return {
+        'meta': {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'samples': samples,
+            'batch_size': batch_size,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dictionary readers on synthetic dictionaries.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated numbers of entries')
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help='comma separated variants among {}'.format(', '.join(VARIANTS)))
+    parser.add_argument('--readers', default='original,compact',
+                        help='comma separated index readers among original, compact')
+    parser.add_argument('--data-dir', default='./benchmark_data',
+                        help='directory of the generated dictionaries')
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='number of looked up words')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='json file of the results, printed by default')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*json.loads(args.child))))
+        return
+
+    variants = args.variants.split(',')
+    for variant in variants:
+        if variant not in VARIANTS:
+            parser.error('Unknown variant {}'.format(variant))
+    readers = [reader == 'compact' for reader in args.readers.split(',')]
+    report = run([int(size) for size in args.sizes.split(',')], variants, os.path.abspath(args.data_dir),
+                 args.samples, args.batch_size, args.seed, readers)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
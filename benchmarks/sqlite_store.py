@@ -0,0 +1,189 @@
+"""Benchmark of the SQLite store (see sqlite_store.py) against the in-memory readers.
+
+Usage: python -m benchmarks.sqlite_store [--sizes 10000,100000] [--readers original,compact,sqlite] [--workers 4]
+[--output results.json]
+
+For each size and reader, --workers processes load the same dictionary at the same time and look up the same
+words, as the workers of a server would. Each reports:
+- load_time_s: Dictionary (or SqliteDictionary) construction time.
+- rss_bytes, pss_bytes, private_bytes: resident memory once the lookups are done. Shared pages (the memory-mapped
+files) count fully in rss, split between the processes mapping them in pss, and not in private (Linux only).
+- lookup_p50_ms, lookup_p99_ms: get_dict_by_word latency (one sample in ten misses).
+The results hold the mean of the workers, and the store import time.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.generate import generate_dictionary
+from benchmarks.run import REPOSITORY_DIRPATH, VARIANTS, get_commit, peak_rss, percentile
+
+READERS = ('original', 'compact', 'sqlite')
+
+
+def get_process_memory():
+    """Get the resident memory of the current process.
+
+    Return:
+    A dictionary {'rss_bytes', 'pss_bytes', 'private_bytes'}, the last two being None when /proc is missing.
+    """
+    memory = {'rss_bytes': peak_rss(), 'pss_bytes': None, 'private_bytes': None}
+    try:
+        with open('/proc/self/smaps_rollup', encoding='ascii') as f:
+            fields = {}
+            for line in f:
+                name, colon, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0]) * 1024
+    except OSError:
+        return memory
+    memory['rss_bytes'] = fields.get('Rss', memory['rss_bytes'])
+    memory['pss_bytes'] = fields.get('Pss')
+    memory['private_bytes'] = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return memory
+
+
+def measure(dictionary_path, reader, store_filename, samples, seed):
+    """Load a dictionary and look words up in the current process.
+
+    Return:
+    A dictionary of the measures.
+    """
+    from sqlite_store import SqliteDictionary
+    from stardict import Dictionary
+
+    results = {}
+    start_time = time.perf_counter()
+    if reader == 'sqlite':
+        dictionary = SqliteDictionary(dictionary_path, store_filename)
+    else:
+        dictionary = Dictionary(dictionary_path, compact_index=reader == 'compact', use_package=False)
+    results['load_time_s'] = time.perf_counter() - start_time
+
+    rng = random.Random(seed)
+    # The entries of the .idx file: the wordcount of the .ifo file may be missing or wrong
+    count = len(dictionary.idx_reader)
+    words = []
+    for i in range(samples):
+        word_str = dictionary.idx_reader.get_index_by_num(rng.randrange(count))[0]
+        words.append(word_str + '#' if i % 10 == 9 else word_str)
+
+    latencies = []
+    for word_str in words:
+        start_time = time.perf_counter()
+        for entry in dictionary.dict_reader.get_dict_by_word(word_str):
+            # Decode the fields, as a caller would
+            dict(entry)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+    results['lookup_p50_ms'] = percentile(latencies, 0.50)
+    results['lookup_p99_ms'] = percentile(latencies, 0.99)
+    results.update(get_process_memory())
+    return results
+
+
+def run_workers(dictionary_path, reader, store_filename, workers, samples, seed):
+    """Run the measures in concurrent worker processes.
+
+    Return:
+    The mean of the measures of the workers.
+    """
+    arguments = json.dumps([dictionary_path, reader, store_filename, samples, seed])
+    processes = [subprocess.Popen([sys.executable, '-m', 'benchmarks.sqlite_store', '--child', arguments],
+                                  cwd=REPOSITORY_DIRPATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                 for number in range(workers)]
+    results = []
+    for process in processes:
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            lines = stderr.decode('utf-8', errors='replace').strip().splitlines()
+            return {'error': lines[-1] if lines else 'exit status {:d}'.format(process.returncode)}
+        results.append(json.loads(stdout.decode('utf-8').strip().splitlines()[-1]))
+    mean = {}
+    for name in results[0]:
+        values = [result[name] for result in results if result[name] is not None]
+        mean[name] = sum(values) / len(values) if values else None
+    return mean
+
+
+def run(sizes, variant, readers, data_dirpath, workers, samples, seed):
+    from sqlite_store import get_store_filename, import_dictionary
+
+    results = []
+    for size in sizes:
+        dictionary_path = os.path.join(data_dirpath, '{}-{:d}-{:d}'.format(variant, size, seed))
+        if not os.path.exists(os.path.join(dictionary_path, os.path.basename(dictionary_path) + '.ifo')):
+            print('Generating {}'.format(dictionary_path), file=sys.stderr)
+            generate_dictionary(dictionary_path, size, seed=seed, **VARIANTS[variant])
+        store_filename = get_store_filename(data_dirpath, os.path.basename(dictionary_path))
+        import_time = None
+        if 'sqlite' in readers:
+            print('Importing {}'.format(dictionary_path), file=sys.stderr)
+            start_time = time.perf_counter()
+            import_dictionary(dictionary_path, store_filename)
+            import_time = time.perf_counter() - start_time
+        for reader in readers:
+            print('Measuring {} ({} reader, {:d} workers)'.format(dictionary_path, reader, workers), file=sys.stderr)
+            result = {'variant': variant, 'entries': size, 'reader': reader, 'workers': workers}
+            if reader == 'sqlite':
+                result['import_time_s'] = import_time
+                result['store_bytes'] = os.path.getsize(store_filename)
+            result.update(run_workers(dictionary_path, reader, store_filename, workers, samples, seed))
+            results.append(result)
+    return {
+        'meta': {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'samples': samples,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite store against the in-memory readers.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated numbers of entries')
+    parser.add_argument('--variant', default='plain', choices=sorted(VARIANTS))
+    parser.add_argument('--readers', default=','.join(READERS),
+                        help='comma separated readers among {}'.format(', '.join(READERS)))
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of concurrent worker processes')
+    parser.add_argument('--data-dir', default='./benchmark_data',
+                        help='directory of the generated dictionaries and of their stores')
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='number of looked up words per worker')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='json file of the results, printed by default')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*json.loads(args.child))))
+        return
+
+    readers = args.readers.split(',')
+    for reader in readers:
+        if reader not in READERS:
+            parser.error('Unknown reader {}'.format(reader))
+    report = run([int(size) for size in args.sizes.split(',')], args.variant, readers,
+                 os.path.abspath(args.data_dir), args.workers, args.samples, args.seed)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,42 @@
+import mmap
 import os
+import unicodedata
+
+
+def map_file(filename):
+    """Memory-map a file read-only.
+
+    Arguments:
+    - `filename`: the file to map.
+    Return:
+    A read-only mmap object, or an empty bytes object for an empty file (which cannot be mapped).
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def fold_word(word):
+    """Fold a word for case- and diacritic-insensitive comparison.
+
+    Arguments:
+    - `word`: the word.
+    Return:
+    The word case-folded, without combining marks: "Übermaß" gives "ubermass".
+    """
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+PACKAGE_EXT = '.sdpkg'
 
 
 def find_dictionary_filepaths(dictionary_path):
     dictionary_path = os.path.abspath(dictionary_path)
+    if os.path.isfile(dictionary_path) and dictionary_path.endswith(PACKAGE_EXT):
+        # A dictionary package alone
+        return {'package': dictionary_path}
     if not os.path.isdir(dictionary_path):
         return None
 
@@ -29,10 +63,27 @@ def find_dictionary_filepaths(dictionary_path):
             filepaths['dict.dz'] = is_compressed
         elif ext == '.syn':
             filepaths['syn'] = filepath
+        elif ext == PACKAGE_EXT and not is_compressed:
+            filepaths['package'] = filepath
+        # Resource storage: a res.rifo, res.ridx and res.rdic database, or a res/ directory
+        elif ext == '.rifo':
+            filepaths['rifo'] = filepath
+        elif ext == '.ridx':
+            filepaths['ridx'] = filepath
+            filepaths['ridx.gz'] = is_compressed
+        elif ext == '.rdic':
+            filepaths['rdic'] = filepath
+            filepaths['rdic.dz'] = is_compressed
+        elif filename == 'res' and os.path.isdir(filepath):
+            filepaths['res'] = filepath
 
     # Not a valid dictionary
     if not('ifo' in filepaths and 'idx' in filepaths and 'dict' in filepaths):
-        return None
+        if 'package' not in filepaths:
+            return None
+        # Only the package is usable
+        for ext in ('ifo', 'idx', 'idx.gz', 'dict', 'dict.dz', 'syn'):
+            filepaths.pop(ext, None)
 
     return filepaths
 
@@ -0,0 +1,173 @@
+import struct
+import zlib
+from array import array
+from dictutils import map_file
+from lrucache import LRUCache
+
+# gzip header flags
+FTEXT = 0x01
+FHCRC = 0x02
+FEXTRA = 0x04
+FNAME = 0x08
+FCOMMENT = 0x10
+
+DEFAULT_CACHE_SIZE = 4 * 1024 * 1024
+
+
+class DictzipFileException(Exception):
+    """Exception while parsing the header of a dictzip file.
+    Raised when the file is not gzip compressed or has no random access (RA) chunk table.
+    """
+
+    def __init__(self, description="DictzipFileException raised"):
+        """Constructor from a description string.
+
+        Arguments:
+        - `description`: a string describing the exception condition.
+        """
+        self._description = description
+
+    def __str__(self):
+        """__str__ method, return the description of exception occured.
+
+        """
+        return self._description
+
+
+class ChunkedFile(object):
+    """Random access reader of data compressed in chunks of a fixed uncompressed length, each one a raw deflate
+    stream that can be inflated on its own.
+    Only the chunks covering a requested range are decompressed; decompressed chunks are kept in a LRU
+    cache bounded by `cache_size` bytes.
+    """
+
+    def __init__(self, content, chunk_offsets, chunk_length, cache_size=DEFAULT_CACHE_SIZE):
+        """Constructor.
+
+        Arguments:
+        - `content`: bytes-like object (usually a mmap) holding the chunks.
+        - `chunk_offsets`: array of the positions of the chunks in `content`, chunk i being stored in
+        content[chunk_offsets[i]:chunk_offsets[i + 1]].
+        - `chunk_length`: the uncompressed length of every chunk but the last one.
+        - `cache_size`: the budget in bytes of the decompressed chunk cache.
+        """
+        self._content = content
+        self._chunk_offsets = chunk_offsets
+        self._chunk_length = chunk_length
+        self._cache = LRUCache(cache_size)
+
+    def _inflate(self, number):
+        compressed = self._content[
+            self._chunk_offsets[number]:self._chunk_offsets[number + 1]]
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+
+    def _get_chunk(self, number):
+        chunk = self._cache.get(number)
+        if chunk is None:
+            chunk = self._inflate(number)
+            self._cache.put(number, chunk)
+        return chunk
+
+    def cache_stats(self):
+        """Get the usage counters of the decompressed chunk cache, see LRUCache.stats.
+
+        """
+        return self._cache.stats()
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader.
+
+        Return:
+        A dictionary {'heap_bytes': size of the chunk table and of the cached chunks, 'mapped_bytes': size of
+        the mapped compressed data}.
+        """
+        return {'heap_bytes': len(self._chunk_offsets) * self._chunk_offsets.itemsize + self._cache.resident_bytes,
+                'mapped_bytes': len(self._content)}
+
+    def read(self, offset, size):
+        """Read decompressed data.
+
+        Arguments:
+        - `offset`: offset of the data in the decompressed file.
+        - `size`: size of the data.
+        Return:
+        The data as bytes, truncated if the range goes past the end of the file.
+        """
+        if size <= 0:
+            return b''
+        first = offset // self._chunk_length
+        last = min((offset + size - 1) // self._chunk_length,
+                   len(self._chunk_offsets) - 2)
+        if first > last:
+            return b''
+        start = offset - first * self._chunk_length
+        if first == last:
+            return self._get_chunk(first)[start:start + size]
+        data = b''.join(self._get_chunk(number)
+                        for number in range(first, last + 1))
+        return data[start:start + size]
+
+
+class DictzipFile(ChunkedFile):
+    """Random access reader of a .dict.dz file.
+    dictzip compresses the data in chunks of a fixed uncompressed length, each one flushed so that it can be
+    inflated on its own, and stores the compressed length of every chunk in the "RA" subfield of the gzip FEXTRA
+    header.
+    """
+
+    def __init__(self, filename, cache_size=DEFAULT_CACHE_SIZE):
+        """Constructor.
+        May raise DictzipFileException if the file has no RA chunk table.
+
+        Arguments:
+        - `filename`: filename of the .dict.dz file.
+        - `cache_size`: the budget in bytes of the decompressed chunk cache.
+        """
+        content = map_file(filename)
+        if content[:3] != b'\x1f\x8b\x08':
+            raise DictzipFileException(
+                "{!r:s} is not a gzip file!".format(filename))
+        flags = content[3]
+        if not flags & FEXTRA:
+            raise DictzipFileException(
+                "No FEXTRA field in {!r:s}!".format(filename))
+
+        # Locate the RA subfield in the extra field
+        extra_length, = struct.unpack("<H", content[10:12])
+        offset = 12
+        extra_end = offset + extra_length
+        chunk_length = None
+        while offset + 4 <= extra_end:
+            subfield_id = content[offset:offset + 2]
+            subfield_length, = struct.unpack(
+                "<H", content[offset + 2:offset + 4])
+            offset += 4
+            if subfield_id == b'RA':
+                version, chunk_length, chunk_count = struct.unpack(
+                    "<HHH", content[offset:offset + 6])
+                chunk_sizes = struct.unpack(
+                    "<{:d}H".format(chunk_count), content[offset + 6:offset + 6 + 2 * chunk_count])
+                break
+            offset += subfield_length
+        if chunk_length is None:
+            raise DictzipFileException(
+                "No RA chunk table in {!r:s}!".format(filename))
+        if version != 1:
+            raise DictzipFileException(
+                "RA version expected to be 1, but {:d} read!".format(version))
+
+        # Skip the rest of the header
+        offset = extra_end
+        if flags & FNAME:
+            offset = content.find(b'\x00', offset) + 1
+        if flags & FCOMMENT:
+            offset = content.find(b'\x00', offset) + 1
+        if flags & FHCRC:
+            offset += 2
+
+        # Chunk i is stored in content[chunk_offsets[i]:chunk_offsets[i + 1]]
+        chunk_offsets = array("Q", [offset])
+        for chunk_size in chunk_sizes:
+            offset += chunk_size
+            chunk_offsets.append(offset)
+        super().__init__(content, chunk_offsets, chunk_length, cache_size)
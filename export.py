@@ -0,0 +1,163 @@
+"""Exporter of StarDict dictionaries to JSON Lines or tab-separated text.
+
+Usage: python export.py PATH [--format jsonl|tsv] [--output FILE] [--processes N] [--range-size 20000]
+
+The entries are written in .idx file order, as read by Dictionary.iter_entries, one per line:
+- jsonl: {"number": origin index, "word": headword, "synonyms": [...], "entry": {type identifier: data}}, the
+binary fields (W for sounds, P for pictures...) base64 encoded.
+- tsv: headword|synonym|synonym<TAB>definition, the definition being the text fields separated by newlines.
+Backslashes, tabs and newlines are escaped as \\\\, \\t and \\n; binary fields are left out.
+
+With --processes, ranges of --range-size entries are formatted by worker processes, each opening the dictionary,
+and written in order: the output is the same as with a single process.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import sys
+import time
+from stardict import Dictionary, DEFAULT_ITER_BATCH_SIZE
+
+FORMATS = ('jsonl', 'tsv')
+DEFAULT_RANGE_SIZE = 20000
+# Size of the output buffer
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def format_jsonl(number, word_str, entry, synonyms):
+    """Format an entry as a JSON line.
+
+    Return:
+    The line, with its newline.
+    """
+    fields = {}
+    for type_identifier, value in entry.items():
+        if isinstance(value, str):
+            fields[type_identifier] = value
+        else:
+            fields[type_identifier] = base64.b64encode(value).decode('ascii')
+    return _json_encode({'number': number, 'word': word_str, 'synonyms': synonyms, 'entry': fields}) + '\n'
+
+
+def format_tsv(number, word_str, entry, synonyms):
+    """Format an entry as a tab-separated line.
+
+    Return:
+    The line, with its newline.
+    """
+    words = '|'.join([word_str] + synonyms).translate(TSV_ESCAPES)
+    definition = '\n'.join(value for value in entry.values() if isinstance(value, str)).translate(TSV_ESCAPES)
+    return words + '\t' + definition + '\n'
+
+
+FORMATTERS = {'jsonl': format_jsonl, 'tsv': format_tsv}
+
+
+def format_entries(dictionary, output_format, start=0, stop=None):
+    """Format a range of entries.
+
+    Arguments:
+    - `dictionary`: stardict.Dictionary object.
+    - `output_format`: one of FORMATS.
+    - `start`, `stop`: the range of origin indexes, see Dictionary.iter_entries.
+    Return:
+    An iterator of lines.
+    """
+    formatter = FORMATTERS[output_format]
+    for number, word_str, entry, synonyms in dictionary.iter_entries(start, stop):
+        yield formatter(number, word_str, entry, synonyms)
+
+
+# Dictionary and format of a worker process, set by _init_worker
+_worker_state = None
+
+
+def _init_worker(dictionary_path, output_format):
+    global _worker_state
+    _worker_state = (Dictionary(dictionary_path, compact_index=True), output_format)
+
+
+def _format_range(bounds):
+    """Format a range of entries in a worker process.
+
+    Return:
+    A tuple (text of the lines, number of lines).
+    """
+    dictionary, output_format = _worker_state
+    lines = list(format_entries(dictionary, output_format, *bounds))
+    return ''.join(lines), len(lines)
+
+
+def export_dictionary(dictionary_path, output, output_format='jsonl', processes=1, range_size=DEFAULT_RANGE_SIZE):
+    """Write all the entries of a dictionary.
+
+    Arguments:
+    - `dictionary_path`: the dictionary directory.
+    - `output`: text file object, preferably buffered (see OUTPUT_BUFFER_SIZE).
+    - `output_format`: one of FORMATS.
+    - `processes`: the number of worker processes, 1 to format the entries in the calling process.
+    - `range_size`: the number of entries formatted at once by a worker process.
+    Return:
+    The number of entries written.
+    """
+    dictionary = Dictionary(dictionary_path, compact_index=True)
+    # The .idx file rather than the wordcount of the .ifo file, which may be missing or wrong
+    count = len(dictionary.idx_reader)
+    if processes <= 1:
+        written = 0
+        lines = []
+        for line in format_entries(dictionary, output_format):
+            lines.append(line)
+            if len(lines) >= DEFAULT_ITER_BATCH_SIZE:
+                output.writelines(lines)
+                written += len(lines)
+                lines.clear()
+        output.writelines(lines)
+        return written + len(lines)
+    dictionary.close()
+    ranges = [(start, min(start + range_size, count)) for start in range(0, count, range_size)]
+    written = 0
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(dictionary_path, output_format)) as pool:
+        for text, range_count in pool.imap(_format_range, ranges):
+            output.write(text)
+            written += range_count
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a StarDict dictionary to JSON Lines or tab-separated text.')
+    parser.add_argument('path', help='dictionary directory')
+    parser.add_argument('--format', default='jsonl', choices=FORMATS)
+    parser.add_argument('--output', default='-',
+                        help='output file, - for the standard output')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of worker processes formatting the entries')
+    parser.add_argument('--range-size', type=int, default=DEFAULT_RANGE_SIZE,
+                        help='number of entries formatted at once by a worker process')
+    args = parser.parse_args()
+    if args.processes <= 0 or args.range_size <= 0:
+        parser.error('The number of processes and the range size must be positive')
+
+    start_time = time.perf_counter()
+    if args.output == '-':
+        output = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE,
+                      closefd=False)
+    else:
+        output = open(args.output, mode='w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE)
+    with output:
+        try:
+            count = export_dictionary(args.path, output, args.format, args.processes, args.range_size)
+        except (OSError, ValueError) as e:
+            print('Cannot export {}: {}'.format(args.path, e), file=sys.stderr)
+            sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+    print('Exported {:d} entries in {:.2f}s ({:.0f} entries/s)'.format(
+        count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+import html
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from snapshot import read_snapshot, write_snapshot
+
+FULLTEXT_EXT = '.fulltext'
+FULLTEXT_VERSION = 1
+
+# Types of the indexed fields: the text types but the phonetic transcription (t) and the resource list (r)
+INDEXED_TYPES = "mgxykwhn"
+# Types whose data is markup: Pango, XDXF, KingSoft, MediaWiki, HTML
+MARKUP_TYPES = "gxkwh"
+TOKEN_PATTERN = re.compile(r"\w+")
+TAG_PATTERN = re.compile(r"<[^>]*>")
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+# Positions skipped between two fields of an entry, so that no phrase spans them
+FIELD_GAP = 1
+DEFAULT_BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    """Split a text into case-folded words.
+
+    Arguments:
+    - `text`: the text.
+    Return:
+    The list of the words.
+    """
+    return [match.group().casefold() for match in TOKEN_PATTERN.finditer(text)]
+
+
+def get_entry_texts(entry):
+    """Get the text of the indexed fields of an entry, without markup.
+
+    Arguments:
+    - `entry`: stardict.Entry object.
+    Return:
+    An iterator of strings.
+    """
+    for type_identifier in entry:
+        if type_identifier not in INDEXED_TYPES:
+            continue
+        text = entry[type_identifier]
+        if type_identifier in MARKUP_TYPES:
+            text = html.unescape(TAG_PATTERN.sub(' ', text))
+        yield text
+
+
+def encode_varint(value, data):
+    """Append an unsigned integer to a bytearray, 7 bits per byte, low bits first.
+
+    """
+    while value > 0x7f:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def decode_varints(data):
+    """Decode a sequence of integers written by encode_varint.
+
+    """
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        else:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+    return values
+
+
+def decode_postings(data):
+    """Decode the postings of a term.
+    Layout, in varints: for each entry, the difference with the previous entry number, the number of
+    positions, then the differences between consecutive positions (the first one from 0).
+
+    Arguments:
+    - `data`: the encoded postings.
+    Return:
+    A list of tuples (entry number, [position, ...]), by increasing entry number.
+    """
+    values = decode_varints(data)
+    postings = []
+    number = 0
+    i = 0
+    while i < len(values):
+        number += values[i]
+        count = values[i + 1]
+        positions = []
+        position = 0
+        for delta in values[i + 2:i + 2 + count]:
+            position += delta
+            positions.append(position)
+        postings.append((number, positions))
+        i += 2 + count
+    return postings
+
+
+class FullTextIndex(object):
+    """On-disk inverted index of the definitions of a dictionary, memory-mapped.
+    Words are case-folded (see tokenize); the markup of HTML, XDXF and the other markup types is stripped.
+    Each term maps to the entry numbers (origin indexes in .idx file) whose definitions contain it, with the
+    positions of the term in the entry, delta and varint encoded. Phrases are matched with the positions.
+    """
+
+    def __init__(self, snapshot):
+        """Constructor.
+
+        Arguments:
+        - `snapshot`: snapshot.SnapshotFile object written by FullTextIndexBuilder.
+        """
+        self._content = snapshot.content
+        self._terms_base = snapshot.get_offset('terms')
+        self._term_starts = snapshot.get_array('term_starts')
+        self._document_counts = snapshot.get_array('document_counts')
+        self._posting_offsets = snapshot.get_array('posting_offsets')
+        self._postings = snapshot.get_array('postings')
+        self.key = snapshot.key
+
+    @classmethod
+    def open(cls, filename, key):
+        """Open an index file if it is up to date.
+
+        Arguments:
+        - `filename`: the index filename.
+        - `key`: the key the index must have been written with, see FullTextIndexBuilder.
+        Return:
+        A FullTextIndex object, or None if the file is missing, unreadable or stale.
+        """
+        snapshot = read_snapshot(filename, key)
+        if snapshot is None:
+            return None
+        return cls(snapshot)
+
+    def __len__(self):
+        return len(self._term_starts) - 1
+
+    def _get_term(self, number):
+        start = self._terms_base + self._term_starts[number]
+        end = self._terms_base + self._term_starts[number + 1] - 1
+        return self._content[start:end]
+
+    def _find_term(self, term):
+        term = term.encode('utf-8')
+        number = bisect_left(range(len(self)), term, key=self._get_term)
+        if number < len(self) and self._get_term(number) == term:
+            return number
+        return -1
+
+    def get_document_count(self, term):
+        """Get the number of entries containing a term.
+
+        Arguments:
+        - `term`: the term, case-folded.
+        """
+        number = self._find_term(term)
+        return self._document_counts[number] if number >= 0 else 0
+
+    def get_postings(self, term):
+        """Get the postings of a term.
+
+        Arguments:
+        - `term`: the term, case-folded.
+        Return:
+        A list of tuples (entry number, [position, ...]), see decode_postings.
+        """
+        number = self._find_term(term)
+        if number < 0:
+            return []
+        return decode_postings(
+            self._postings[self._posting_offsets[number]:self._posting_offsets[number + 1]])
+
+    def find_word(self, word_str):
+        """Find the entries containing a word.
+
+        Arguments:
+        - `word_str`: the word. A text of several words is looked up as a phrase.
+        Return:
+        The list of the entry numbers, in increasing order.
+        """
+        terms = tokenize(word_str)
+        if len(terms) != 1:
+            return self.find_phrase(word_str)
+        return [number for number, positions in self.get_postings(terms[0])]
+
+    def find_phrase(self, phrase):
+        """Find the entries containing consecutive words.
+
+        Arguments:
+        - `phrase`: the words.
+        Return:
+        The list of the entry numbers, in increasing order.
+        """
+        terms = tokenize(phrase)
+        if not terms:
+            return []
+        # Start from the rarest term
+        order = sorted(range(len(terms)), key=lambda i: self.get_document_count(terms[i]))
+        candidates = None
+        term_postings = {}
+        for i in order:
+            if terms[i] not in term_postings:
+                term_postings[terms[i]] = dict(self.get_postings(terms[i]))
+            postings = term_postings[terms[i]]
+            candidates = set(postings) if candidates is None else candidates.intersection(postings)
+            if not candidates:
+                return []
+        numbers = []
+        for number in sorted(candidates):
+            starts = set(term_postings[terms[0]][number])
+            for i in range(1, len(terms)):
+                positions = set(term_postings[terms[i]][number])
+                starts = {start for start in starts if start + i in positions}
+                if not starts:
+                    break
+            if starts:
+                numbers.append(number)
+        return numbers
+
+    def search(self, query, limit=None):
+        """Find the entries matching a query: words, and phrases in double quotes, all of them required.
+
+        Arguments:
+        - `query`: the query, like: Haus "big house".
+        - `limit`: the maximum number of entries, or None for all of them.
+        Return:
+        The list of the entry numbers, in increasing order.
+        """
+        result = None
+        for match in QUERY_PATTERN.finditer(query):
+            if match.group(1) is not None:
+                numbers = self.find_phrase(match.group(1))
+            else:
+                numbers = self.find_word(match.group(2))
+            result = set(numbers) if result is None else result.intersection(numbers)
+            if not result:
+                return []
+        if result is None:
+            return []
+        result = sorted(result)
+        return result if limit is None else result[:limit]
+
+
+class FullTextIndexBuilder(threading.Thread):
+    """Build the FullTextIndex of a dictionary in a background thread.
+    Entries are read in batches, in .idx order, and their postings appended to per-term byte buffers, already
+    encoded, so the memory used stays close to the size of the index file. Progress is available in `done` and
+    `total`, and reported to `callback` after each batch. The index file is written at the end, aside and
+    renamed, so readers never see a partial index.
+    """
+
+    def __init__(self, dictionary, filename, batch_size=DEFAULT_BATCH_SIZE, callback=None):
+        """Constructor.
+
+        Arguments:
+        - `dictionary`: stardict.Dictionary object.
+        - `filename`: the index filename.
+        - `batch_size`: the number of entries read at once.
+        - `callback`: function called with (done, total) numbers of entries after each batch, from the
+        building thread.
+        """
+        super().__init__(name='fulltext-{}'.format(dictionary.name), daemon=True)
+        self.dictionary = dictionary
+        self.filename = filename
+        self.batch_size = batch_size
+        self.callback = callback
+        # Set once the building starts: counting the entries loads a lazy dictionary, which belongs to the
+        # building thread rather than to the caller of start()
+        self.total = None
+        self.done = 0
+        self.index = None
+        self.error = None
+        self._stop_event = threading.Event()
+
+    @property
+    def progress(self):
+        """The fraction of the entries indexed so far, from 0 to 1.
+
+        """
+        if self.total is None:
+            return 0.0
+        return self.done / self.total if self.total else 1.0
+
+    def stop(self):
+        """Stop building after the current batch; no index is written.
+
+        """
+        self._stop_event.set()
+
+    def run(self):
+        try:
+            self.index = self.build()
+        except Exception as e:
+            print('Cannot build the full-text index of {}: {}'.format(self.dictionary.name, e))
+            self.error = e
+
+    def build(self):
+        """Build the index in the calling thread.
+
+        Return:
+        The FullTextIndex object, or None if stopped.
+        """
+        dictionary = self.dictionary
+        key = dictionary.get_content_key(fulltext_version=FULLTEXT_VERSION)
+        # The entries of the .idx file, whatever the wordcount of the .ifo file says
+        self.total = len(dictionary.idx_reader)
+        # term: [encoded postings, last entry number, number of entries]
+        terms = {}
+        for first in range(0, self.total, self.batch_size):
+            if self._stop_event.is_set():
+                return None
+            numbers = range(first, min(first + self.batch_size, self.total))
+            locations = [dictionary.idx_reader.get_index_by_num(number)[1:] for number in numbers]
+            for number, entry in zip(numbers, dictionary.dict_reader.get_dicts_by_locations(locations)):
+                entry_positions = {}
+                position = 0
+                for text in get_entry_texts(entry):
+                    for term in tokenize(text):
+                        entry_positions.setdefault(term, []).append(position)
+                        position += 1
+                    position += FIELD_GAP
+                for term, positions in entry_positions.items():
+                    state = terms.get(term)
+                    if state is None:
+                        state = terms[term] = [bytearray(), 0, 0]
+                    data = state[0]
+                    encode_varint(number - state[1], data)
+                    encode_varint(len(positions), data)
+                    previous = 0
+                    for position in positions:
+                        encode_varint(position - previous, data)
+                        previous = position
+                    state[1] = number
+                    state[2] += 1
+            self.done = numbers.stop
+            if self.callback is not None:
+                self.callback(self.done, self.total)
+
+        sorted_terms = sorted((term.encode('utf-8'), state) for term, state in terms.items())
+        term_blob = bytearray()
+        term_starts = array('Q', [0])
+        document_counts = array('I')
+        postings = bytearray()
+        posting_offsets = array('Q', [0])
+        for term, (data, last_number, count) in sorted_terms:
+            term_blob += term
+            term_blob += b'\x00'
+            term_starts.append(len(term_blob))
+            document_counts.append(count)
+            postings += data
+            posting_offsets.append(len(postings))
+        write_snapshot(self.filename, key, {
+            'terms': term_blob, 'term_starts': term_starts, 'document_counts': document_counts,
+            'postings': postings, 'posting_offsets': posting_offsets})
+        return FullTextIndex.open(self.filename, key)
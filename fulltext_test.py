@@ -0,0 +1,114 @@
+"""Test of the full-text index of a dictionary.
+
+Usage: python fulltext_test.py
+
+The postings must decode to what was encoded. A small dictionary with two fields per entry, a plain text one and
+an HTML one, is indexed: words and phrases must be found without the markup, and no phrase may span two fields
+(FIELD_GAP). The builder must not load a lazy dictionary before it is started.
+"""
+import os
+import random
+import struct
+import tempfile
+from fulltext import FullTextIndexBuilder, FIELD_GAP, decode_postings, decode_varints, encode_varint
+from stardict import Dictionary
+
+# Headword, plain text field (m), HTML field (h), in .idx order
+ENTRIES = [
+    ('barn', 'red', '<b>big</b> house for animals'),
+    ('cottage', 'small house', 'a <i>red</i> roof'),
+    ('hut', 'red house', 'tiny &amp; wooden'),
+    ('villa', 'big house', 'a house by the sea'),
+]
+QUERIES = {
+    'house': ['barn', 'cottage', 'hut', 'villa'],
+    'HOUSE': ['barn', 'cottage', 'hut', 'villa'],
+    'red': ['barn', 'cottage', 'hut'],
+    '"red house"': ['hut'],
+    # "red" ends the first field of barn, "big" starts the second one
+    '"red big"': [],
+    '"big house"': ['barn', 'villa'],
+    'big "red house"': [],
+    'red "big house"': ['barn'],
+    '"house by the"': ['villa'],
+    'wooden': ['hut'],
+    # Markup is not indexed
+    'b': [],
+    'amp': [],
+    'missing': [],
+    '': [],
+}
+
+
+def check_postings():
+    rng = random.Random(0)
+    values = [0, 1, 127, 128, 16383, 16384, 2 ** 32, 2 ** 63] + [rng.randrange(2 ** 40) for i in range(1000)]
+    data = bytearray()
+    for value in values:
+        encode_varint(value, data)
+    assert decode_varints(data) == values
+    postings = []
+    number = 0
+    for i in range(200):
+        number += rng.randrange(1, 100000)
+        positions = sorted(rng.sample(range(100000), rng.randrange(1, 20)))
+        postings.append((number, positions))
+    data = bytearray()
+    previous_number = 0
+    for number, positions in postings:
+        encode_varint(number - previous_number, data)
+        encode_varint(len(positions), data)
+        previous = 0
+        for position in positions:
+            encode_varint(position - previous, data)
+            previous = position
+        previous_number = number
+    assert decode_postings(bytes(data)) == postings
+
+
+def make_dictionary(dirpath):
+    name = os.path.basename(dirpath)
+    os.makedirs(dirpath)
+    idx = bytearray()
+    offset = 0
+    with open(os.path.join(dirpath, name + '.dict'), 'wb') as f:
+        for word_str, text, markup in ENTRIES:
+            data = text.encode('utf-8') + b'\0' + markup.encode('utf-8')
+            f.write(data)
+            idx += word_str.encode('utf-8') + b'\0' + struct.pack('!II', offset, len(data))
+            offset += len(data)
+    with open(os.path.join(dirpath, name + '.idx'), 'wb') as f:
+        f.write(idx)
+    with open(os.path.join(dirpath, name + '.ifo'), 'w', encoding='utf-8') as f:
+        f.write("StarDict's dict ifo file\nversion=2.4.2\nbookname={}\nwordcount={:d}\nidxfilesize={:d}\n"
+                "sametypesequence=mh\n".format(name, len(ENTRIES), len(idx)))
+
+
+def check_index(dictionary_path, filename):
+    dictionary = Dictionary(dictionary_path, lazy=True, use_package=False)
+    builder = FullTextIndexBuilder(dictionary, filename)
+    assert not dictionary.loaded and builder.progress == 0.0
+    index = builder.build()
+    assert builder.total == len(ENTRIES) and builder.progress == 1.0
+    for query, expected in QUERIES.items():
+        words = [dictionary.idx_reader.get_index_by_num(number)[0] for number in index.search(query)]
+        assert words == expected, (query, words, expected)
+    # barn: "red" in the first field, then the gap, then "big house for animals"
+    assert index.get_postings('red')[0] == (0, [0])
+    assert index.get_postings('big')[0] == (0, [1 + FIELD_GAP])
+    assert index.get_document_count('house') == len(ENTRIES)
+    assert index.get_postings('house')[-1] == (3, [1, 3 + FIELD_GAP])
+    assert index.search('house', 2) == [0, 1]
+
+
+def main():
+    check_postings()
+    with tempfile.TemporaryDirectory() as dirpath:
+        dictionary_path = os.path.join(dirpath, 'houses')
+        make_dictionary(dictionary_path)
+        check_index(dictionary_path, os.path.join(dirpath, 'houses.fulltext'))
+    print('Postings round trip, and {:d} queries match'.format(len(QUERIES)))
+
+
+if __name__ == '__main__':
+    main()
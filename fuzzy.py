@@ -0,0 +1,143 @@
+from array import array
+from bisect import bisect_left
+
+
+def _next_prefix(prefix):
+    """Get the smallest string greater than all the strings starting with `prefix`.
+
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _walk(words, query, max_distance, split, split_distance):
+    """Find the words within a Levenshtein distance of `query` whose beginning matches query[:split]
+    within `split_distance`.
+    The sorted word list is walked as an implicit trie: words sharing a prefix are adjacent, so the dynamic
+    programming row of a prefix is computed once for all of them, and only for the cells of the diagonal band
+    that can stay within `max_distance`. As soon as a prefix can no longer match, all the words starting with
+    it are skipped with a binary search.
+
+    Return:
+    A list of tuples (distance, position of the word in `words`).
+    """
+    results = []
+    length = len(query)
+    over = max_distance + 1
+    # rows[d] is the distance row between the query and the first d characters of the current word,
+    # capped at `over`; matched[d] tells whether query[:split] was matched within split_distance.
+    rows = [[i if i <= max_distance else over for i in range(length + 1)]]
+    matched = [split_distance >= split]
+    previous_word = ''
+    position = 0
+    count = len(words)
+    while position < count:
+        word = words[position]
+        # Reuse the rows of the prefix shared with the previous word
+        depth = 0
+        last_depth = min(len(word), len(previous_word), len(rows) - 1)
+        while depth < last_depth and word[depth] == previous_word[depth]:
+            depth += 1
+        del rows[depth + 1:]
+        del matched[depth + 1:]
+
+        pruned = False
+        word_length = len(word)
+        while depth < word_length:
+            character = word[depth]
+            previous_row = rows[depth]
+            depth += 1
+            row = [over] * (length + 1)
+            low = depth - max_distance
+            high = min(depth + max_distance, length)
+            if low <= 0:
+                low = 1
+                value = row[0] = depth if depth <= max_distance else over
+            else:
+                value = over
+            best = value
+            split_best = value
+            for i in range(low, high + 1):
+                distance = previous_row[i - 1] + (query[i - 1] != character)
+                if value + 1 < distance:
+                    distance = value + 1
+                if previous_row[i] + 1 < distance:
+                    distance = previous_row[i] + 1
+                if distance > over:
+                    distance = over
+                row[i] = value = distance
+                if distance < best:
+                    best = distance
+                if i <= split and distance < split_best:
+                    split_best = distance
+            rows.append(row)
+            is_matched = matched[-1]
+            if not is_matched and split_best > split_distance:
+                pruned = True
+                break
+            matched.append(is_matched or row[split] <= split_distance)
+            if best > max_distance:
+                pruned = True
+                break
+
+        previous_word = word
+        if pruned:
+            # No word starting with word[:depth] can match
+            del rows[depth:]
+            del matched[depth:]
+            position = bisect_left(words, _next_prefix(
+                word[:depth]), position + 1)
+            continue
+        distance = rows[-1][length]
+        if distance <= max_distance:
+            results.append((distance, position))
+        position += 1
+    return results
+
+
+class FuzzyIndex(object):
+    """Index of a sorted word list for bounded edit distance search.
+    If a word is within distance k of a query, either the first half or the second half of the query is matched
+    within k // 2 errors. The words are searched twice, as an implicit trie (see _walk): forward with the first
+    half bound, and reversed with the second half bound, which prunes much closer to the root than a single
+    search within k errors.
+    """
+
+    def __init__(self, words, reversed_words=None, reversed_positions=None):
+        """Constructor.
+
+        Arguments:
+        - `words`: a sorted sequence of words.
+        - `reversed_words`: the words spelled backwards, sorted. Built if not given.
+        - `reversed_positions`: the position in `words` of the word each reversed word comes from.
+        """
+        self.words = words
+        if reversed_words is None:
+            reversed_words = [word[::-1] for word in words]
+            reversed_positions = array('I', sorted(
+                range(len(reversed_words)), key=reversed_words.__getitem__))
+            reversed_words = [reversed_words[position]
+                              for position in reversed_positions]
+        self.reversed_words = reversed_words
+        self.reversed_positions = reversed_positions
+
+    def search(self, query, max_distance=2, limit=None):
+        """Find the words within a Levenshtein distance (insertions, deletions and substitutions) of `query`.
+
+        Arguments:
+        - `query`: the word to look for.
+        - `max_distance`: the maximum edit distance.
+        - `limit`: the maximum number of results, or None for all of them.
+        Return:
+        A list of tuples (distance, position of the word in `words`), by increasing distance then position.
+        """
+        split = len(query) // 2
+        found = {position: distance for distance, position in _walk(
+            self.words, query, max_distance, split, max_distance // 2)}
+        for distance, position in _walk(self.reversed_words, query[::-1], max_distance,
+                                        len(query) - split, max_distance // 2):
+            found[self.reversed_positions[position]] = distance
+        results = sorted((distance, position)
+                         for position, distance in found.items())
+        if limit is not None:
+            del results[limit:]
+        return results
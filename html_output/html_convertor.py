@@ -1,3 +1,6 @@
+import io
+import os
+from itertools import islice
 from jinja2 import Environment, PackageLoader, select_autoescape
 
 
@@ -6,8 +9,117 @@ env = Environment(
     autoescape=select_autoescape(['html', 'xml'])
 )
 
+DEFAULT_REPORT_FILENAME = 'report.html'
+# Size of the write buffer of the report files
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
 
 def build_report(text):
     template = env.get_template('report.html')
-    with open('report.html', mode='w', encoding="utf8") as f:
+    with open(DEFAULT_REPORT_FILENAME, mode='w', encoding="utf8") as f:
         f.write(template.render(text=text))
+
+
+def get_page_filename(filename, number):
+    """Get the filename of a page of a paginated report.
+
+    Arguments:
+    - `filename`: the report filename, like report.html.
+    - `number`: the page number, from 1.
+    Return:
+    The page filename, like report-1.html.
+    """
+    root, ext = os.path.splitext(filename)
+    return '{}-{:d}{}'.format(root, number, ext)
+
+
+def write_resources(resources, dirpath):
+    """Copy resources next to a report, streamed piece by piece rather than read whole.
+    Resources the report refers to by relative names (see stardict.get_resource_names) then resolve.
+
+    Arguments:
+    - `resources`: an iterable of tuples (stardict.ResourceStorage object, resource name). A name given by
+    several storages is written once, from the first one holding it.
+    - `dirpath`: the directory of the report.
+    Return:
+    The list of the written filenames.
+    """
+    dirpath = os.path.abspath(dirpath)
+    filenames = []
+    written = set()
+    for storage, name in resources:
+        if name in written or storage is None:
+            continue
+        filename = os.path.normpath(os.path.join(dirpath, *name.split('/')))
+        # No way out of the report directory
+        if not filename.startswith(dirpath + os.sep):
+            continue
+        try:
+            chunks = storage.iter_chunks(name)
+        except KeyError:
+            continue
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, mode='wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        written.add(name)
+        filenames.append(filename)
+    return filenames
+
+
+def _dump_report(entries, output, buffer_size, **context):
+    stream = env.get_template('report.html').stream(text=entries, **context)
+    if not isinstance(output, str):
+        # Encode the report unless the file object takes strings
+        stream.dump(output, encoding=None if isinstance(output, io.TextIOBase) else 'utf8')
+        return
+    with open(output, mode='w', encoding='utf8', buffering=buffer_size) as f:
+        stream.dump(f)
+
+
+def stream_report(entries, output=DEFAULT_REPORT_FILENAME, page_size=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                  resources=None):
+    """Render the report of many entries without building it in memory.
+    The entries are consumed as the report is written, so `entries` may be a generator.
+
+    Arguments:
+    - `entries`: an iterable of tuples (header, definition), or (explanation,).
+    - `output`: the report filename, or a file object (text or binary).
+    - `page_size`: if set, write pages of at most this many entries, named after `output` by
+    get_page_filename and linked to each other. `output` must be a filename.
+    - `buffer_size`: the size in bytes of the write buffer of the report files.
+    - `resources`: the resources the entries refer to, copied next to the report by write_resources once the
+    entries are written, so it may be filled while they are consumed. `output` must be a filename.
+    Return:
+    The list of the written filenames, empty when writing to a file object.
+    """
+    if resources is not None and not isinstance(output, str):
+        raise ValueError('A report with resources needs a filename')
+    if page_size is None:
+        _dump_report(entries, output, buffer_size)
+        if not isinstance(output, str):
+            return []
+        return [output] + (write_resources(resources, os.path.dirname(output) or os.curdir) if resources else [])
+    if not isinstance(output, str):
+        raise ValueError('A paginated report needs a filename')
+    if page_size <= 0:
+        raise ValueError('The page size must be positive')
+
+    filenames = []
+    entries = iter(entries)
+    page = list(islice(entries, page_size))
+    number = 1
+    while True:
+        # Read the next page ahead, to know whether this one links to it
+        next_page = list(islice(entries, page_size))
+        filename = get_page_filename(output, number)
+        _dump_report(page, filename, buffer_size,
+                     previous_page=os.path.basename(get_page_filename(output, number - 1)) if number > 1 else None,
+                     next_page=os.path.basename(get_page_filename(output, number + 1)) if next_page else None)
+        filenames.append(filename)
+        if not next_page:
+            if resources:
+                filenames.extend(write_resources(resources, os.path.dirname(output) or os.curdir))
+            return filenames
+        page = next_page
+        number += 1
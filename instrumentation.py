@@ -0,0 +1,253 @@
+"""Opt-in instrumentation of the lookup hot paths.
+
+enable() wraps the instrumented methods and functions (see TARGETS) with timers and counters, and disable()
+puts the original ones back. Nothing is measured, and nothing costs anything, until enable() is called.
+
+Timers record the number of calls and their total and maximum durations. Nested timers overlap: the time of
+"dict.decompress" is included in the one of "dict.read". Counters add up sizes: bytes decompressed, entries
+parsed. Cache hit ratios, load time breakdowns, memory estimates and budget evictions are collected by
+StarDict.stats(), which includes stats(). format_prometheus renders any of these in the Prometheus text format,
+and hooks receive each measure as it is recorded.
+"""
+import functools
+import importlib
+import re
+import threading
+import time
+
+# (module, owner class or None for a module function, attribute, timer name, counter name, counter function
+# of the result or None to count calls)
+TARGETS = (
+    ('stardict', 'IdxFileReader', 'get_index_by_word', 'idx.search', None, None),
+    ('stardict', 'IdxFileReader', 'get_index_by_num', 'idx.get', None, None),
+    ('stardict', 'CompactIdxFileReader', 'get_index_by_word', 'idx.search', None, None),
+    ('stardict', 'CompactIdxFileReader', 'get_index_by_num', 'idx.get', None, None),
+    ('stardict', 'SynFileReader', 'get_syn', 'syn.search', None, None),
+    ('stardict', 'CompactSynFileReader', 'get_syn', 'syn.search', None, None),
+    ('stardict', 'WordResolver', 'resolve', 'resolver.search', None, None),
+    ('stardict', 'DictFileReader', 'get_dict_by_word', 'dict.read', None, None),
+    ('stardict', 'DictFileReader', 'get_dict_by_index', 'dict.read', None, None),
+    ('stardict', 'DictFileReader', 'get_dicts_by_locations', 'dict.read', 'dict.entries_read', len),
+    ('dictzip', 'ChunkedFile', '_inflate', 'dict.decompress', 'dict.bytes_decompressed', len),
+    ('stardict', None, '_parse_fields', 'entry.parse', 'entry.parsed', None),
+    ('app', 'StarDict', 'get_definitions_from_enabled_dictionaries', 'stardict.lookup', None, None),
+    ('app', 'StarDict', 'get_definitions_from_dictionary_name', 'stardict.lookup', None, None),
+    ('app', 'StarDict', 'lookup_many', 'stardict.lookup_many', None, None),
+    ('html_output.html_convertor', None, 'build_report', 'report.render', None, None),
+    ('html_output.html_convertor', None, 'stream_report', 'report.render', None, None),
+)
+
+_lock = threading.Lock()
+# name: [count, total seconds, max seconds]
+_timers = {}
+# name: value
+_counters = {}
+# Replaced, never modified, so that the measuring threads iterate it without the lock
+_hooks = ()
+# (owner, attribute, original)
+_originals = []
+
+
+def is_enabled():
+    """Whether the TARGETS are being measured.
+
+    """
+    return bool(_originals)
+
+
+def record_time(name, seconds):
+    """Record the duration of a call.
+
+    Arguments:
+    - `name`: the timer name.
+    - `seconds`: the duration.
+    """
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+    for hook in _hooks:
+        hook('timer', name, seconds)
+
+
+def increment(name, value=1):
+    """Add to a counter.
+
+    Arguments:
+    - `name`: the counter name.
+    - `value`: the increment.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    for hook in _hooks:
+        hook('counter', name, value)
+
+
+def _wrap(function, timer_name, counter_name, count):
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start_time = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            # Failing calls (a missing word raising IndexError...) are timed too
+            record_time(timer_name, perf_counter() - start_time)
+        if counter_name is not None:
+            increment(counter_name, count(result) if count is not None else 1)
+        return result
+    return wrapper
+
+
+def enable():
+    """Start measuring: wrap the TARGETS.
+
+    """
+    with _lock:
+        if _originals:
+            return
+        for module_name, owner_name, attribute, timer_name, counter_name, count in TARGETS:
+            module = importlib.import_module(module_name)
+            owner = getattr(module, owner_name) if owner_name else module
+            original = owner.__dict__[attribute] if owner_name else getattr(module, attribute)
+            _originals.append((owner, attribute, original))
+            setattr(owner, attribute, _wrap(original, timer_name, counter_name, count))
+
+
+def disable():
+    """Stop measuring: put the original TARGETS back. The recorded measures are kept.
+
+    """
+    with _lock:
+        while _originals:
+            owner, attribute, original = _originals.pop()
+            setattr(owner, attribute, original)
+
+
+def reset():
+    """Drop the recorded measures.
+
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def add_hook(hook):
+    """Call a function on each measure, from the measuring thread.
+
+    Arguments:
+    - `hook`: function called with (kind, name, value): ('timer', name, seconds) or ('counter', name, increment).
+    """
+    global _hooks
+    with _lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook):
+    """Stop calling a function added by add_hook.
+    Raise ValueError if it is not a hook.
+
+    """
+    global _hooks
+    with _lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+def stats():
+    """Get the recorded measures.
+
+    Return:
+    A dictionary {'enabled': bool, 'timers': {name: {'count', 'total_s', 'max_s', 'mean_s'}},
+    'counters': {name: value}}.
+    """
+    with _lock:
+        return {
+            'enabled': bool(_originals),
+            'timers': {name: {'count': count, 'total_s': total, 'max_s': maximum, 'mean_s': total / count}
+                       for name, (count, total, maximum) in sorted(_timers.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def _metric_name(*parts):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join(parts))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(stats, prefix='stardict'):
+    """Render measures in the Prometheus text exposition format.
+
+    Arguments:
+    - `stats`: the result of stats() or of StarDict.stats().
+    - `prefix`: the prefix of the metric names.
+    Return:
+    The text.
+    """
+    lines = []
+    for name, timer in stats.get('timers', {}).items():
+        metric = _metric_name(prefix, name, 'seconds')
+        lines.append('# TYPE {} summary'.format(metric))
+        lines.append('{}_count {:d}'.format(metric, timer['count']))
+        lines.append('{}_sum {!r}'.format(metric, timer['total_s']))
+    for name, value in stats.get('counters', {}).items():
+        metric = _metric_name(prefix, name, 'total')
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+
+    cache = stats.get('definition_cache')
+    if cache:
+        for field in ('hits', 'misses', 'evictions', 'expirations'):
+            metric = _metric_name(prefix, 'definition_cache', field, 'total')
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {:d}'.format(metric, cache[field]))
+        for field in ('items', 'resident_bytes'):
+            metric = _metric_name(prefix, 'definition_cache', field)
+            lines.append('# TYPE {} gauge'.format(metric))
+            lines.append('{} {:d}'.format(metric, cache[field]))
+
+    budget = stats.get('memory_budget')
+    if budget:
+        metric = _metric_name(prefix, 'memory_budget_evictions_total')
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {:d}'.format(metric, budget['evictions']))
+        for field in ('budget_bytes', 'resident_bytes'):
+            metric = _metric_name(prefix, 'memory_budget', field)
+            lines.append('# TYPE {} gauge'.format(metric))
+            lines.append('{} {:d}'.format(metric, budget[field]))
+
+    dictionaries = stats.get('dictionaries', {})
+    samples = {}
+    for name, dictionary in dictionaries.items():
+        labels = 'dictionary="{}"'.format(_label(name))
+        if dictionary.get('load_time_s') is not None:
+            samples.setdefault(('load_seconds', 'gauge'), []).append(
+                '{{{}}} {!r}'.format(labels, dictionary['load_time_s']))
+        for phase, seconds in dictionary.get('load_phases_s', {}).items():
+            samples.setdefault(('load_phase_seconds', 'gauge'), []).append(
+                '{{{},phase="{}"}} {!r}'.format(labels, _label(phase), seconds))
+        for reader, usage in dictionary.get('memory', {}).items():
+            for kind, size in usage.items():
+                samples.setdefault(('memory_' + kind, 'gauge'), []).append(
+                    '{{{},reader="{}"}} {:d}'.format(labels, _label(reader), size))
+        chunk_cache = dictionary.get('chunk_cache')
+        if chunk_cache:
+            for field in ('hits', 'misses', 'evictions'):
+                samples.setdefault(('chunk_cache_' + field + '_total', 'counter'), []).append(
+                    '{{{}}} {:d}'.format(labels, chunk_cache[field]))
+    for (name, metric_type), values in samples.items():
+        metric = _metric_name(prefix, 'dictionary', name)
+        lines.append('# TYPE {} {}'.format(metric, metric_type))
+        lines.extend(metric + value for value in values)
+    return '\n'.join(lines) + '\n'
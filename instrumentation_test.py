@@ -0,0 +1,162 @@
+"""Test of the instrumentation and of its Prometheus output.
+
+Usage: python instrumentation_test.py
+
+Lookups are measured on two synthetic dictionaries (see benchmarks/generate.py), failing ones included. Hooks are
+added and removed by threads while others record measures. The output of format_prometheus must follow the
+Prometheus text format: one TYPE line per metric family, before its samples, valid names, escaped label values.
+"""
+import os
+import re
+import tempfile
+import threading
+import instrumentation
+from app import StarDict, DictionarySettings, SETTINGS_FILENAMES
+from benchmarks.generate import generate_dictionary
+
+DICTIONARIES = (
+    ('plain', dict(sametypesequence='m')),
+    # A name whose labels need escaping
+    ('dict"zip\\', dict(idx_gz=True, dictzip=True, sametypesequence='tm')),
+)
+METRIC_NAME = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+TYPE_PATTERN = re.compile(r'# TYPE ({}) (counter|gauge|summary|histogram|untyped)\Z'.format(METRIC_NAME))
+LABEL_VALUE = r'"(?:[^"\\\n]|\\[\\"n])*"'
+LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)=({})'.format(LABEL_VALUE))
+SAMPLE_PATTERN = re.compile(r'({})(?:\{{((?:[a-zA-Z_][a-zA-Z0-9_]*={}(?:,|(?=\}})))*)\}})? (\S+)\Z'.format(
+    METRIC_NAME, LABEL_VALUE))
+SUFFIXES = {'counter': ('',), 'gauge': ('',), 'untyped': ('',), 'summary': ('_count', '_sum', ''),
+            'histogram': ('_bucket', '_count', '_sum')}
+
+
+def make_stardict(dirpath):
+    dicts_dirpath = os.path.join(dirpath, 'dicts')
+    settings_dirpath = os.path.join(dirpath, 'settings')
+    os.makedirs(settings_dirpath)
+    for order, (name, options) in enumerate(DICTIONARIES):
+        generate_dictionary(os.path.join(dicts_dirpath, name), 2000, seed=order, **options)
+    for filename in SETTINGS_FILENAMES:
+        with open(os.path.join(settings_dirpath, filename), mode='w', encoding='utf-8') as f:
+            for order, (name, options) in enumerate(DICTIONARIES):
+                f.write('{} 1 {:d}\n'.format(name, order))
+    return StarDict(DictionarySettings(dicts_dirpath, settings_dirpath), definition_cache_max_items=100,
+                    memory_budget=64 * 1024 * 1024)
+
+
+def parse_prometheus(text):
+    """Check the text format and parse it.
+
+    Return:
+    A dictionary {metric family: (type, [(sample name, {label: value}, value), ...])}.
+    """
+    assert text.endswith('\n')
+    families = {}
+    family = None
+    for line in text[:-1].split('\n'):
+        match = TYPE_PATTERN.match(line)
+        if match:
+            assert match.group(1) not in families, 'TYPE of {} repeated'.format(match.group(1))
+            family = match.group(1)
+            families[family] = (match.group(2), [])
+            continue
+        match = SAMPLE_PATTERN.match(line)
+        assert match, 'invalid line {!r}'.format(line)
+        name, labels, value = match.groups()
+        metric_type, samples = families[family]
+        assert name in [family + suffix for suffix in SUFFIXES[metric_type]], (
+            'sample {} out of the family {}'.format(name, family))
+        labels = {label: re.sub(r'\\(.)', lambda escape: '\n' if escape.group(1) == 'n' else escape.group(1),
+                                value[1:-1])
+                  for label, value in LABEL_PATTERN.findall(labels or '')}
+        samples.append((name, labels, float(value)))
+    return families
+
+
+def check_failing_calls(stardict):
+    dictionary = stardict._get_dictionary('plain')
+    try:
+        dictionary.idx_reader.get_index_by_num(10 ** 9)
+    except IndexError:
+        pass
+    else:
+        raise AssertionError('no IndexError')
+    assert instrumentation.stats()['timers']['idx.get']['count'] == 1
+
+
+def check_hooks():
+    recorded = []
+    errors = []
+    stop = threading.Event()
+
+    def record():
+        try:
+            while not stop.is_set():
+                instrumentation.increment('test.hooks')
+        except Exception as e:
+            errors.append(e)
+
+    def churn():
+        try:
+            for i in range(2000):
+                hook = lambda kind, name, value: recorded.append(name)
+                instrumentation.add_hook(hook)
+                instrumentation.remove_hook(hook)
+        except Exception as e:
+            errors.append(e)
+
+    recorders = [threading.Thread(target=record) for i in range(2)]
+    churners = [threading.Thread(target=churn) for i in range(4)]
+    for thread in recorders + churners:
+        thread.start()
+    for thread in churners:
+        thread.join()
+    stop.set()
+    for thread in recorders:
+        thread.join()
+    assert not errors, errors
+    assert instrumentation._hooks == ()
+    try:
+        instrumentation.remove_hook(check_hooks)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('an unknown hook is removed')
+
+
+def check_prometheus(stardict):
+    for word_str in ('aaaa', 'missing#'):
+        stardict.get_definitions_from_enabled_dictionaries(word_str)
+    stardict.lookup_many(['aaaa', 'missing#'])
+    stats = stardict.stats()
+    families = parse_prometheus(instrumentation.format_prometheus(stats))
+    metric_type, samples = families['stardict_idx_get_seconds']
+    assert metric_type == 'summary'
+    assert dict((name, value) for name, labels, value in samples)['stardict_idx_get_seconds_count'] == \
+        stats['timers']['idx.get']['count']
+    assert families['stardict_definition_cache_misses_total'][0] == 'counter'
+    names = {labels['dictionary'] for name, labels, value in families['stardict_dictionary_load_seconds'][1]}
+    assert names == {name for name, options in DICTIONARIES}, names
+    readers = {labels['reader'] for name, labels, value in families['stardict_dictionary_memory_heap_bytes'][1]}
+    assert 'idx' in readers and 'dict' in readers, readers
+    assert families['stardict_dictionary_chunk_cache_misses_total'][1]
+    # The measures alone render too
+    parse_prometheus(instrumentation.format_prometheus(instrumentation.stats()))
+    return families
+
+
+def main():
+    instrumentation.enable()
+    try:
+        with tempfile.TemporaryDirectory() as dirpath:
+            stardict = make_stardict(dirpath)
+            check_failing_calls(stardict)
+            check_hooks()
+            families = check_prometheus(stardict)
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+    print('{:d} metric families in the Prometheus text format'.format(len(families)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Test of a dictionary whose .dict file is larger than 4 GB (64-bit .idx offsets).
+
+Usage: python large_file_test.py
+
+The .dict file is sparse: only the entries are written, the gaps between them are holes which take no disk space.
+Entries sit below 4 GB, across the 4 GB boundary and past it; the .idx file stores their offsets on 64 bits
+(idxoffsetbits=64 in the .ifo file). Each reader configuration of CONFIGURATIONS must find them, and the plain
+.dict file must be memory-mapped rather than read into the heap.
+"""
+import mmap
+import os
+import resource
+import struct
+import tempfile
+from stardict import Dictionary, IfoFileReader, IfoFileException
+
+GB = 2 ** 30
+# Word, offset in the .dict file, definition
+ENTRIES = (
+    ('alpha', 10, 'below 4 GB'),
+    ('gamma', 4 * GB - 5, 'across the 4 GB boundary'),
+    ('beta', 5 * GB, 'past 4 GB'),
+)
+DICT_SIZE = 6 * GB
+CONFIGURATIONS = (
+    dict(),
+    dict(compact_index=True),
+    dict(compact_index=True, snapshot=True),
+    dict(compact_index=True, unified_lookup=True),
+)
+# The dictionary data must stay out of the heap: far less than 4 GB of resident memory
+MAX_RSS_BYTES = 512 * 1024 * 1024
+
+
+def make_dictionary(dirpath):
+    """Write the sparse .dict file, the .idx file with 64-bit offsets and the .ifo file.
+
+    """
+    name = os.path.basename(dirpath)
+    os.makedirs(dirpath)
+    with open(os.path.join(dirpath, name + '.dict'), 'wb') as f:
+        for word_str, offset, definition in ENTRIES:
+            f.seek(offset)
+            f.write(definition.encode('utf-8'))
+        f.truncate(DICT_SIZE)
+    idx = b''.join(word_str.encode('utf-8') + b'\0' + struct.pack('!QI', offset, len(definition.encode('utf-8')))
+                   for word_str, offset, definition in sorted(ENTRIES))
+    with open(os.path.join(dirpath, name + '.idx'), 'wb') as f:
+        f.write(idx)
+    with open(os.path.join(dirpath, name + '.ifo'), 'w', encoding='utf-8') as f:
+        f.write("StarDict's dict ifo file\nversion=3.0.0\nbookname={}\nwordcount={:d}\nidxfilesize={:d}\n"
+                "idxoffsetbits=64\nsametypesequence=m\n".format(name, len(ENTRIES), len(idx)))
+
+
+def check_dictionary(dictionary_path, options):
+    dictionary = Dictionary(dictionary_path, use_package=False, **options)
+    assert dictionary.index_offset_bits == 64
+    assert len(dictionary.idx_reader) == len(ENTRIES)
+    for word_str, offset, definition in ENTRIES:
+        definitions = [entry['m'] for entry in dictionary.dict_reader.get_dict_by_word(word_str)]
+        assert definitions == [definition], (options, word_str, definitions)
+        locations = [dictionary.idx_reader.get_index_by_word(word_str)[0]]
+        assert locations[0][0] == offset, (options, word_str, locations)
+        definitions = [entry['m'] for entry in dictionary.dict_reader.get_dicts_by_locations(locations)]
+        assert definitions == [definition], (options, word_str, definitions)
+    # The .dict file is mapped, not read
+    assert isinstance(dictionary.dict_reader._dict_file, mmap.mmap)
+    usage = dictionary.get_memory_usage()['dict']
+    assert usage['mapped_bytes'] == DICT_SIZE and usage['heap_bytes'] < 1024 * 1024, (options, usage)
+    dictionary.close()
+
+
+def check_ifo_versions():
+    # idxoffsetbits only applies from version 3.0.0 on
+    ifo_reader = IfoFileReader.from_string("StarDict's dict ifo file\nversion=2.4.2\nidxoffsetbits=64\n")
+    assert ifo_reader.get_index_offset_bits() == 32
+    ifo_reader = IfoFileReader.from_string("StarDict's dict ifo file\nversion=3.0.0\nidxoffsetbits=64\n")
+    assert ifo_reader.get_index_offset_bits() == 64
+    ifo_reader = IfoFileReader.from_string("StarDict's dict ifo file\nversion=3.0.0\nidxoffsetbits=48\n")
+    try:
+        ifo_reader.get_index_offset_bits()
+    except IfoFileException:
+        pass
+    else:
+        raise AssertionError('idxoffsetbits=48 is accepted')
+
+
+def main():
+    check_ifo_versions()
+    with tempfile.TemporaryDirectory() as dirpath:
+        dictionary_path = os.path.join(dirpath, 'large')
+        make_dictionary(dictionary_path)
+        for options in CONFIGURATIONS:
+            options = dict(options)
+            if options.pop('snapshot', False):
+                options['snapshot_dirpath'] = os.path.join(dirpath, 'snapshots')
+            check_dictionary(dictionary_path, options)
+            print('{:d} entries of a {:d} GB .dict file found with {}'.format(
+                len(ENTRIES), DICT_SIZE // GB, options or 'the default options'))
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    assert max_rss < MAX_RSS_BYTES, 'maximum resident memory: {:d} bytes'.format(max_rss)
+
+
+if __name__ == '__main__':
+    main()
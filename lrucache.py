@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A least-recently-used mapping bounded by the total size of its values, and optionally by the number of
+    values and their age.
+    The size of a value is measured by `sizeof` (len by default), so the bound is a byte budget
+    when values are bytes. All operations are protected by a lock.
+    """
+
+    def __init__(self, max_bytes, sizeof=len, max_items=None, ttl=None):
+        """Constructor.
+
+        Arguments:
+        - `max_bytes`: the budget for the summed size of all cached values, or None for no budget.
+        - `sizeof`: function returning the size of a value.
+        - `max_items`: the maximum number of cached values, or None for no maximum.
+        - `ttl`: the number of seconds a value stays cached, or None to keep it until it is evicted.
+        """
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def resident_bytes(self):
+        """The summed size of all cached values.
+
+        """
+        return self._bytes
+
+    def get(self, key, default=None):
+        """Get a cached value and mark it as the most recently used.
+
+        Arguments:
+        - `key`: the key of the value.
+        - `default`: returned when the key is not cached or its value has expired.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, size, expiry = item
+            if expiry is not None and expiry <= time.monotonic():
+                del self._items[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used ones to stay within the bounds.
+        A value bigger than the whole budget is not cached.
+
+        Arguments:
+        - `key`: the key of the value.
+        - `value`: the value.
+        """
+        size = self._sizeof(value)
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._items[key] = (value, size, expiry)
+            self._bytes += size
+            while ((self.max_bytes is not None and self._bytes > self.max_bytes) or
+                   (self.max_items is not None and len(self._items) > self.max_items)):
+                evicted_key, (evicted_value, evicted_size, evicted_expiry) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached values.
+
+        """
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Get the usage counters of the cache.
+
+        Return:
+        A dictionary with the numbers of hits, misses, evictions (to stay within the bounds) and expirations,
+        the number of cached values and their summed size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'items': len(self._items),
+                    'resident_bytes': self._bytes}
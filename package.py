@@ -0,0 +1,202 @@
+"""Offline compiler of StarDict dictionaries into single-file packages.
+
+Usage: python package.py PATH... [--block-size 65536] [--level 6] [--output-dir DIR] [--no-verify]
+
+Each PATH is a dictionary directory or a directory of dictionaries. The package of a dictionary is written in its
+directory as <name>.sdpkg by default, where Dictionary finds it and reads it instead of the StarDict files as long
+as it is up to date.
+
+A package is a snapshot file (see snapshot.py) memory-mapped as a whole, with the sections:
+- ifo: the .ifo file.
+- idx.*: the headwords, sorted, and the .dict offset and size arrays of CompactIdxFileReader.
+- syn.*: the synonym table of CompactSynFileReader, if the dictionary has synonyms.
+- resolve.slots: the merged headword and synonym order of WordResolver.
+- dict.blocks and dict.block_offsets: the .dict data compressed in independently inflatable blocks of
+block_size bytes, or dict.data: the .dict data as is when the level is 0.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+import zlib
+from array import array
+from dictutils import PACKAGE_EXT, find_dictionary_filepaths, find_installed_dictionaries_paths, map_file
+from snapshot import get_source_key, write_snapshot
+from stardict import (Dictionary, IfoFileReader, CompactIdxFileReader, CompactSynFileReader, WordResolver,
+                      PACKAGE_FORMAT, PACKAGE_VERSION, get_package_sources)
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_LEVEL = 6
+
+
+def _iter_dict_blocks(filepaths, block_size):
+    opener = gzip.open if filepaths['dict.dz'] else open
+    with opener(filepaths['dict'], 'rb') as dict_file:
+        while True:
+            data = dict_file.read(block_size)
+            if not data:
+                break
+            yield data
+
+
+def compress_blocks(blocks, level=DEFAULT_LEVEL):
+    """Compress data blocks, each one as a raw deflate stream of its own.
+
+    Arguments:
+    - `blocks`: iterable of bytes, all of the same length but the last one.
+    - `level`: the zlib compression level.
+    Return:
+    A tuple (compressed data, array of the offsets of the blocks in it, followed by its length).
+    """
+    compressed = bytearray()
+    block_offsets = array('Q', [0])
+    for data in blocks:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed += compressor.compress(data)
+        compressed += compressor.flush()
+        block_offsets.append(len(compressed))
+    return compressed, block_offsets
+
+
+def compile_package(dictionary_path, output_filename=None, block_size=DEFAULT_BLOCK_SIZE, level=DEFAULT_LEVEL):
+    """Compile a dictionary into a package.
+
+    Arguments:
+    - `dictionary_path`: the dictionary directory.
+    - `output_filename`: the package filename, <name>.sdpkg in the dictionary directory by default.
+    - `block_size`: the uncompressed length of the .dict data blocks.
+    - `level`: the zlib compression level of the blocks, 0 to store the .dict data uncompressed.
+    Return:
+    The package filename.
+    """
+    filepaths = find_dictionary_filepaths(dictionary_path)
+    if not filepaths or 'ifo' not in filepaths:
+        print('Invalid dictionary')
+        raise ValueError
+    name = os.path.basename(os.path.normpath(dictionary_path))
+    if output_filename is None:
+        output_filename = os.path.join(dictionary_path, name + PACKAGE_EXT)
+
+    index_offset_bits = IfoFileReader(filepaths['ifo']).get_index_offset_bits()
+    idx_reader = CompactIdxFileReader(filepaths['idx'], compressed=filepaths['idx.gz'],
+                                      index_offset_bits=index_offset_bits)
+    syn_reader = CompactSynFileReader(filepaths['syn']) if 'syn' in filepaths else None
+    resolver = WordResolver(idx_reader, syn_reader)
+
+    with open(filepaths['ifo'], 'rb') as ifo_file:
+        sections = {'ifo': ifo_file.read()}
+    for prefix, reader in (('idx.', idx_reader), ('syn.', syn_reader), ('resolve.', resolver)):
+        if reader:
+            for section_name, data in reader.get_sections().items():
+                sections[prefix + section_name] = data
+
+    if level:
+        sections['dict.blocks'], sections['dict.block_offsets'] = compress_blocks(
+            _iter_dict_blocks(filepaths, block_size), level)
+    elif filepaths['dict.dz']:
+        sections['dict.data'] = b''.join(_iter_dict_blocks(filepaths, block_size))
+    else:
+        sections['dict.data'] = map_file(filepaths['dict'])
+
+    key = get_source_key(get_package_sources(filepaths), format=PACKAGE_FORMAT, package_version=PACKAGE_VERSION,
+                         name=name, block_size=block_size, level=level,
+                         index_offset_bits=index_offset_bits)
+    write_snapshot(output_filename, key, sections)
+    return output_filename
+
+
+def verify_package(dictionary_path, package_filename):
+    """Check that a package gives the same lookup results as the dictionary it was compiled from.
+
+    Arguments:
+    - `dictionary_path`: the dictionary directory.
+    - `package_filename`: the package filename.
+    Return:
+    The list of the differences found, as strings, empty if none.
+    """
+    original = Dictionary(dictionary_path, compact_index=True, unified_lookup=True, use_package=False)
+    package = Dictionary(package_filename, unified_lookup=True)
+    differences = []
+
+    if original.ifo_reader._ifo != package.ifo_reader._ifo:
+        differences.append('.ifo content')
+    # The entries actually in the .idx file, whatever the wordcount of the .ifo file says
+    count = len(original.idx_reader)
+    if len(package.idx_reader) != count:
+        differences.append('number of entries: {:d} instead of {:d}'.format(len(package.idx_reader), count))
+        count = min(count, len(package.idx_reader))
+    for number in range(count):
+        index = original.idx_reader.get_index_by_num(number)
+        if package.idx_reader.get_index_by_num(number) != index:
+            differences.append('index of entry {:d}'.format(number))
+        elif package.dict_reader.get_dict_by_index(number).tobytes() != \
+                original.dict_reader.get_dict_by_index(number).tobytes():
+            differences.append('data of entry {:d}'.format(number))
+    for word_str in original.idx_reader.iter_words():
+        if package.idx_reader.get_index_by_word(word_str) != original.idx_reader.get_index_by_word(word_str):
+            differences.append('headword {!r}'.format(word_str))
+        elif package.resolve(word_str) != original.resolve(word_str):
+            differences.append('resolution of {!r}'.format(word_str))
+    if (original.syn_reader is None) != (package.syn_reader is None):
+        differences.append('.syn file')
+    elif original.syn_reader is not None:
+        for word_str in original.syn_reader.iter_words():
+            if package.syn_reader.get_syn(word_str) != original.syn_reader.get_syn(word_str):
+                differences.append('synonym {!r}'.format(word_str))
+            elif package.resolve(word_str) != original.resolve(word_str):
+                differences.append('resolution of {!r}'.format(word_str))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile StarDict dictionaries into single-file packages.')
+    parser.add_argument('paths', nargs='+',
+                        help='dictionary directories, or directories of installed dictionaries')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='uncompressed length in bytes of the .dict data blocks')
+    parser.add_argument('--level', type=int, default=DEFAULT_LEVEL, choices=range(10),
+                        help='zlib compression level of the blocks, 0 to store the data uncompressed')
+    parser.add_argument('--output-dir', default=None,
+                        help='directory of the packages, the dictionary directories by default')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='do not compare the lookup results of the packages with the dictionaries')
+    args = parser.parse_args()
+    if args.block_size <= 0:
+        parser.error('The block size must be positive')
+
+    dictionary_paths = []
+    for path in args.paths:
+        if find_dictionary_filepaths(path):
+            dictionary_paths.append(os.path.abspath(path))
+        else:
+            dictionary_paths.extend(sorted(find_installed_dictionaries_paths(path)))
+
+    failures = 0
+    for dictionary_path in dictionary_paths:
+        output_filename = None
+        if args.output_dir:
+            output_filename = os.path.join(args.output_dir, os.path.basename(dictionary_path) + PACKAGE_EXT)
+        start_time = time.perf_counter()
+        try:
+            output_filename = compile_package(dictionary_path, output_filename,
+                                              block_size=args.block_size, level=args.level)
+        except (OSError, ValueError) as e:
+            print('Cannot compile {}: {}'.format(dictionary_path, e))
+            failures += 1
+            continue
+        print('Compiled {} in {:.2f}s'.format(output_filename, time.perf_counter() - start_time))
+        if args.no_verify:
+            continue
+        differences = verify_package(dictionary_path, output_filename)
+        if differences:
+            print('Package {} differs from the dictionary: {}'.format(
+                output_filename, ', '.join(differences[:10])))
+            failures += 1
+        else:
+            print('Package {} verified'.format(output_filename))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
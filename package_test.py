@@ -0,0 +1,89 @@
+"""Test of the compile and verify round trip of dictionary packages.
+
+Usage: python package_test.py
+
+Synthetic dictionaries (see benchmarks/generate.py) are compiled with each configuration of CONFIGURATIONS and
+verified against their files: verify_package must find no difference, also when the wordcount of the .ifo file is
+wrong, and Dictionary must read an up to date package instead of the files, with the same results. A package
+verified against another dictionary must show differences.
+"""
+import os
+import random
+import re
+import shutil
+import tempfile
+from benchmarks.generate import generate_dictionary
+from package import compile_package, verify_package
+from stardict import Dictionary
+
+ENTRIES = 3000
+DICTIONARIES = (
+    ('plain', dict(sametypesequence='m')),
+    ('dictzip', dict(idx_gz=True, dictzip=True, sametypesequence='tm')),
+    ('nosyn', dict(syn=False, sametypesequence=None)),
+)
+# Options of compile_package
+CONFIGURATIONS = (
+    dict(),
+    dict(level=0),
+    dict(block_size=4096, level=1),
+)
+
+
+def check_lookups(dictionary_path, samples=300):
+    """Check that Dictionary reads the package, with the results of the files.
+
+    """
+    files = Dictionary(dictionary_path, use_package=False)
+    package = Dictionary(dictionary_path)
+    assert package._package is not None, 'the package of {} is not read'.format(dictionary_path)
+    rng = random.Random(0)
+    for i in range(samples):
+        word_str = files.idx_reader.get_index_by_num(rng.randrange(len(files.idx_reader)))[0]
+        for word in (word_str, word_str.lower() + '-syn', word_str + '#'):
+            assert ([entry.tobytes() for entry in package.dict_reader.get_dict_by_word(word)] ==
+                    [entry.tobytes() for entry in files.dict_reader.get_dict_by_word(word)]), word
+            assert package.resolve(word) == files.resolve(word), word
+    package.close()
+    files.close()
+
+
+def set_wordcount(dictionary_path, wordcount):
+    name = os.path.basename(dictionary_path)
+    filename = os.path.join(dictionary_path, name + '.ifo')
+    with open(filename, encoding='utf-8') as f:
+        ifo = f.read()
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(re.sub(r'(?m)^wordcount=\d+$', 'wordcount={:d}'.format(wordcount), ifo))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirpath:
+        for order, (name, options) in enumerate(DICTIONARIES):
+            dictionary_path = generate_dictionary(os.path.join(dirpath, name), ENTRIES, seed=order, **options)
+            for compile_options in CONFIGURATIONS:
+                package_filename = compile_package(dictionary_path, **compile_options)
+                differences = verify_package(dictionary_path, package_filename)
+                assert differences == [], (name, compile_options, differences[:10])
+                check_lookups(dictionary_path)
+                print('{} compiled and verified with {}'.format(name, compile_options or 'the default options'))
+
+        # The .idx file has more entries than the .ifo file says
+        dictionary_path = os.path.join(dirpath, 'plain')
+        set_wordcount(dictionary_path, 10)
+        package_filename = compile_package(dictionary_path)
+        assert verify_package(dictionary_path, package_filename) == []
+        assert len(Dictionary(dictionary_path).idx_reader) == ENTRIES
+
+        # A dictionary with fewer entries, and different ones
+        other_path = os.path.join(dirpath, 'other', 'plain')
+        generate_dictionary(other_path, ENTRIES // 2, seed=len(DICTIONARIES))
+        shutil.copy(package_filename, other_path)
+        differences = verify_package(other_path, os.path.join(other_path, os.path.basename(package_filename)))
+        assert 'number of entries: {:d} instead of {:d}'.format(ENTRIES, ENTRIES // 2) in differences, differences[:10]
+        assert any(difference.startswith('index of entry') for difference in differences), differences[:10]
+    print('Packages verified, differences found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Test of the streamed HTML report.
+
+Usage: python report_test.py
+
+stream_report must write what the template renders at once, whether to a file, a text or a binary file object,
+consume the entries as it goes, split pages with links between them, and copy the resources of the entries
+next to the report without leaving its directory.
+"""
+import io
+import os
+import tempfile
+from html_output.html_convertor import env, get_page_filename, stream_report
+from stardict import ResourceDirectory
+
+ENTRIES = [('Haus {:d}'.format(number), 'house <b>{:d}</b> & Straße'.format(number)) for number in range(7)]
+ENTRIES.append(('An explanation without a definition',))
+RESOURCES = {'pic/a.png': b'\x89PNG' * 1000, 'b.wav': b'RIFF'}
+
+
+def render(entries, **context):
+    return env.get_template('report.html').render(text=entries, **context)
+
+
+def read(filename):
+    with open(filename, encoding='utf8') as f:
+        return f.read()
+
+
+def check_single_report(dirpath):
+    filename = os.path.join(dirpath, 'report.html')
+    consumed = []
+
+    def iter_entries():
+        for entry in ENTRIES:
+            consumed.append(entry)
+            yield entry
+
+    assert stream_report(iter_entries(), filename) == [filename]
+    assert consumed == ENTRIES
+    assert read(filename) == render(ENTRIES)
+    text_output = io.StringIO()
+    assert stream_report(ENTRIES, text_output) == []
+    assert text_output.getvalue() == render(ENTRIES)
+    binary_output = io.BytesIO()
+    stream_report(ENTRIES, binary_output)
+    assert binary_output.getvalue() == render(ENTRIES).encode('utf8')
+
+
+def check_pages(dirpath):
+    output = os.path.join(dirpath, 'pages', 'report.html')
+    os.makedirs(os.path.dirname(output))
+    for page_size in (1, 3, 4, len(ENTRIES), len(ENTRIES) + 1):
+        filenames = stream_report(iter(ENTRIES), output, page_size=page_size)
+        pages = [ENTRIES[first:first + page_size] for first in range(0, len(ENTRIES), page_size)]
+        assert filenames == [get_page_filename(output, number) for number in range(1, len(pages) + 1)]
+        for number, (filename, page) in enumerate(zip(filenames, pages), 1):
+            previous_page = os.path.basename(get_page_filename(output, number - 1)) if number > 1 else None
+            next_page = os.path.basename(get_page_filename(output, number + 1)) if number < len(pages) else None
+            assert read(filename) == render(page, previous_page=previous_page, next_page=next_page), (
+                page_size, number)
+        for filename in filenames:
+            os.remove(filename)
+    for output, options in ((io.StringIO(), dict(page_size=2)), (output, dict(page_size=0)),
+                            (io.StringIO(), dict(resources=[]))):
+        try:
+            stream_report(ENTRIES, output, **options)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('stream_report accepts {}'.format(options))
+
+
+def check_resources(dirpath):
+    res_dirpath = os.path.join(dirpath, 'res')
+    for name, data in RESOURCES.items():
+        filename = os.path.join(res_dirpath, *name.split('/'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+    storage = ResourceDirectory(res_dirpath)
+    report_dirpath = os.path.join(dirpath, 'report')
+    os.makedirs(report_dirpath)
+    output = os.path.join(report_dirpath, 'report.html')
+    resources = []
+
+    def iter_entries():
+        # The resources are named as the entries are consumed
+        for name in list(RESOURCES) + ['../res/b.wav', 'missing.png', 'b.wav']:
+            resources.append((storage, name))
+            yield (name, '<img src="{}">'.format(name))
+
+    filenames = stream_report(iter_entries(), output, resources=resources)
+    assert filenames == [output] + [os.path.join(report_dirpath, *name.split('/')) for name in RESOURCES]
+    for name, data in RESOURCES.items():
+        with open(os.path.join(report_dirpath, *name.split('/')), 'rb') as f:
+            assert f.read() == data, name
+    assert sorted(os.listdir(report_dirpath)) == ['b.wav', 'pic', 'report.html']
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirpath:
+        check_single_report(dirpath)
+        check_pages(dirpath)
+        check_resources(dirpath)
+    print('Reports of {:d} entries match the template rendering'.format(len(ENTRIES)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+import heapq
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from dictutils import fold_word
+from fuzzy import FuzzyIndex
+from snapshot import read_snapshot, write_snapshot
+from stardict import stardict_strcmp_key
+
+FOLDED_SEARCH_INDEX_SNAPSHOT_FILENAME = 'folded_search_index.snapshot'
+FUZZY_INDEX_SNAPSHOT_FILENAME = 'fuzzy_index.snapshot'
+
+
+def _get_key(word_str):
+    return stardict_strcmp_key(word_str.encode('utf-8'))
+
+
+def _tag_words(words, bitmap):
+    for word_str in words:
+        yield (_get_key(word_str), word_str, bitmap)
+
+
+def _tag_postings(postings):
+    for word_str, bitmap in postings:
+        yield (_get_key(word_str), word_str, bitmap)
+
+
+def _merge_tagged(tagged_streams):
+    current_key = current_word = None
+    current_bitmap = 0
+    for key, word_str, bitmap in heapq.merge(*tagged_streams):
+        if key == current_key:
+            current_bitmap |= bitmap
+            continue
+        if current_key is not None:
+            yield (current_word, current_bitmap)
+        current_key, current_word, current_bitmap = key, word_str, bitmap
+    if current_key is not None:
+        yield (current_word, current_bitmap)
+
+
+def merge_postings(streams):
+    """Merge sorted word streams, k-way.
+
+    Arguments:
+    - `streams`: a list of tuples (bitmap, words), `words` iterating over distinct words in stardict_strcmp()
+    order and `bitmap` being the dictionaries containing them.
+    Return:
+    An iterator of tuples (word, bitmap of the dictionaries containing the word), in stardict_strcmp() order.
+    """
+    return _merge_tagged([_tag_words(words, bitmap) for bitmap, words in streams])
+
+
+class SearchIndex():
+    """List of the words of a group of dictionaries in stardict_strcmp() order, the order of the .idx files,
+    with the dictionaries containing each word.
+    The dictionaries containing a word are stored as a bitmap of (len(names) + 63) // 64 64-bit integers per word;
+    bit i stands for names[i].
+    A SearchIndex is not modified once built, except for the folded and fuzzy indexes built on first use,
+    so it can be queried by concurrent threads.
+    """
+
+    def __init__(self, names, words, postings, key, snapshot_dirpath=None):
+        """Constructor.
+
+        Arguments:
+        - `names`: names of the dictionaries.
+        - `words`: the sorted list of words.
+        - `postings`: the bitmaps of the dictionaries containing each word.
+        - `key`: the snapshot key of the index, see snapshot.get_source_key.
+        - `snapshot_dirpath`: directory of the snapshots of the folded and fuzzy indexes.
+        """
+        self.names = names
+        self.words = words
+        self.key = key
+        self.snapshot_dirpath = snapshot_dirpath
+        self._postings = postings
+        self._postings_width = (len(names) + 63) // 64
+        self._folded_search_index = None
+        self._fuzzy_index = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, names, streams, key, snapshot_dirpath=None):
+        """Build an index by merging the sorted words of the dictionaries.
+
+        Arguments:
+        - `names`: names of the dictionaries.
+        - `streams`: a list of tuples (number, words): the position of a dictionary in `names`, and an iterator
+        over its distinct words in stardict_strcmp() order, see IdxFileReader.iter_words.
+        - `key`: the snapshot key of the index, see snapshot.get_source_key.
+        - `snapshot_dirpath`: directory of the snapshots of the folded and fuzzy indexes.
+        """
+        return cls._from_postings(names, merge_postings([(1 << number, words) for number, words in streams]),
+                                  key, snapshot_dirpath)
+
+    @classmethod
+    def _from_postings(cls, names, postings_iterator, key, snapshot_dirpath):
+        width = (len(names) + 63) // 64
+        words = []
+        postings = array('Q')
+        for word_str, bitmap in postings_iterator:
+            words.append(word_str)
+            if width == 1:
+                postings.append(bitmap)
+            else:
+                for k in range(width):
+                    postings.append((bitmap >> (64 * k)) & 0xffffffffffffffff)
+        return cls(names, words, postings, key, snapshot_dirpath)
+
+    def merge(self, name, words, key):
+        """Build a new index with one more dictionary, by merging its words into the words of this index.
+        Runs of indexed words between two words of the dictionary are copied as a whole, so the cost mostly
+        depends on the size of the dictionary.
+
+        Arguments:
+        - `name`: name of the dictionary, numbered after the dictionaries of this index.
+        - `words`: an iterator over its distinct words in stardict_strcmp() order.
+        - `key`: the snapshot key of the new index.
+        """
+        names = self.names + [name]
+        width = self._postings_width
+        if (len(names) + 63) // 64 != width:
+            # One more 64-bit integer per word
+            return self._from_postings(names, _merge_tagged([
+                _tag_postings(self.iter_postings()), _tag_words(words, 1 << len(self.names))]),
+                key, self.snapshot_dirpath)
+
+        slot, bit = divmod(len(self.names), 64)
+        indexed_words, indexed_postings = self.words, memoryview(self._postings)
+        merged_words = []
+        postings = array('Q')
+        position = 0
+        for word_str in words:
+            end = self._gallop(_get_key(word_str), position)
+            merged_words.extend(indexed_words[position:end])
+            postings.frombytes(indexed_postings[position * width:end * width].cast('B'))
+            if end < len(indexed_words) and indexed_words[end] == word_str:
+                bitmaps = array('Q', indexed_postings[end * width:(end + 1) * width])
+                end += 1
+            else:
+                bitmaps = array('Q', bytes(8 * width))
+            bitmaps[slot] |= 1 << bit
+            merged_words.append(word_str)
+            postings.extend(bitmaps)
+            position = end
+        merged_words.extend(indexed_words[position:])
+        postings.frombytes(indexed_postings[position * width:].cast('B'))
+        return SearchIndex(names, merged_words, postings, key, self.snapshot_dirpath)
+
+    def _gallop(self, key, start):
+        """Find the position of the first word not lower than `key` from `start`, by exponential search.
+
+        """
+        words = self.words
+        low = high = start
+        step = 1
+        while high < len(words) and _get_key(words[high]) < key:
+            low = high + 1
+            high = low + step
+            step *= 2
+        return bisect_left(words, key, low, min(high, len(words)), key=_get_key)
+
+    def get_postings(self):
+        """Get the bitmaps of all the words, to be saved in a snapshot.
+
+        """
+        return self._postings
+
+    def iter_postings(self):
+        """Iterate over the words of the index with the bitmaps of the dictionaries containing them.
+
+        Return:
+        An iterator of tuples (word, bitmap).
+        """
+        for position, word_str in enumerate(self.words):
+            yield (word_str, self.get_bitmap(position))
+
+    def get_bitmap(self, position):
+        """Get the bitmap of the dictionaries containing a word, as one integer.
+
+        Arguments:
+        - `position`: position of the word in words.
+        """
+        width = self._postings_width
+        if width == 1:
+            return self._postings[position]
+        bitmap = 0
+        for k in range(width):
+            bitmap |= self._postings[position * width + k] << (64 * k)
+        return bitmap
+
+    def find(self, word_str):
+        """Find a word.
+
+        Arguments:
+        - `word_str`: the word.
+        Return:
+        The position of the word in words, or None if it is not in the index.
+        """
+        position = self._bisect(word_str)
+        if position < len(self.words) and self.words[position] == word_str:
+            return position
+        return None
+
+    def _bisect(self, word_str):
+        return bisect_left(self.words, _get_key(word_str), key=_get_key)
+
+    def get_word_dictionaries(self, word_str):
+        """Get the names of the dictionaries containing a word.
+
+        Arguments:
+        - `word_str`: the word.
+        Return:
+        A list of dictionary names, empty if the word is not in the index.
+        """
+        position = self.find(word_str)
+        if position is None:
+            return []
+        return self.get_dictionaries(position)
+
+    def get_dictionaries(self, position):
+        """Get the names of the dictionaries containing a word.
+
+        Arguments:
+        - `position`: position of the word in words.
+        """
+        width = self._postings_width
+        names = []
+        for k in range(width):
+            bitmap = self._postings[position * width + k]
+            number = 64 * k
+            while bitmap:
+                if bitmap & 1:
+                    names.append(self.names[number])
+                bitmap >>= 1
+                number += 1
+        return names
+
+    def _get_folded_search_index(self):
+        """Get the words sorted by folded word, built on first use.
+        It is saved next to the search index snapshot, if any.
+
+        Return:
+        A tuple (folded_words, positions): the sorted folded words, and the position in words
+        of the word each one comes from.
+        """
+        folded_search_index = self._folded_search_index
+        if folded_search_index is not None:
+            return folded_search_index
+        with self._lock:
+            if self._folded_search_index is None:
+                self._folded_search_index = self._build_folded_search_index()
+        return self._folded_search_index
+
+    def _build_folded_search_index(self):
+        if self.snapshot_dirpath is not None:
+            snapshot_filepath = os.path.join(
+                self.snapshot_dirpath, FOLDED_SEARCH_INDEX_SNAPSHOT_FILENAME)
+            snapshot = read_snapshot(snapshot_filepath, self.key)
+            if snapshot:
+                folded_words = snapshot.get_bytes('words').decode('utf-8')
+                return (folded_words.split('\x00') if folded_words else [],
+                        snapshot.get_array('positions'))
+
+        folded_words = [fold_word(word) for word in self.words]
+        positions = array('I', sorted(
+            range(len(folded_words)), key=folded_words.__getitem__))
+        folded_words = [folded_words[position] for position in positions]
+        folded_search_index = (folded_words, positions)
+
+        if self.snapshot_dirpath is not None:
+            words = '\x00'.join(folded_words).encode('utf-8')
+            try:
+                write_snapshot(snapshot_filepath, self.key, {
+                               'words': words, 'positions': positions})
+            except OSError:
+                print('Cannot write the folded search index snapshot')
+        return folded_search_index
+
+    def _iter_positions(self, low, high, fold):
+        """Iterate over the positions of the words between `low` and `high`.
+
+        Arguments:
+        - `low`: the first word of the range (included), or a prefix.
+        - `high`: the last word of the range (excluded), or None to stop at the end of the index.
+        - `fold`: compare the folded words instead of the words, see dictutils.fold_word.
+        """
+        if fold:
+            words, positions = self._get_folded_search_index()
+            low = fold_word(low)
+            high = fold_word(high) if high is not None else None
+            start = bisect_left(words, low)
+            stop = bisect_left(words, high) if high is not None else len(words)
+            for position in range(start, stop):
+                yield positions[position]
+            return
+        start = self._bisect(low)
+        stop = self._bisect(high) if high is not None else len(self.words)
+        yield from range(start, stop)
+
+    def complete(self, prefix, limit=10, fold=False):
+        """Complete a prefix with the words of the index.
+
+        Arguments:
+        - `prefix`: the beginning of the words.
+        - `limit`: the maximum number of completions, or None for all of them.
+        - `fold`: case- and diacritic-insensitive completion, see dictutils.fold_word.
+        Return:
+        A list of tuples (word, [name of each dictionary containing the word]), in index order.
+        """
+        completions = []
+        if limit is not None and limit <= 0:
+            return completions
+        if fold:
+            folded_prefix = fold_word(prefix)
+            for position in self._iter_positions(prefix, None, fold):
+                word = self.words[position]
+                if not fold_word(word).startswith(folded_prefix):
+                    break
+                completions.append((word, self.get_dictionaries(position)))
+                if limit is not None and len(completions) >= limit:
+                    break
+            return completions
+
+        # The words starting with the prefix are among the ones starting with it regardless of ASCII case,
+        # which are contiguous in stardict_strcmp() order
+        lower_prefix = prefix.encode('utf-8').lower()
+        for position in self._iter_positions(prefix, None, fold):
+            word = self.words[position]
+            if not word.encode('utf-8').lower().startswith(lower_prefix):
+                break
+            if not word.startswith(prefix):
+                continue
+            completions.append((word, self.get_dictionaries(position)))
+            if limit is not None and len(completions) >= limit:
+                break
+        return completions
+
+    def _get_fuzzy_index(self):
+        """Get the fuzzy index of the folded words, built on first use.
+        It is saved next to the search index snapshot, if any.
+
+        """
+        fuzzy_index = self._fuzzy_index
+        if fuzzy_index is not None:
+            return fuzzy_index
+        with self._lock:
+            if self._fuzzy_index is None:
+                self._fuzzy_index = self._build_fuzzy_index()
+        return self._fuzzy_index
+
+    def _build_fuzzy_index(self):
+        folded_words, positions = self._get_folded_search_index()
+        if self.snapshot_dirpath is not None:
+            snapshot_filepath = os.path.join(
+                self.snapshot_dirpath, FUZZY_INDEX_SNAPSHOT_FILENAME)
+            snapshot = read_snapshot(snapshot_filepath, self.key)
+            if snapshot:
+                reversed_words = snapshot.get_bytes(
+                    'reversed_words').decode('utf-8')
+                return FuzzyIndex(folded_words, reversed_words.split('\x00') if reversed_words else [],
+                                  snapshot.get_array('reversed_positions'))
+
+        fuzzy_index = FuzzyIndex(folded_words)
+
+        if self.snapshot_dirpath is not None:
+            reversed_words = '\x00'.join(
+                fuzzy_index.reversed_words).encode('utf-8')
+            try:
+                write_snapshot(snapshot_filepath, self.key, {
+                               'reversed_words': reversed_words,
+                               'reversed_positions': fuzzy_index.reversed_positions})
+            except OSError:
+                print('Cannot write the fuzzy index snapshot')
+        return fuzzy_index
+
+    def suggest(self, word_str, max_distance=2, limit=10):
+        """Find the words of the index close to a possibly misspelled word ("did you mean").
+        The distance is measured between folded words (see dictutils.fold_word), so that case, umlauts and
+        "ß" against "ss" do not count as edits.
+
+        Arguments:
+        - `word_str`: the word.
+        - `max_distance`: the maximum Levenshtein distance, usually 1 or 2.
+        - `limit`: the maximum number of suggestions, or None for all of them.
+        Return:
+        A list of tuples (word, distance), by increasing distance.
+        """
+        folded_words, positions = self._get_folded_search_index()
+        fuzzy_index = self._get_fuzzy_index()
+        return [(self.words[positions[position]], distance) for distance, position
+                in fuzzy_index.search(fold_word(word_str), max_distance, limit)]
+
+    def iter_range(self, low, high=None, fold=False):
+        """Iterate over the words of the index between two words.
+
+        Arguments:
+        - `low`: the first word of the range (included).
+        - `high`: the last word of the range (excluded), or None to go to the end of the index.
+        - `fold`: compare the folded words instead of the words, see dictutils.fold_word.
+        Return:
+        An iterator of tuples (word, [name of each dictionary containing the word]), in index order, or in folded
+        word order with `fold`.
+        """
+        for position in self._iter_positions(low, high, fold):
+            yield (self.words[position], self.get_dictionaries(position))
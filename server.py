@@ -0,0 +1,485 @@
+import argparse
+import asyncio
+import base64
+import json
+import mimetypes
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+import instrumentation
+from app import StarDict, DictionarySettings, DictionaryWatcher, LOAD_EAGER, LOAD_LAZY, LOAD_PARALLEL
+from lrucache import LRUCache
+
+DEFAULT_RESPONSE_CACHE_SIZE = 16 * 1024 * 1024
+DEFAULT_KEEP_ALIVE_TIMEOUT = 15
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY_SIZE = 1024 * 1024
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_RESOURCE_CONTENT_TYPE = 'application/octet-stream'
+
+
+class HTTPError(Exception):
+    """Exception answered with an HTTP error response.
+
+    """
+
+    def __init__(self, status, description):
+        """Constructor.
+
+        Arguments:
+        - `status`: HTTP status code.
+        - `description`: a string describing the exception condition.
+        """
+        self.status = status
+        self._description = description
+
+    def __str__(self):
+        """__str__ method, return the description of exception occured.
+
+        """
+        return self._description
+
+
+class StreamedPayload(object):
+    """Response body written piece by piece, of a known length.
+
+    """
+
+    def __init__(self, content_type, length, chunks):
+        """Constructor.
+
+        Arguments:
+        - `content_type`: the Content-Type of the body.
+        - `length`: the length in bytes of the body.
+        - `chunks`: an iterator of the bytes-like pieces of the body.
+        """
+        self.content_type = content_type
+        self.length = length
+        self.chunks = chunks
+
+
+class LatencyHistogram(object):
+    """Count of requests per latency bucket, see LATENCY_BUCKETS.
+
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, milliseconds):
+        """Record the latency of a request.
+
+        Arguments:
+        - `milliseconds`: the latency.
+        """
+        with self._lock:
+            for number, bound in enumerate(LATENCY_BUCKETS):
+                if milliseconds <= bound:
+                    self.counts[number] += 1
+                    break
+            self.count += 1
+            self.total += milliseconds
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'mean_ms': self.total / self.count if self.count else 0.0,
+                'buckets': [['+Inf' if bound == float('inf') else bound, count]
+                            for bound, count in zip(LATENCY_BUCKETS, self.counts)],
+            }
+
+
+def entry_to_json(entry):
+    """Convert a dictionary entry to json-serializable data.
+    Text fields are kept as decoded by the Entry, the other fields (W for sounds, P for pictures...) are base64
+    encoded.
+
+    Arguments:
+    - `entry`: dictionary data of an entry, Entry object.
+    """
+    result = {}
+    for type_identifier, value in entry.items():
+        if isinstance(value, str):
+            result[type_identifier] = value
+        else:
+            result[type_identifier] = base64.b64encode(value).decode('ascii')
+    return result
+
+
+def definitions_to_json(dictionaries_definitions):
+    """Convert [(dictionary, definitions), ...] to json-serializable data.
+
+    """
+    return [{'dictionary': dictionary.name,
+             'bookname': dictionary.ifo_reader.get_ifo('bookname'),
+             'definitions': [entry_to_json(entry) for entry in definitions]}
+            for dictionary, definitions in dictionaries_definitions]
+
+
+class LookupServer(object):
+    """HTTP/JSON server answering lookups with a StarDict object.
+    Endpoints (GET, parameters in the query string):
+    - /lookup?word=W[&text_capture=1]: definitions of W from the enabled dictionaries.
+    - /batch?word=W1&word=W2...[&dictionary=D...][&text_capture=1], or POST /batch with a json body
+    {"words": [...], "dictionaries": [...], "text_capture": false}: definitions of many words.
+    - /complete?prefix=P[&limit=N][&fold=1]: completions of P.
+    - /dictionaries/D?word=W: definitions of W from the dictionary D only.
+    - /resources/D/NAME: the resource NAME (a picture, a sound...) of the dictionary D, streamed from its
+    resource storage.
+    - /stats: request counts, latency histograms, response and definition cache usage.
+    - /metrics: StarDict.stats() in the Prometheus text format, with the per-phase timers when the
+    instrumentation is enabled (see instrumentation.py).
+    Connections are kept alive. GET responses are kept in a LRU cache bounded in bytes, keyed by
+    StarDict.state_version so that a reload or an install is seen at once.
+    Lookups run on a thread pool, unless `inline` is set, which suits StarDict objects with memory-mapped
+    readers (compact index or snapshots), whose lookups do not block on reads.
+    """
+
+    def __init__(self, stardict, cache_size=DEFAULT_RESPONSE_CACHE_SIZE, max_workers=None, inline=False,
+                 keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT):
+        """Constructor.
+
+        Arguments:
+        - `stardict`: the StarDict object answering the lookups.
+        - `cache_size`: the budget in bytes of the response cache, 0 to disable it.
+        - `max_workers`: the size of the lookup thread pool.
+        - `inline`: run lookups on the event loop instead of the thread pool.
+        - `keep_alive_timeout`: seconds an idle connection is kept open.
+        """
+        self.stardict = stardict
+        self.inline = inline
+        self.keep_alive_timeout = keep_alive_timeout
+        self._cache = LRUCache(cache_size) if cache_size else None
+        self._executor = None if inline else ThreadPoolExecutor(
+            max_workers=max_workers)
+        self._histograms = {}
+        # Routes are added from the event loop while /stats reads them from the thread pool
+        self._histograms_lock = threading.Lock()
+        self._connections = 0
+        self._started = time.time()
+        self._routes = {
+            '/lookup': self._lookup,
+            '/batch': self._batch,
+            '/complete': self._complete,
+            '/stats': self._stats,
+            '/metrics': self._metrics,
+        }
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        """Serve until cancelled.
+
+        Arguments:
+        - `host`: the interface to listen on.
+        - `port`: the port to listen on.
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        self._connections += 1
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        """Read the rest of a request and write the response.
+
+        Return:
+        Whether the connection should be kept alive.
+        """
+        start_time = time.perf_counter()
+        method, target, version = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, colon, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        url = urlsplit(target)
+        path = unquote(url.path)
+        if path in self._routes:
+            route = path
+        elif path.startswith('/dictionaries/'):
+            route = '/dictionaries/'
+        elif path.startswith('/resources/'):
+            route = '/resources/'
+        else:
+            route = 'other'
+        try:
+            body = b''
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_SIZE:
+                keep_alive = False
+                raise HTTPError(413, 'Request body too large')
+            if length:
+                body = await reader.readexactly(length)
+            content_type = JSON_CONTENT_TYPE
+            payload = await self._dispatch(method, path, url.query, body)
+            if isinstance(payload, str):
+                content_type, payload = PROMETHEUS_CONTENT_TYPE, payload.encode('utf-8')
+            elif isinstance(payload, StreamedPayload):
+                content_type = payload.content_type
+            status = 200
+        except HTTPError as e:
+            status, payload = e.status, json.dumps({'error': str(e)}).encode('utf-8')
+        except Exception as e:
+            status, payload = 500, json.dumps({'error': repr(e)}).encode('utf-8')
+
+        streamed = isinstance(payload, StreamedPayload)
+        writer.write('HTTP/1.1 {:d} {}\r\nContent-Type: {}\r\n'
+                     'Content-Length: {:d}\r\nConnection: {}\r\n\r\n'.format(
+                         status, REASONS[status], content_type, payload.length if streamed else len(payload),
+                         'keep-alive' if keep_alive else 'close')
+                     .encode('latin-1'))
+        if streamed:
+            # Wait for each piece to be sent before reading the next one. The pieces are read (and decompressed)
+            # on the thread pool, like lookups, so that a large resource does not hold up the other connections
+            chunks = iter(payload.chunks)
+            loop = asyncio.get_running_loop()
+            try:
+                while True:
+                    if self.inline:
+                        chunk = next(chunks, None)
+                    else:
+                        chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+            except OSError:
+                # The response cannot be completed: the client sees a short body
+                keep_alive = False
+        else:
+            writer.write(payload)
+
+        histogram = self._histograms.get(route)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self._histograms.setdefault(route, LatencyHistogram())
+        histogram.add((time.perf_counter() - start_time) * 1000)
+        return keep_alive
+
+    async def _dispatch(self, method, path, query, body):
+        if path.startswith('/dictionaries/'):
+            handler = self._dictionary_lookup
+        elif path.startswith('/resources/'):
+            if method != 'GET':
+                raise HTTPError(405, 'Method {} not allowed on {}'.format(method, path))
+            # Not cached: resources are streamed from their storage
+            return await self._run(self._resource, path, {})
+        elif path in self._routes:
+            handler = self._routes[path]
+        else:
+            raise HTTPError(404, 'Unknown endpoint {}'.format(path))
+        if method not in ('GET', 'POST') or (method == 'POST' and path != '/batch'):
+            raise HTTPError(405, 'Method {} not allowed on {}'.format(method, path))
+
+        cacheable = method == 'GET' and path not in ('/stats', '/metrics') and self._cache is not None
+        if cacheable:
+            # Responses computed before a reload or an install are not served again
+            cache_key = (path, query, self.stardict.state_version)
+            payload = self._cache.get(cache_key)
+            if payload is not None:
+                return payload
+
+        params = parse_qs(query)
+        if method == 'POST':
+            try:
+                params = json.loads(body.decode('utf-8'))
+            except ValueError:
+                raise HTTPError(400, 'Invalid json body')
+            if not isinstance(params, dict):
+                raise HTTPError(400, 'The json body must be an object')
+        result = await self._run(handler, path, params)
+        if isinstance(result, str):
+            # Plain text
+            return result
+        payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        if cacheable:
+            self._cache.put(cache_key, payload)
+        return payload
+
+    async def _run(self, handler, path, params):
+        if self.inline:
+            return handler(path, params)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, handler, path, params)
+
+    @staticmethod
+    def _get_param(params, name, default=None):
+        values = params.get(name)
+        if not values:
+            if default is None:
+                raise HTTPError(400, 'Missing parameter {}'.format(name))
+            return default
+        return values[0]
+
+    @staticmethod
+    def _get_flag(params, name):
+        value = params.get(name, False)
+        if isinstance(value, list):
+            value = value[0] if value else ''
+        if isinstance(value, str):
+            # Query strings, and json bodies with string flags
+            return value.strip().lower() not in ('', '0', 'false')
+        return bool(value)
+
+    def _lookup(self, path, params):
+        word_str = self._get_param(params, 'word')
+        return {'word': word_str,
+                'results': definitions_to_json(self.stardict.get_definitions_from_enabled_dictionaries(
+                    word_str, text_capture_mode=self._get_flag(params, 'text_capture')))}
+
+    def _batch(self, path, params):
+        words = params.get('words', params.get('word'))
+        if not words or not isinstance(words, list):
+            raise HTTPError(400, 'Missing parameter words')
+        if not all(isinstance(word_str, str) for word_str in words):
+            raise HTTPError(400, 'The words must be strings')
+        dictionaries = params.get('dictionaries', params.get('dictionary'))
+        if dictionaries is not None and (not isinstance(dictionaries, list) or
+                                         not all(isinstance(name, str) for name in dictionaries)):
+            raise HTTPError(400, 'The dictionaries must be a list of strings')
+        results = self.stardict.lookup_many(words, dictionaries=dictionaries,
+                                            text_capture_mode=self._get_flag(params, 'text_capture'))
+        return {'results': {word_str: definitions_to_json(dictionaries_definitions)
+                            for word_str, dictionaries_definitions in results.items()}}
+
+    def _complete(self, path, params):
+        prefix = self._get_param(params, 'prefix', '')
+        try:
+            limit = int(self._get_param(params, 'limit', '10'))
+        except ValueError:
+            raise HTTPError(400, 'Invalid limit')
+        completions = self.stardict.complete(
+            prefix, limit, fold=self._get_flag(params, 'fold'))
+        return {'prefix': prefix,
+                'completions': [{'word': word_str, 'dictionaries': names} for word_str, names in completions]}
+
+    def _dictionary_lookup(self, path, params):
+        dictionary_name = path[len('/dictionaries/'):]
+        word_str = self._get_param(params, 'word')
+        result = self.stardict.get_definitions_from_dictionary_name(
+            word_str, dictionary_name)
+        if result is None:
+            raise HTTPError(404, 'Unknown dictionary {}'.format(dictionary_name))
+        return {'word': word_str, 'results': definitions_to_json([result])}
+
+    def _resource(self, path, params):
+        dictionary_name, slash, name = path[len('/resources/'):].partition('/')
+        resources = self.stardict.get_resources(dictionary_name)
+        length = resources.get_size(name) if resources is not None and name else None
+        if length is None:
+            raise HTTPError(404, 'Unknown resource {} of dictionary {}'.format(name, dictionary_name))
+        content_type = mimetypes.guess_type(name)[0] or DEFAULT_RESOURCE_CONTENT_TYPE
+        return StreamedPayload(content_type, length, resources.iter_chunks(name))
+
+    def _stats(self, path, params):
+        with self._histograms_lock:
+            histograms = sorted(self._histograms.items())
+        stats = {
+            'uptime_s': time.time() - self._started,
+            'open_connections': self._connections,
+            'latency_ms': {route: histogram.to_json() for route, histogram in histograms},
+            'load_time_s': self.stardict.get_load_times(),
+        }
+        if self._cache is not None:
+            stats['response_cache'] = self._cache.stats()
+        definition_cache_stats = self.stardict.get_definition_cache_stats()
+        if definition_cache_stats is not None:
+            stats['definition_cache'] = definition_cache_stats
+        return stats
+
+    def _metrics(self, path, params):
+        return instrumentation.format_prometheus(self.stardict.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve StarDict lookups over HTTP/JSON.')
+    parser.add_argument('--dicts', default='./dicts',
+                        help='directory of the installed dictionaries')
+    parser.add_argument('--settings', default='./settings',
+                        help='directory of the settings files')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_RESPONSE_CACHE_SIZE,
+                        help='response cache budget in bytes, 0 to disable')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='size of the lookup and loading thread pools')
+    parser.add_argument('--definition-cache-size', type=int, default=0,
+                        help='definition cache budget in bytes, 0 to disable')
+    parser.add_argument('--definition-cache-ttl', type=float, default=None,
+                        help='seconds definitions stay cached')
+    parser.add_argument('--inline', action='store_true',
+                        help='run lookups on the event loop (for memory-mapped readers)')
+    parser.add_argument('--compact-index', action='store_true',
+                        help='use the compact .idx and .syn readers')
+    parser.add_argument('--snapshot-dir', default=None,
+                        help='directory of the index snapshots')
+    parser.add_argument('--load-mode', default=LOAD_EAGER,
+                        choices=(LOAD_EAGER, LOAD_LAZY, LOAD_PARALLEL))
+    parser.add_argument('--instrument', action='store_true',
+                        help='measure the lookup phases, reported by /metrics')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='heap budget in bytes of the loaded dictionaries, past which the least '
+                             'recently used ones are closed')
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help='poll the settings and dictionaries directories every SECONDS, and reload the '
+                             'new and changed dictionaries')
+    args = parser.parse_args()
+
+    if args.instrument:
+        instrumentation.enable()
+
+    settings = DictionarySettings(args.dicts, args.settings)
+    stardict = StarDict(settings, compact_index=args.compact_index, snapshot_dirpath=args.snapshot_dir,
+                        load_mode=args.load_mode, max_workers=args.workers,
+                        definition_cache_size=args.definition_cache_size,
+                        definition_cache_ttl=args.definition_cache_ttl, memory_budget=args.memory_budget)
+    server = LookupServer(stardict, cache_size=args.cache_size,
+                          max_workers=args.workers, inline=args.inline)
+    if args.watch:
+        DictionaryWatcher(stardict, interval=args.watch).start()
+    print('Serving on http://{}:{:d}'.format(args.host, args.port))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from dictutils import map_file
+
+SNAPSHOT_MAGIC = b'SDSNAP\x00\x00'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXT = '.snapshot'
+
+# magic, version, length of the json header
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 8
+
+
+class SnapshotFileException(Exception):
+    """Exception while reading a snapshot file.
+    Raised when the file is not a snapshot or was written by another snapshot version.
+    """
+
+    def __init__(self, description="SnapshotFileException raised"):
+        """Constructor from a description string.
+
+        Arguments:
+        - `description`: a string describing the exception condition.
+        """
+        self._description = description
+
+    def __str__(self):
+        """__str__ method, return the description of exception occured.
+
+        """
+        return self._description
+
+
+def get_source_key(filenames, **params):
+    """Identify the state of the files a snapshot is built from.
+
+    Arguments:
+    - `filenames`: the source files.
+    - `params`: any other value the snapshot content depends on.
+    Return:
+    A json-serializable key, equal for two calls as long as the files are neither resized nor modified.
+    """
+    sources = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        sources.append([os.path.basename(filename),
+                        stat.st_size, stat.st_mtime_ns])
+    key = {"version": SNAPSHOT_VERSION,
+           "byteorder": sys.byteorder, "sources": sources}
+    key.update(params)
+    return key
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_snapshot(filename, key, sections):
+    """Write a snapshot file.
+    The file is written aside and renamed, so that readers never see a partial snapshot.
+    Layout: preamble, json header {key, sections: {name: [offset, length, format]}}, then the sections,
+    each one aligned on 8 bytes. Offsets are relative to the end of the header.
+
+    Arguments:
+    - `filename`: the snapshot filename.
+    - `key`: json-serializable key identifying the source of the snapshot, see get_source_key.
+    - `sections`: a dictionary {name: array, memoryview or bytes-like object}.
+    """
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        if isinstance(data, array):
+            data_format = data.typecode
+        elif isinstance(data, memoryview):
+            data_format = data.format
+        else:
+            data_format = "B"
+        length = len(memoryview(data).cast("B"))
+        layout[name] = [offset, length, data_format]
+        offset = _align(offset + length)
+    header = json.dumps({"key": key, "sections": layout}).encode('utf-8')
+    header_end = _align(_PREAMBLE.size + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    temporary_filename = "{}.{:d}.{:d}.tmp".format(
+        filename, os.getpid(), threading.get_ident())
+    with open(temporary_filename, "wb") as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        f.write(b'\x00' * (header_end - _PREAMBLE.size - len(header)))
+        for name, data in sections.items():
+            offset, length, data_format = layout[name]
+            f.write(b'\x00' * (header_end + offset - f.tell()))
+            f.write(memoryview(data).cast("B"))
+    os.replace(temporary_filename, filename)
+
+
+class SnapshotFile(object):
+    """Memory-mapped snapshot file.
+    Sections are served without copy, as memoryviews over the mapping.
+    """
+
+    def __init__(self, filename):
+        """Constructor.
+        May raise SnapshotFileException if the file is not a snapshot of the current version.
+
+        Arguments:
+        - `filename`: the snapshot filename.
+        """
+        self.content = map_file(filename)
+        if len(self.content) < _PREAMBLE.size:
+            raise SnapshotFileException(
+                "{!r:s} is not a snapshot file!".format(filename))
+        magic, version, header_length = _PREAMBLE.unpack_from(self.content)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotFileException(
+                "{!r:s} is not a snapshot file!".format(filename))
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotFileException(
+                "Snapshot version expected to be {:d}, but {:d} read!".format(SNAPSHOT_VERSION, version))
+        header = json.loads(
+            bytes(self.content[_PREAMBLE.size:_PREAMBLE.size + header_length]).decode('utf-8'))
+        self.key = header["key"]
+        self._header_end = _align(_PREAMBLE.size + header_length)
+        self._sections = header["sections"]
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def get_offset(self, name):
+        """Get the offset of a section in the mapping.
+
+        Arguments:
+        - `name`: section name.
+        """
+        return self._header_end + self._sections[name][0]
+
+    def get_array(self, name):
+        """Get a section as a memoryview of its items.
+
+        Arguments:
+        - `name`: section name.
+        Return:
+        The memoryview, or None if the snapshot has no such section.
+        """
+        if name not in self._sections:
+            return None
+        offset, length, data_format = self._sections[name]
+        start = self._header_end + offset
+        return memoryview(self.content)[start:start + length].cast(data_format)
+
+    def get_bytes(self, name):
+        """Get a copy of a section.
+
+        Arguments:
+        - `name`: section name.
+        Return:
+        The bytes, or None if the snapshot has no such section.
+        """
+        if name not in self._sections:
+            return None
+        offset, length, data_format = self._sections[name]
+        start = self._header_end + offset
+        return self.content[start:start + length]
+
+
+def read_snapshot(filename, key):
+    """Open a snapshot file if it is up to date.
+
+    Arguments:
+    - `filename`: the snapshot filename.
+    - `key`: the key the snapshot must have been written with.
+    Return:
+    A SnapshotFile object, or None if the snapshot is missing, unreadable or stale.
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        snapshot = SnapshotFile(filename)
+    except (OSError, ValueError, SnapshotFileException):
+        return None
+    if snapshot.key != key:
+        return None
+    return snapshot
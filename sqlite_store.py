@@ -0,0 +1,554 @@
+"""SQLite store of StarDict dictionaries, shared by many processes.
+
+Usage: python sqlite_store.py STORE_DIR PATH... [--fulltext] [--batch-size 10000]
+
+Each PATH is a dictionary directory or a directory of dictionaries. The store of a dictionary is imported once
+into STORE_DIR as <name>.sqlite, and read by SqliteDictionary, through StarDict(store_dirpath=STORE_DIR), as long
+as it is up to date. Stores are read through memory mapping, so the processes serving the same dictionaries
+share the system page cache instead of each holding parsed copies of the .idx, .syn and .dict files.
+
+Tables:
+- meta: the import key (see get_store_key) and the .ifo file.
+- entries: the .idx entries by origin index, with their .dict data, indexed by headword, by .dict offset and by
+sort key (see get_sort_key), for iteration in stardict_strcmp() order.
+- synonyms: the .syn entries, indexed by word and by sort key.
+- fulltext: optionally, a contentless FTS5 table of the words of the definitions (see fulltext.get_entry_texts
+and fulltext.tokenize), whose rowids are the origin indexes of the entries.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dictutils import find_dictionary_filepaths, find_installed_dictionaries_paths
+from fulltext import QUERY_PATTERN, get_entry_texts, tokenize
+from snapshot import get_source_key
+from stardict import (Dictionary, Entry, IfoFileReader, compile_layout, get_package_sources, open_resource_storage,
+                      read_package, stardict_strcmp_key, DEFAULT_RESOURCE_CACHE_SIZE)
+
+STORE_EXT = '.sqlite'
+STORE_FORMAT = 'stardict-sqlite'
+STORE_VERSION = 3
+# Number of entries inserted per transaction
+DEFAULT_BATCH_SIZE = 10000
+# Locations looked up per query by SqliteDictReader.get_dicts_by_locations, two parameters each, below the
+# default limit of 999 parameters of older SQLite versions
+LOCATIONS_PER_QUERY = 400
+# Page cache of each connection, in KiB, on top of the memory-mapped file
+DEFAULT_PAGE_CACHE_SIZE = 2048
+
+SCHEMA = '''
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE entries (number INTEGER PRIMARY KEY, word TEXT NOT NULL, sort_key BLOB NOT NULL,
+                      offset INTEGER NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL);
+CREATE TABLE synonyms (word TEXT NOT NULL, sort_key BLOB NOT NULL, number INTEGER NOT NULL);
+'''
+# Created once the tables are filled, which is faster than maintaining them row by row
+INDEXES = '''
+CREATE INDEX entries_word ON entries (word);
+CREATE INDEX entries_offset ON entries (offset, size);
+CREATE INDEX entries_sort_key ON entries (sort_key, word);
+CREATE INDEX synonyms_word ON synonyms (word);
+CREATE INDEX synonyms_sort_key ON synonyms (sort_key, word);
+'''
+FULLTEXT_SCHEMA = '''
+CREATE VIRTUAL TABLE fulltext USING fts5 (text, content='', tokenize='unicode61 remove_diacritics 0');
+'''
+
+
+def get_sort_key(word_str):
+    """Get the sort_key column of a word: stardict_strcmp_key as a single BLOB, which SQLite compares byte-wise.
+    The folded word and the word are separated by a null byte, which no word contains, so that the BLOBs compare
+    like the tuples.
+
+    """
+    folded_word, word = stardict_strcmp_key(word_str.encode('utf-8'))
+    return folded_word + b'\0' + word
+
+
+def get_store_filename(store_dirpath, name):
+    return os.path.join(store_dirpath, name + STORE_EXT)
+
+
+def get_store_sources(filepaths):
+    """Get the files a store is imported from: the StarDict files, or the package of a dictionary without them.
+
+    Arguments:
+    - `filepaths`: the files of the dictionary, as returned by find_dictionary_filepaths.
+    """
+    if 'ifo' in filepaths:
+        return get_package_sources(filepaths)
+    return [filepaths['package']]
+
+
+def get_store_key(filepaths, name):
+    return get_source_key(get_store_sources(filepaths), format=STORE_FORMAT, store_version=STORE_VERSION, name=name)
+
+
+def import_dictionary(dictionary_path, filename, batch_size=DEFAULT_BATCH_SIZE, fulltext=False, callback=None):
+    """Import a dictionary into a store.
+    The entries are read in .idx order, in batches inserted in one transaction each, so the memory used does not
+    depend on the size of the dictionary. The store is written aside and renamed, so readers never see a partial
+    store.
+
+    Arguments:
+    - `dictionary_path`: the dictionary directory.
+    - `filename`: the store filename.
+    - `batch_size`: the number of entries inserted per transaction.
+    - `fulltext`: also fill the fulltext table.
+    - `callback`: function called with (done, total) numbers of entries after each batch.
+    Return:
+    The store filename.
+    """
+    filepaths = find_dictionary_filepaths(dictionary_path)
+    if not filepaths:
+        print('Invalid dictionary')
+        raise ValueError
+    dictionary = Dictionary(dictionary_path, compact_index=True, use_package='ifo' not in filepaths)
+    key = get_store_key(filepaths, dictionary.name)
+    if 'ifo' in filepaths:
+        with open(filepaths['ifo'], encoding='utf-8') as ifo_file:
+            ifo = ifo_file.read()
+    else:
+        ifo = read_package(filepaths['package']).get_bytes('ifo').decode('utf-8')
+
+    temp_filename = '{}.{:d}.tmp'.format(filename, os.getpid())
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+    connection = sqlite3.connect(temp_filename, isolation_level=None)
+    try:
+        # The file is renamed only once complete: no journal is needed
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SCHEMA)
+        if fulltext:
+            connection.executescript(FULLTEXT_SCHEMA)
+
+        # The .idx file rather than the wordcount of the .ifo file, which may be missing or wrong
+        total = len(dictionary.idx_reader)
+        idx_reader, dict_reader = dictionary.idx_reader, dictionary.dict_reader
+        for first in range(0, total, batch_size):
+            numbers = range(first, min(first + batch_size, total))
+            indexes = [idx_reader.get_index_by_num(number) for number in numbers]
+            entries = dict_reader.get_dicts_by_locations([index[1:] for index in indexes])
+            connection.execute('BEGIN')
+            connection.executemany(
+                'INSERT INTO entries (number, word, sort_key, offset, size, data) VALUES (?, ?, ?, ?, ?, ?)',
+                ((number, word_str, get_sort_key(word_str), offset, size, entry.tobytes())
+                 for number, (word_str, offset, size), entry in zip(numbers, indexes, entries)))
+            if fulltext:
+                # The words as fulltext.tokenize gives them, which the queries go through too: the tokenizer of
+                # the table only lowercases, it does not case-fold ("Straße" would not match "strasse")
+                connection.executemany(
+                    'INSERT INTO fulltext (rowid, text) VALUES (?, ?)',
+                    ((number, ' '.join(term for text in get_entry_texts(entry) for term in tokenize(text)))
+                     for number, entry in zip(numbers, entries)))
+            connection.execute('COMMIT')
+            if callback is not None:
+                callback(numbers.stop, total)
+
+        syn_reader = dictionary.syn_reader
+        if syn_reader is not None:
+            connection.execute('BEGIN')
+            batch = []
+            for word_str in syn_reader.iter_words():
+                sort_key = get_sort_key(word_str)
+                batch.extend((word_str, sort_key, number) for number in syn_reader.get_syn(word_str))
+                if len(batch) >= batch_size:
+                    connection.executemany('INSERT INTO synonyms (word, sort_key, number) VALUES (?, ?, ?)', batch)
+                    batch = []
+            connection.executemany('INSERT INTO synonyms (word, sort_key, number) VALUES (?, ?, ?)', batch)
+            connection.execute('COMMIT')
+
+        connection.executescript(INDEXES)
+        connection.executemany('INSERT INTO meta (name, value) VALUES (?, ?)',
+                               [('key', json.dumps(key)), ('ifo', ifo)])
+        connection.execute('ANALYZE')
+    except BaseException:
+        connection.close()
+        os.remove(temp_filename)
+        raise
+    connection.close()
+    os.replace(temp_filename, filename)
+    return filename
+
+
+def read_store_key(filename):
+    """Read the import key of a store.
+
+    Return:
+    The key, or None if the file is missing or is not a store.
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        connection = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True)
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE name = 'key'").fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row else None
+
+
+class SqliteStore(object):
+    """Read-only access to a store file, with a connection per thread.
+    The file is memory-mapped by SQLite, so that its pages are shared with the other processes reading it.
+    """
+
+    def __init__(self, filename, page_cache_size=DEFAULT_PAGE_CACHE_SIZE):
+        """Constructor.
+
+        Arguments:
+        - `filename`: the store filename.
+        - `page_cache_size`: the page cache of each connection, in KiB.
+        """
+        self.filename = filename
+        self.page_cache_size = page_cache_size
+        self._local = threading.local()
+        self._connections = 0
+
+    def _connect(self):
+        connection = sqlite3.connect('file:{}?mode=ro'.format(self.filename), uri=True)
+        connection.execute('PRAGMA mmap_size = {:d}'.format(os.path.getsize(self.filename)))
+        connection.execute('PRAGMA cache_size = -{:d}'.format(self.page_cache_size))
+        return connection
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            self._connections += 1
+        return connection
+
+    def execute(self, sql, parameters=()):
+        """Run a query on the connection of the calling thread.
+
+        Return:
+        The list of the result rows.
+        """
+        return self._get_connection().execute(sql, parameters).fetchall()
+
+    def iterate(self, sql, parameters=()):
+        """Run a query on the connection of the calling thread, without fetching all its rows at once.
+
+        Return:
+        An iterator of the result rows.
+        """
+        return iter(self._get_connection().execute(sql, parameters))
+
+    def close(self):
+        """Drop the connections. Each one is closed once its thread no longer uses it.
+
+        """
+        self._local = threading.local()
+        self._connections = 0
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the store, see stardict.get_memory_usage.
+        The heap part is the page cache budget of the open connections.
+
+        """
+        return {'heap_bytes': self._connections * self.page_cache_size * 1024,
+                'mapped_bytes': os.path.getsize(self.filename)}
+
+
+class SqliteIdxReader(object):
+    """Lookups of the .idx entries of a store, like IdxFileReader.
+
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return self._store.execute('SELECT COUNT(*) FROM entries')[0][0]
+
+    def get_index_by_num(self, number):
+        """Get index infomation of a specified entry in .idx file by origin index.
+        May raise IndexError if number is out of range.
+
+        Arguments:
+        - `number`: the origin index of the entry in .idx file
+        Return:
+        A tuple in form of (word_str, word_data_offset, word_data_size)
+        """
+        rows = self._store.execute('SELECT word, offset, size FROM entries WHERE number = ?', (number,))
+        if not rows:
+            raise IndexError("Index out of range! Acessing the {:d} index".format(number))
+        return rows[0]
+
+    def get_index_by_word(self, word_str):
+        """Get index infomation of a specified word entry.
+
+        Arguments:
+        - `word_str`: name of word entry.
+        Return:
+        Index infomation corresponding to the specified word if exists, otherwise empty list.
+        A list of tuples in form of (word_data_offset, word_data_size), in file order.
+        """
+        return self._store.execute('SELECT offset, size FROM entries WHERE word = ? ORDER BY number', (word_str,))
+
+    def get_numbers_by_word(self, word_str):
+        """Get the origin indexes of the entries of a word in .idx file.
+
+        """
+        return [row[0] for row in self._store.execute(
+            'SELECT number FROM entries WHERE word = ? ORDER BY number', (word_str,))]
+
+    def get_all_words(self):
+        return {row[0] for row in self._store.execute('SELECT DISTINCT word FROM entries')}
+
+    def iter_words(self):
+        """Iterate over the words of the dictionary in stardict_strcmp() order, each word once.
+
+        """
+        return (row[1] for row in self._store.iterate(
+            'SELECT DISTINCT sort_key, word FROM entries ORDER BY sort_key'))
+
+
+class SqliteSynReader(object):
+    """Lookups of the .syn entries of a store, like SynFileReader.
+
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def get_syn(self, synonym_word):
+        """Get the origin indexes in .idx file of the entries named by a synonym.
+
+        """
+        return [row[0] for row in self._store.execute(
+            'SELECT number FROM synonyms WHERE word = ? ORDER BY rowid', (synonym_word,))]
+
+    def iter_words(self):
+        """Iterate over the synonyms in stardict_strcmp() order, each synonym once.
+
+        """
+        return (row[1] for row in self._store.iterate(
+            'SELECT DISTINCT sort_key, word FROM synonyms ORDER BY sort_key'))
+
+
+class SqliteDictReader(object):
+    """Reads of the .dict data of a store, like DictFileReader. Entries are Entry objects over copies of the data.
+
+    """
+
+    def __init__(self, store, dict_ifo):
+        self._store = store
+        self._layout = compile_layout(dict_ifo.get_ifo("sametypesequence"))
+
+    def _make_entry(self, data):
+        return Entry(data, 0, len(data), self._layout)
+
+    def get_dict_by_word(self, word):
+        return [self._make_entry(row[0]) for row in self._store.execute(
+            'SELECT data FROM entries WHERE word = ? ORDER BY number', (word,))]
+
+    def get_dict_by_index(self, index):
+        rows = self._store.execute('SELECT data FROM entries WHERE number = ?', (index,))
+        if not rows:
+            raise IndexError("Index out of range! Acessing the {:d} index".format(index))
+        return self._make_entry(rows[0][0])
+
+    def get_dicts_by_locations(self, locations):
+        """Get the dictionary data of many entries at once, LOCATIONS_PER_QUERY locations per query.
+        Raise IndexError if no entry of the store has one of the locations.
+
+        Arguments:
+        - `locations`: a list of tuples (word_data_offset, word_data_size), as returned by get_index_by_word.
+        Return:
+        The list of the dictionary data of the entries, as Entry objects, in the order of `locations`.
+        """
+        data = {}
+        unique_locations = list(dict.fromkeys(tuple(location) for location in locations))
+        for first in range(0, len(unique_locations), LOCATIONS_PER_QUERY):
+            batch = unique_locations[first:first + LOCATIONS_PER_QUERY]
+            rows = self._store.execute(
+                'SELECT offset, size, data FROM entries WHERE (offset, size) IN (VALUES {})'.format(
+                    ', '.join(['(?, ?)'] * len(batch))),
+                [value for location in batch for value in location])
+            for offset, size, entry_data in rows:
+                data[offset, size] = entry_data
+        result = []
+        for offset, size in locations:
+            entry_data = data.get((offset, size))
+            if entry_data is None:
+                raise IndexError("No entry at offset {:d} with size {:d}".format(offset, size))
+            result.append(self._make_entry(entry_data))
+        return result
+
+    def cache_stats(self):
+        return None
+
+
+class SqliteFullTextIndex(object):
+    """Full-text search over the fulltext table of a store, with the query syntax of fulltext.FullTextIndex.
+
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def search(self, query, limit=None):
+        """Find the entries matching a query: words, and phrases in double quotes, all of them required.
+
+        Arguments:
+        - `query`: the query, like: Haus "big house".
+        - `limit`: the maximum number of entries, or None for all of them.
+        Return:
+        The list of the entry numbers, in increasing order.
+        """
+        # Quote each term, so that no character of the query is taken as FTS5 syntax
+        phrases = []
+        for match in QUERY_PATTERN.finditer(query):
+            terms = tokenize(match.group(1) if match.group(1) is not None else match.group(2))
+            if terms:
+                phrases.append('"{}"'.format(' '.join(terms)))
+        if not phrases:
+            return []
+        return [row[0] for row in self._store.execute(
+            'SELECT rowid FROM fulltext WHERE fulltext MATCH ? ORDER BY rowid LIMIT ?',
+            (' AND '.join(phrases), -1 if limit is None else limit))]
+
+
+class SqliteDictionary(object):
+    """A dictionary looked up in its store, with the lookup interface of stardict.Dictionary.
+
+    """
+
+    def __init__(self, dictionary_path, filename, resource_cache_size=DEFAULT_RESOURCE_CACHE_SIZE,
+                 page_cache_size=DEFAULT_PAGE_CACHE_SIZE):
+        """Constructor.
+        Raise ValueError if the store is missing or out of date.
+
+        Arguments:
+        - `dictionary_path`: the dictionary directory, which the store must have been imported from as it is now.
+        - `filename`: the store filename.
+        - `resource_cache_size`: the budget in bytes of the cache of the resources, see stardict.ResourceStorage.
+        - `page_cache_size`: the page cache of each connection, in KiB.
+        """
+        start_time = time.perf_counter()
+        filepaths = find_dictionary_filepaths(dictionary_path)
+        if not filepaths:
+            raise ValueError('Invalid dictionary {}'.format(dictionary_path))
+        self.name = os.path.basename(os.path.normpath(dictionary_path))
+        key = read_store_key(filename)
+        if key is None or key != get_store_key(filepaths, self.name):
+            raise ValueError('No up to date store {}'.format(filename))
+        self._filepaths = filepaths
+        self._store = SqliteStore(filename, page_cache_size)
+        self.ifo_reader = IfoFileReader.from_string(
+            self._store.execute("SELECT value FROM meta WHERE name = 'ifo'")[0][0], filename)
+        self.index_offset_bits = self.ifo_reader.get_index_offset_bits()
+        self.source_key = key
+        self.idx_reader = SqliteIdxReader(self._store)
+        self.syn_reader = SqliteSynReader(self._store) if self._store.execute(
+            'SELECT 1 FROM synonyms LIMIT 1') else None
+        self.dict_reader = SqliteDictReader(self._store, self.ifo_reader)
+        self.fulltext_index = SqliteFullTextIndex(self._store) if self._store.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'fulltext'") else None
+        self._resource_cache_size = resource_cache_size
+        self._resources = None
+        self._resources_lock = threading.Lock()
+        self.load_time = time.perf_counter() - start_time
+        self.load_phases = {'store': self.load_time}
+
+    @property
+    def loaded(self):
+        return True
+
+    def open(self):
+        pass
+
+    def close(self):
+        """Drop the connections and the resources; they are opened again on the next access.
+
+        """
+        self._store.close()
+        self._resources = None
+
+    @property
+    def has_resources(self):
+        return any(key in self._filepaths for key in ('rifo', 'res'))
+
+    @property
+    def resources(self):
+        resources = self._resources
+        if resources is None and self.has_resources:
+            with self._resources_lock:
+                if self._resources is None:
+                    self._resources = open_resource_storage(self._filepaths, self._resource_cache_size)
+                resources = self._resources
+        return resources
+
+    def resolve(self, word_str):
+        """Get the entries named by a word, as a headword or as a synonym.
+
+        Arguments:
+        - `word_str`: the word.
+        Return:
+        The list of the origin indexes of the entries in .idx file, headword entries first, without duplicates.
+        """
+        numbers = self.idx_reader.get_numbers_by_word(word_str)
+        if self.syn_reader:
+            numbers.extend(self.syn_reader.get_syn(word_str))
+        return list(dict.fromkeys(numbers))
+
+    def get_memory_usage(self):
+        usage = {'store': self._store.get_memory_usage()}
+        resources = self._resources
+        if resources is not None:
+            usage['resources'] = resources.get_memory_usage()
+        return usage
+
+    def get_content_key(self, **params):
+        """Identify the state of the store, see snapshot.get_source_key.
+
+        Arguments:
+        - `params`: any other value the key depends on.
+        """
+        return get_source_key([self._store.filename], **params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import StarDict dictionaries into SQLite stores.')
+    parser.add_argument('store_dir', help='directory of the stores')
+    parser.add_argument('paths', nargs='+',
+                        help='dictionary directories, or directories of installed dictionaries')
+    parser.add_argument('--fulltext', action='store_true',
+                        help='index the definition texts for full-text search')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='number of entries inserted per transaction')
+    args = parser.parse_args()
+    if args.batch_size <= 0:
+        parser.error('The batch size must be positive')
+
+    dictionary_paths = []
+    for path in args.paths:
+        if find_dictionary_filepaths(path):
+            dictionary_paths.append(os.path.abspath(path))
+        else:
+            dictionary_paths.extend(sorted(find_installed_dictionaries_paths(path)))
+
+    os.makedirs(args.store_dir, exist_ok=True)
+    failures = 0
+    for dictionary_path in dictionary_paths:
+        filename = get_store_filename(args.store_dir, os.path.basename(dictionary_path))
+        start_time = time.perf_counter()
+        try:
+            import_dictionary(dictionary_path, filename, batch_size=args.batch_size, fulltext=args.fulltext)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print('Cannot import {}: {}'.format(dictionary_path, e))
+            failures += 1
+            continue
+        print('Imported {} in {:.2f}s'.format(filename, time.perf_counter() - start_time))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Test of the SQLite store of a dictionary against the dictionary files.
+
+Usage: python sqlite_store_test.py
+
+A small German dictionary is imported with its full-text table. The lookups of the store must give the entries of
+the files, batched reads must keep the order of the locations and reject unknown ones, and full-text queries must
+case-fold like fulltext.FullTextIndex: "Straße", "STRASSE" and "strasse" find the same entries.
+"""
+import os
+import struct
+import tempfile
+from fulltext import FullTextIndexBuilder
+from sqlite_store import SqliteDictionary, import_dictionary, LOCATIONS_PER_QUERY
+from stardict import Dictionary
+
+# Headword and definition, in .idx order
+ENTRIES = [
+    ('Gasse', 'eine schmale Straße'),
+    ('groß', 'GROSS und breit'),
+    ('Maß', 'das Maß aller Dinge'),
+    ('Straße', 'Die Straße führt zum Haus'),
+    ('Weg', 'kein Weg, keine STRASSE'),
+] + [('wort{:04d}'.format(number), 'Definition {:d}'.format(number)) for number in range(1000)]
+QUERIES = {
+    'Straße': ['Gasse', 'Straße', 'Weg'],
+    'STRASSE': ['Gasse', 'Straße', 'Weg'],
+    'strasse': ['Gasse', 'Straße', 'Weg'],
+    'Maß': ['Maß'],
+    '"die straße"': ['Straße'],
+    'groß': ['groß'],
+    'Definition 999': ['wort0999'],
+}
+
+
+def make_dictionary(dirpath):
+    name = os.path.basename(dirpath)
+    os.makedirs(dirpath)
+    idx = bytearray()
+    offset = 0
+    with open(os.path.join(dirpath, name + '.dict'), 'wb') as f:
+        for word_str, definition in ENTRIES:
+            data = definition.encode('utf-8')
+            f.write(data)
+            idx += word_str.encode('utf-8') + b'\0' + struct.pack('!II', offset, len(data))
+            offset += len(data)
+    with open(os.path.join(dirpath, name + '.idx'), 'wb') as f:
+        f.write(idx)
+    with open(os.path.join(dirpath, name + '.ifo'), 'w', encoding='utf-8') as f:
+        f.write("StarDict's dict ifo file\nversion=2.4.2\nbookname={}\nwordcount={:d}\nidxfilesize={:d}\n"
+                "sametypesequence=m\n".format(name, len(ENTRIES), len(idx)))
+
+
+def check_lookups(original, store):
+    assert len(store.idx_reader) == len(original.idx_reader) == len(ENTRIES)
+    for number, (word_str, definition) in enumerate(ENTRIES):
+        assert store.idx_reader.get_index_by_num(number) == tuple(original.idx_reader.get_index_by_num(number))
+        assert [entry['m'] for entry in store.dict_reader.get_dict_by_word(word_str)] == [definition]
+    # More locations than a query takes, in reverse order and with a duplicate
+    locations = [tuple(original.idx_reader.get_index_by_num(number)[1:]) for number in range(len(ENTRIES))]
+    locations = locations[::-1] + locations[:1]
+    assert len(locations) > LOCATIONS_PER_QUERY
+    assert ([entry.tobytes() for entry in store.dict_reader.get_dicts_by_locations(locations)] ==
+            [entry.tobytes() for entry in original.dict_reader.get_dicts_by_locations(locations)])
+    try:
+        store.dict_reader.get_dicts_by_locations(locations[:1] + [(1, 1)])
+    except IndexError:
+        pass
+    else:
+        raise AssertionError('an unknown location is accepted')
+
+
+def check_fulltext(original, store, fulltext_filename):
+    # The file index is built over the store, as StarDict.build_fulltext_index does for a store dictionary
+    builder = FullTextIndexBuilder(store, fulltext_filename)
+    file_index = builder.build()
+    assert builder.total == len(ENTRIES)
+    for query, expected in QUERIES.items():
+        numbers = store.fulltext_index.search(query)
+        words = [original.idx_reader.get_index_by_num(number)[0] for number in numbers]
+        assert words == expected, (query, words, expected)
+        assert file_index.search(query) == numbers, (query, file_index.search(query), numbers)
+        assert store.fulltext_index.search(query, 1) == numbers[:1]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirpath:
+        dictionary_path = os.path.join(dirpath, 'german')
+        make_dictionary(dictionary_path)
+        store_filename = os.path.join(dirpath, 'german.sqlite')
+        import_dictionary(dictionary_path, store_filename, batch_size=100, fulltext=True)
+        original = Dictionary(dictionary_path, use_package=False)
+        store = SqliteDictionary(dictionary_path, store_filename)
+        check_lookups(original, store)
+        check_fulltext(original, store, os.path.join(dirpath, 'german.fulltext'))
+        store.close()
+    print('{:d} entries and {:d} full-text queries match the dictionary files'.format(len(ENTRIES), len(QUERIES)))
+
+
+if __name__ == '__main__':
+    main()
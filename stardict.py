@@ -2,8 +2,72 @@
 # -*- coding: utf-8 -*-
 import struct
 import gzip
+import heapq
+import io
+import mmap
 import os
-from dictutils import find_dictionary_filepaths
+import re
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from dictutils import find_dictionary_filepaths, map_file
+from dictzip import ChunkedFile, DictzipFile, DictzipFileException, DEFAULT_CACHE_SIZE
+from lrucache import LRUCache
+from snapshot import SNAPSHOT_EXT, SnapshotFile, SnapshotFileException, get_source_key, read_snapshot, \
+    write_snapshot
+
+# Number of entries measured by the memory estimates of the readers holding Python objects
+MEMORY_SAMPLE_SIZE = 1000
+
+
+def stardict_strcmp_key(word):
+    """Sort key equivalent to stardict_strcmp() for an utf-8 encoded word.
+
+    Arguments:
+    - `word`: the word as bytes.
+    Return:
+    A tuple comparing like stardict_strcmp(): ASCII case-insensitive first, then byte-wise.
+    """
+    return (word.lower(), word)
+
+
+def get_memory_usage(*buffers):
+    """Estimate the memory used by bytes-like objects (bytes, arrays, mmaps, memoryviews).
+
+    Arguments:
+    - `buffers`: the objects, None being ignored.
+    Return:
+    A dictionary {'heap_bytes': size of the objects in memory, 'mapped_bytes': size of the memory-mapped file
+    ranges, which the system pages in and out}.
+    """
+    usage = {'heap_bytes': 0, 'mapped_bytes': 0}
+    for buffer in buffers:
+        if buffer is None:
+            continue
+        with memoryview(buffer) as view:
+            owner = view.obj if isinstance(buffer, memoryview) else buffer
+            usage['mapped_bytes' if isinstance(owner, mmap.mmap) else 'heap_bytes'] += view.nbytes
+    return usage
+
+
+def _sample_sizes(values, get_size, sample_size=MEMORY_SAMPLE_SIZE):
+    """Estimate the total size of the values of a sequence from an evenly spaced sample of them.
+
+    Arguments:
+    - `values`: the sequence.
+    - `get_size`: function giving the size in bytes of a value.
+    - `sample_size`: the number of values measured.
+    Return:
+    The estimated total size.
+    """
+    if len(values) <= sample_size:
+        return sum(get_size(value) for value in values)
+    step = len(values) / sample_size
+    total = sum(get_size(values[int(i * step)]) for i in range(sample_size))
+    return int(total * len(values) / sample_size)
 
 
 class IfoFileException(Exception):
@@ -39,30 +103,46 @@ class IfoFileReader(object):
         - `filename`: the filename of .ifo file of stardict.
         May raise IfoFileException during initialization.
         """
+        with open(filename, "r", encoding='utf-8') as ifo_file:
+            self._parse(ifo_file, filename)
+
+    @classmethod
+    def from_string(cls, content, name="<string>"):
+        """Constructor from the content of a .ifo file.
+        May raise IfoFileException.
+
+        Arguments:
+        - `content`: the content of the .ifo file, as a string.
+        - `name`: the name of the content in exception messages.
+        """
+        reader = cls.__new__(cls)
+        reader._parse(io.StringIO(content, newline=None), name)
+        return reader
+
+    def _parse(self, ifo_file, filename):
         self._ifo = dict()
-        with open(filename, "rU", encoding='utf-8') as ifo_file:
-            self._ifo["dict_title"] = ifo_file.readline()  # dictionary title
-            line = ifo_file.readline()  # version info
+        self._ifo["dict_title"] = ifo_file.readline()  # dictionary title
+        line = ifo_file.readline()  # version info
+        key, equal, value = line.partition("=")
+        key = key.strip()
+        value = value.strip()
+        # check version info, raise an IfoFileException if error encounted
+        if key != "version":
+            raise IfoFileException(
+                "Version info expected in the second line of {!r:s}!".format(filename))
+        if value != "2.4.2" and value != "3.0.0":
+            raise IfoFileException(
+                "Version expected to be either 2.4.2 or 3.0.0, but {!r:s} read!".format(value))
+        self._ifo[key] = value
+        # read in other infomation in the file
+        for line in ifo_file:
             key, equal, value = line.partition("=")
             key = key.strip()
             value = value.strip()
-            # check version info, raise an IfoFileException if error encounted
-            if key != "version":
-                raise IfoFileException(
-                    "Version info expected in the second line of {!r:s}!".format(filename))
-            if value != "2.4.2" and value != "3.0.0":
-                raise IfoFileException(
-                    "Version expected to be either 2.4.2 or 3.0.0, but {!r:s} read!".format(value))
             self._ifo[key] = value
-            # read in other infomation in the file
-            for line in ifo_file:
-                key, equal, value = line.partition("=")
-                key = key.strip()
-                value = value.strip()
-                self._ifo[key] = value
-            # check if idxoffsetbits should be discarded due to version info
-            if self._ifo["version"] == "3.0.0" and "idxoffsetbits" in self._ifo:
-                del self._ifo["version"]
+        # idxoffsetbits is only defined since version 3.0.0, discard it otherwise
+        if self._ifo["version"] != "3.0.0" and "idxoffsetbits" in self._ifo:
+            del self._ifo["idxoffsetbits"]
 
     def get_ifo(self, key):
         """Get configuration value.
@@ -76,6 +156,23 @@ class IfoFileReader(object):
             return False
         return self._ifo[key]
 
+    def get_index_offset_bits(self, key="idxoffsetbits"):
+        """Get the length of the offset field of the .idx file entries.
+        May raise IfoFileException if the value is neither 32 nor 64.
+
+        Arguments:
+        - `key`: the configuration option name, "ridxoffsetbits" for the res.ridx file of a resource storage.
+        Return:
+        32 or 64.
+        """
+        value = self.get_ifo(key)
+        if not value:
+            return 32
+        if value not in ("32", "64"):
+            raise IfoFileException(
+                "{:s} expected to be either 32 or 64, but {!r:s} read!".format(key, value))
+        return int(value)
+
 
 class IdxFileReader(object):
     """Read dictionary indexes from the .idx file and store the indexes in a list and a dictionary.
@@ -148,7 +245,7 @@ class IdxFileReader(object):
             self._offset += 4
         elif self._index_offset_bits == 64:
             word_data_offset, = struct.unpack(
-                "!I", self._content[self._offset:self._offset + 8])
+                "!Q", self._content[self._offset:self._offset + 8])
             self._offset += 8
         else:
             raise ValueError
@@ -164,6 +261,9 @@ class IdxFileReader(object):
 
         return (word_str, word_data_offset, word_data_size, self._index)
 
+    def __len__(self):
+        return len(self._index_idx)
+
     def get_index_by_num(self, number):
         """Get index infomation of a specified entry in .idx file by origin index.
         May raise IndexError if number is out of range.
@@ -195,6 +295,16 @@ class IdxFileReader(object):
             indexes.append(self._index_idx[number][1:])
         return indexes
 
+    def get_numbers_by_word(self, word_str):
+        """Get the origin indexes of the entries of a word in .idx file.
+
+        Arguments:
+        - `word_str`: name of word entry.
+        Return:
+        The list of origin indexes, in file order, empty if the word does not exist.
+        """
+        return list(self._word_idx.get(word_str, []))
+
     def get_all_words(self):
         """Get all words in an dictionary
 
@@ -204,6 +314,272 @@ class IdxFileReader(object):
 
         return {data[0] for data in self._index_idx}
 
+    def iter_words(self):
+        """Iterate over the words of the dictionary in stardict_strcmp() order, each word once.
+
+        """
+        return iter(sorted(self._word_idx, key=lambda word_str: stardict_strcmp_key(word_str.encode('utf-8'))))
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+
+        """
+        heap_bytes = sys.getsizeof(self._index_idx) + sys.getsizeof(self._word_idx)
+        heap_bytes += _sample_sizes(self._index_idx,
+                                    lambda index: sys.getsizeof(index) + sum(sys.getsizeof(value) for value in index))
+        heap_bytes += _sample_sizes(list(self._word_idx.values()), sys.getsizeof)
+        return {'heap_bytes': heap_bytes, 'mapped_bytes': 0}
+
+
+class CompactWordTable(object):
+    """Base class of the compact readers: a table of utf-8 words sorted in stardict_strcmp() order.
+    The words stay as byte ranges of a buffer (a memory-mapped file or a snapshot), the word of entry i being
+    content[base + word_starts[i]:base + word_starts[i + 1] - stride]. Binary search follows the order of the
+    entries in the file; if the file turns out not to be sorted, a sorted permutation of the entries is used.
+    """
+    # Sort key of a word as bytes
+    sort_key = staticmethod(stardict_strcmp_key)
+
+    def _index_content(self, content, entry_tail, typecodes):
+        """Index the entries of a .idx or .syn file: a null terminated word followed by `entry_tail`.
+
+        Arguments:
+        - `content`: the file content.
+        - `entry_tail`: struct.Struct of the fields following each word.
+        - `typecodes`: array typecodes of the columns storing the fields.
+        Return:
+        The list of columns, one array per field of `entry_tail`.
+        """
+        word_starts = array("I" if len(content) < 2 ** 32 else "Q")
+        columns = [array(typecode) for typecode in typecodes]
+        appends = [column.append for column in columns]
+        unpack_tail = entry_tail.unpack_from
+        stride = 1 + entry_tail.size
+        length = len(content)
+        sort_key = self.sort_key
+        in_order = True
+        previous_key = sort_key(b"")
+        offset = 0
+        while offset < length:
+            end = content.find(b'\x00', offset)
+            if end == -1 or end + stride > length:
+                break
+            word_starts.append(offset)
+            for append, value in zip(appends, unpack_tail(content, end + 1)):
+                append(value)
+            if in_order:
+                key = sort_key(content[offset:end])
+                in_order = previous_key <= key
+                previous_key = key
+            offset = end + stride
+        # Sentinel: the word of the last entry ends at word_starts[-1] - stride
+        word_starts.append(offset)
+
+        self._init_words(content, 0, word_starts, stride)
+        if not in_order:
+            self._order = array("I", sorted(range(self._count), key=self._get_key))
+        return columns
+
+    def _init_words(self, content, base, word_starts, stride, order=None):
+        self._content = content
+        self._base = base
+        self._word_starts = word_starts
+        self._stride = stride
+        self._order = order
+        self._count = len(word_starts) - 1
+
+    def _get_word(self, number):
+        return self._content[self._base + self._word_starts[number]:
+                             self._base + self._word_starts[number + 1] - self._stride]
+
+    def _get_key(self, number):
+        return self.sort_key(self._get_word(number))
+
+    def _get_number(self, position):
+        if self._order is None:
+            return position
+        return self._order[position]
+
+    def _find_numbers(self, word):
+        """Binary search a word in sorted order.
+
+        Arguments:
+        - `word`: the word as bytes.
+        Return:
+        The list of origin indexes of the entries named `word`, in file order.
+        """
+        key = self.sort_key(word)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key(self._get_number(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        numbers = []
+        while low < self._count:
+            number = self._get_number(low)
+            if self._get_word(number) != word:
+                break
+            numbers.append(number)
+            low += 1
+        return numbers
+
+    def _get_word_sections(self):
+        if self._stride == 1 and self._base == 0:
+            words, word_starts = self._content, self._word_starts
+        else:
+            # Drop the binary fields between the words
+            words = bytearray()
+            word_starts = array("I" if len(self._content) < 2 ** 32 else "Q")
+            for number in range(self._count):
+                word_starts.append(len(words))
+                words += self._get_word(number)
+                words += b'\x00'
+            word_starts.append(len(words))
+        sections = {"words": words, "word_starts": word_starts}
+        if self._order is not None:
+            sections["order"] = self._order
+        return sections
+
+    def _init_words_from_snapshot(self, snapshot, prefix):
+        self._init_words(snapshot.content, snapshot.get_offset(prefix + "words"),
+                         snapshot.get_array(prefix + "word_starts"), 1,
+                         snapshot.get_array(prefix + "order"))
+
+    def _get_word_buffers(self):
+        # The words only, not the whole snapshot they may be read from
+        words = memoryview(self._content)[self._base:self._base + self._word_starts[-1]]
+        return [words, self._word_starts, self._order]
+
+    def iter_words(self):
+        """Iterate over the words of the table in stardict_strcmp() order, each word once.
+
+        """
+        previous = None
+        for position in range(self._count):
+            word = self._get_word(self._get_number(position))
+            if word != previous:
+                yield word.decode('utf-8')
+                previous = word
+
+
+class CompactIdxFileReader(CompactWordTable):
+    """Read dictionary indexes from the .idx file into compact columns.
+    The .idx file is memory-mapped (decompressed once if gzipped) and the headwords stay in it as byte ranges.
+    Data offsets and sizes are kept in arrays, so no Python object is created per entry.
+    Lookup by word is a binary search over the stardict_strcmp() order the .idx file is sorted in.
+    Results are the same as the ones of IdxFileReader.
+    """
+
+    def __init__(self, filename, compressed=False, index_offset_bits=32):
+        """Constructor.
+
+        Arguments:
+        - `filename`: the filename of .idx file of stardict.
+        - `compressed`: indicate whether the .idx file is compressed.
+        - `index_offset_bits`: the offset field length in bits.
+        """
+        if index_offset_bits == 32:
+            entry_tail = struct.Struct("!II")
+            offset_typecode = "I"
+        elif index_offset_bits == 64:
+            entry_tail = struct.Struct("!QI")
+            offset_typecode = "Q"
+        else:
+            raise ValueError
+
+        # Open file
+        if compressed:
+            with gzip.open(filename, "rb") as index_file:
+                content = index_file.read()
+        else:
+            content = map_file(filename)
+
+        # Indexing: word_str, word_data_offset and word_data_size columns
+        self._offsets, self._sizes = self._index_content(
+            content, entry_tail, (offset_typecode, "I"))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, prefix="idx."):
+        """Build the reader from the sections written by get_sections.
+
+        Arguments:
+        - `snapshot`: snapshot.SnapshotFile object.
+        - `prefix`: prefix of the section names.
+        """
+        reader = cls.__new__(cls)
+        reader._init_words_from_snapshot(snapshot, prefix)
+        reader._offsets = snapshot.get_array(prefix + "offsets")
+        reader._sizes = snapshot.get_array(prefix + "sizes")
+        return reader
+
+    def get_sections(self):
+        """Get the columns of the reader, to be saved in a snapshot.
+
+        Return:
+        A dictionary {section_name: bytes-like object}.
+        """
+        sections = self._get_word_sections()
+        sections["offsets"] = self._offsets
+        sections["sizes"] = self._sizes
+        return sections
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+
+        """
+        return get_memory_usage(*self._get_word_buffers(), self._offsets, self._sizes)
+
+    def __len__(self):
+        return self._count
+
+    def get_index_by_num(self, number):
+        """Get index infomation of a specified entry in .idx file by origin index.
+        May raise IndexError if number is out of range.
+
+        Arguments:
+        - `number`: the origin index of the entry in .idx file
+        Return:
+        A tuple in form of (word_str, word_data_offset, word_data_size)
+        """
+        if number >= self._count:
+            raise IndexError("Index out of range! Acessing the {:d} index but totally {:d}".format(
+                number, self._count))
+        if number < 0:
+            number += self._count
+        return (self._get_word(number).decode('utf-8'), self._offsets[number], self._sizes[number])
+
+    def get_index_by_word(self, word_str):
+        """Get index infomation of a specified word entry.
+
+        Arguments:
+        - `word_str`: name of word entry.
+        Return:
+        Index infomation corresponding to the specified word if exists, otherwise an empty list.
+        The index infomation returned is a list of tuples, in form of [(word_data_offset, word_data_size) ...]
+        """
+        numbers = self._find_numbers(word_str.encode('utf-8'))
+        return [(self._offsets[number], self._sizes[number]) for number in numbers]
+
+    def get_numbers_by_word(self, word_str):
+        """Get the origin indexes of the entries of a word in .idx file.
+
+        Arguments:
+        - `word_str`: name of word entry.
+        Return:
+        The list of origin indexes, in file order, empty if the word does not exist.
+        """
+        return self._find_numbers(word_str.encode('utf-8'))
+
+    def get_all_words(self):
+        """Get all words in an dictionary
+
+        Return:
+        A set of words
+        """
+        return {self._get_word(number).decode('utf-8') for number in range(self._count)}
+
 
 class SynFileReader(object):
     """Read infomation from .syn file and form a dictionary as below:
@@ -251,29 +627,396 @@ class SynFileReader(object):
             return []
         return self._syn[synonym_word]
 
+    def iter_synonyms(self):
+        """Iterate over the synonyms, grouped by word in the order of their first occurrence in the .syn file.
+
+        Return:
+        An iterator of tuples (synonym_word, original_word_index).
+        """
+        for synonym_word, indexes in self._syn.items():
+            for index in indexes:
+                yield synonym_word, index
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+
+        """
+        heap_bytes = sys.getsizeof(self._syn)
+        heap_bytes += _sample_sizes(list(self._syn.items()), lambda item: sys.getsizeof(item[0]) + sys.getsizeof(
+            item[1]) + sum(sys.getsizeof(index) for index in item[1]))
+        return {'heap_bytes': heap_bytes, 'mapped_bytes': 0}
+
+
+class CompactSynFileReader(CompactWordTable):
+    """Read the .syn file into a compact table, like CompactIdxFileReader does for the .idx file.
+    The .syn file is memory-mapped and the original word indexes are kept in an array.
+    Results are the same as the ones of SynFileReader.
+    """
+
+    def __init__(self, filename):
+        """Constructor.
+
+        Arguments:
+        - `filename`: The filename of .syn file of stardict.
+        """
+        content = map_file(filename)
+        self._indexes, = self._index_content(
+            content, struct.Struct("!I"), ("I",))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, prefix="syn."):
+        """Build the reader from the sections written by get_sections.
+
+        Arguments:
+        - `snapshot`: snapshot.SnapshotFile object.
+        - `prefix`: prefix of the section names.
+        """
+        reader = cls.__new__(cls)
+        reader._init_words_from_snapshot(snapshot, prefix)
+        reader._indexes = snapshot.get_array(prefix + "indexes")
+        return reader
+
+    def get_sections(self):
+        """Get the columns of the reader, to be saved in a snapshot.
+
+        Return:
+        A dictionary {section_name: bytes-like object}.
+        """
+        sections = self._get_word_sections()
+        sections["indexes"] = self._indexes
+        return sections
+
+    def get_syn(self, synonym_word):
+        """
+
+        Arguments:
+        - `synonym_word`: synonym word.
+        Return:
+        If synonym_word exists in the .syn file, return the corresponding indexes, otherwise an empty list.
+        """
+        numbers = self._find_numbers(synonym_word.encode('utf-8'))
+        return [self._indexes[number] for number in numbers]
+
+    def iter_synonyms(self):
+        """Iterate over the synonyms in .syn file order.
+
+        Return:
+        An iterator of tuples (synonym_word, original_word_index).
+        """
+        for number in range(self._count):
+            yield self._get_word(number).decode('utf-8'), self._indexes[number]
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+
+        """
+        return get_memory_usage(*self._get_word_buffers(), self._indexes)
+
+
+class WordResolver(object):
+    """Resolve a word to the .idx entries it names, as a headword or as a synonym, with a single binary search.
+    The headwords of a CompactIdxFileReader and the synonyms of a CompactSynFileReader are merged in
+    stardict_strcmp() order into an array of slots: slot n < number of entries stands for the headword of entry n,
+    slot number of entries + m for the synonym m of the .syn file. The words themselves stay in the readers.
+    """
+
+    def __init__(self, idx_reader, syn_reader=None, slots=None):
+        """Constructor.
+
+        Arguments:
+        - `idx_reader`: CompactIdxFileReader object.
+        - `syn_reader`: CompactSynFileReader object, or None.
+        - `slots`: the merged slots, as returned by get_sections, computed if not given.
+        """
+        self._idx_reader = idx_reader
+        self._syn_reader = syn_reader
+        self._idx_count = idx_reader._count
+        if slots is None:
+            slots = self._merge()
+        self._slots = slots
+
+    def _merge(self):
+        idx_reader, syn_reader = self._idx_reader, self._syn_reader
+        total = self._idx_count + (syn_reader._count if syn_reader else 0)
+        slots = array("I" if total < 2 ** 32 else "Q")
+        headwords = (idx_reader._get_number(position) for position in range(idx_reader._count))
+        if syn_reader is None:
+            slots.extend(headwords)
+            return slots
+        synonyms = (self._idx_count + syn_reader._get_number(position) for position in range(syn_reader._count))
+        # Headwords come before synonyms of the same word
+        slots.extend(heapq.merge(headwords, synonyms, key=self._get_key))
+        return slots
+
+    def _get_word(self, slot):
+        if slot < self._idx_count:
+            return self._idx_reader._get_word(slot)
+        return self._syn_reader._get_word(slot - self._idx_count)
+
+    def _get_key(self, slot):
+        return stardict_strcmp_key(self._get_word(slot))
+
+    def get_sections(self):
+        """Get the merged slots, to be saved in a snapshot.
+
+        Return:
+        A dictionary {section_name: bytes-like object}.
+        """
+        return {"slots": self._slots}
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the merged slots, see get_memory_usage.
+
+        """
+        return get_memory_usage(self._slots)
+
+    def resolve(self, word_str):
+        """Get the entries named by a word.
+
+        Arguments:
+        - `word_str`: the word.
+        Return:
+        The list of the origin indexes of the entries in .idx file, headword entries first, without duplicates.
+        """
+        word = word_str.encode('utf-8')
+        key = stardict_strcmp_key(word)
+        slots = self._slots
+        low, high = 0, len(slots)
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key(slots[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        numbers = {}
+        while low < len(slots) and self._get_word(slots[low]) == word:
+            slot = slots[low]
+            if slot < self._idx_count:
+                numbers[slot] = None
+            else:
+                numbers[self._syn_reader._indexes[slot - self._idx_count]] = None
+            low += 1
+        return list(numbers)
+
+
+# Type identifiers of the fields decoded as utf-8 text by Entry; the other fields are returned as bytes
+# ('l' is in the locale encoding of the dictionary author, upper case types are binary)
+TEXT_TYPES = "mgtxykwhnr"
+
+
+def compile_layout(sametypesequence):
+    """Compile the field layout shared by all the entries of a dictionary with a sametypesequence.
+
+    Arguments:
+    - `sametypesequence`: the sametypesequence value of the .ifo file.
+    Return:
+    A tuple of (type_identifier, sized) pairs, `sized` telling whether the field is preceded by its size instead
+    of terminated by a null byte; the last field has neither and runs to the end of the entry.
+    None if `sametypesequence` is empty: each field is then preceded by its type identifier.
+    """
+    if not sametypesequence:
+        return None
+    return tuple((type_identifier, type_identifier.isupper()) for type_identifier in sametypesequence)
+
+
+def _parse_fields(buffer, start, end, layout):
+    """Locate the fields of an entry.
+
+    Return:
+    A dictionary {type_identifier: (field_start, field_end)}, positions in `buffer`.
+    """
+    fields = {}
+    offset = start
+    if layout is not None:
+        last = len(layout) - 1
+        for number, (type_identifier, sized) in enumerate(layout):
+            if number == last:
+                fields[type_identifier] = (offset, end)
+            elif sized:
+                size, = struct.unpack_from("!I", buffer, offset)
+                fields[type_identifier] = (offset + 4, offset + 4 + size)
+                offset += 4 + size
+            else:
+                field_end = buffer.find(b'\x00', offset, end)
+                if field_end == -1:
+                    field_end = end
+                fields[type_identifier] = (offset, field_end)
+                offset = field_end + 1
+        return fields
+
+    while offset < end:
+        type_identifier = chr(buffer[offset])
+        offset += 1
+        if type_identifier.isupper():
+            size, = struct.unpack_from("!I", buffer, offset)
+            offset += 4
+            fields[type_identifier] = (offset, min(offset + size, end))
+            offset += size
+        else:
+            field_end = buffer.find(b'\x00', offset, end)
+            if field_end == -1:
+                field_end = end
+            fields[type_identifier] = (offset, field_end)
+            offset = field_end + 1
+    return fields
+
+
+class Entry(Mapping):
+    """Dictionary data of an entry, a read-only mapping {type_identifier: infomation, ...}.
+    The entry keeps a reference to the buffer holding its data (the .dict file content, or the bytes read for
+    it) and locates its fields on first access. Fields are decoded when accessed: utf-8 text for TEXT_TYPES,
+    bytes for the others. get_raw gives a field without copying it.
+    """
+    __slots__ = ("_buffer", "_start", "_end", "_layout", "_fields")
+
+    def __init__(self, buffer, start, end, layout):
+        """Constructor.
+
+        Arguments:
+        - `buffer`: bytes-like object holding the entry data.
+        - `start`: the position of the entry in `buffer`.
+        - `end`: the end of the entry in `buffer`.
+        - `layout`: the field layout, see compile_layout.
+        """
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._layout = layout
+        self._fields = None
+
+    def _get_fields(self):
+        if self._fields is None:
+            self._fields = _parse_fields(self._buffer, self._start, self._end, self._layout)
+        return self._fields
+
+    @property
+    def size(self):
+        """The size in bytes of the entry data.
+
+        """
+        return self._end - self._start
+
+    def get_raw(self, type_identifier):
+        """Get a field without decoding nor copying it.
+        May raise KeyError if the entry has no such field.
+
+        Arguments:
+        - `type_identifier`: the type identifier of the field.
+        Return:
+        A memoryview of the field data.
+        """
+        field_start, field_end = self._get_fields()[type_identifier]
+        return memoryview(self._buffer)[field_start:field_end]
+
+    def __getitem__(self, type_identifier):
+        raw = self.get_raw(type_identifier)
+        if type_identifier in TEXT_TYPES:
+            return str(raw, "utf-8", "replace")
+        return raw.tobytes()
+
+    def __iter__(self):
+        return iter(self._get_fields())
+
+    def __len__(self):
+        return len(self._get_fields())
+
+    def __repr__(self):
+        return "Entry({!r})".format(dict(self))
+
+    def tobytes(self):
+        """Get a copy of the entry data, as stored in the .dict file.
+
+        """
+        return bytes(self._buffer[self._start:self._end])
+
+    def detach(self):
+        """Get an entry holding a copy of its data only, not the buffer it was read from (a whole memory-mapped
+        .dict file, or a dictzip chunk), so that keeping it does not keep the buffer.
+
+        """
+        return Entry(self.tobytes(), 0, self.size, self._layout)
+
+    def __reduce__(self):
+        # Pickle the entry data only, not the whole buffer
+        return (Entry, (self.tobytes(), 0, self.size, self._layout))
+
+
+# Entries read together by DictFileReader.get_dicts_by_locations may be this far apart
+COALESCE_GAP = 4096
+# and span at most this many bytes
+COALESCE_MAX_SIZE = 1024 * 1024
+
 
 class DictFileReader(object):
-    """Read the .dict file, store the data in memory for querying.
+    """Read the .dict file for querying.
+    A plain .dict file is memory-mapped, whatever its size; the system pages in the entries looked up.
+    A .dict.dz file with a dictzip chunk table is not loaded: only the chunks holding the requested entries are
+    decompressed, through DictzipFile.
+    The reader of a dictionary package (see package.py) serves the .dict data from the package mapping, either
+    stored as is or in independently compressed blocks.
+    Entries are returned as Entry objects, which reference the in-memory content of a .dict file without copying
+    it and decode their fields on access. The reader is not modified by lookups, so it can be shared by
+    concurrent threads.
     """
 
-    def __init__(self, filename, dict_ifo, dict_index, compressed=False):
+    def __init__(self, filename, dict_ifo, dict_index, compressed=False, cache_size=DEFAULT_CACHE_SIZE):
         """Constructor.
 
         Arguments:
         - `filename`: filename of .dict file.
         - `dict_ifo`: IfoFileReader object.
         - `dict_index`: IdxFileReader object.
+        - `compressed`: indicate whether the .dict file is compressed.
+        - `cache_size`: the budget in bytes of the decompressed chunk cache of a dictzip file.
         """
         self._dict_ifo = dict_ifo
         self._dict_index = dict_index
         self._compressed = compressed
-        self._offset = 0
+        self._layout = compile_layout(dict_ifo.get_ifo("sametypesequence"))
+        # Position of the .dict data in _dict_file
+        self._base = 0
         if self._compressed:
-            with gzip.open(filename, "rb") as dict_file:
-                self._dict_file = dict_file.read()
+            try:
+                self._dict_file = DictzipFile(filename, cache_size=cache_size)
+            except DictzipFileException:
+                # Plain gzip file, no random access
+                with gzip.open(filename, "rb") as dict_file:
+                    self._dict_file = dict_file.read()
+        else:
+            # Mapped rather than read, so that the size of the file does not count against the heap
+            self._dict_file = map_file(filename)
+
+    @classmethod
+    def from_package(cls, package, dict_ifo, dict_index, cache_size=DEFAULT_CACHE_SIZE):
+        """Build the reader from the .dict data of a dictionary package.
+
+        Arguments:
+        - `package`: snapshot.SnapshotFile object of the package.
+        - `dict_ifo`: IfoFileReader object.
+        - `dict_index`: CompactIdxFileReader object.
+        - `cache_size`: the budget in bytes of the decompressed block cache.
+        """
+        reader = cls.__new__(cls)
+        reader._dict_ifo = dict_ifo
+        reader._dict_index = dict_index
+        reader._layout = compile_layout(dict_ifo.get_ifo("sametypesequence"))
+        reader._compressed = "dict.blocks" in package
+        reader._base = 0
+        if reader._compressed:
+            base = package.get_offset("dict.blocks")
+            block_offsets = array("Q", (base + offset for offset in package.get_array("dict.block_offsets")))
+            reader._dict_file = ChunkedFile(package.content, block_offsets, package.key["block_size"],
+                                            cache_size=cache_size)
         else:
-            with open(filename, "rb") as dict_file:
-                self._dict_file = dict_file.read()
+            reader._dict_file = package.content
+            reader._base = package.get_offset("dict.data")
+        return reader
+
+    def _read_entry(self, offset, size):
+        if isinstance(self._dict_file, ChunkedFile):
+            return Entry(self._dict_file.read(offset, size), 0, size, self._layout)
+        start = self._base + offset
+        return Entry(self._dict_file, start, start + size, self._layout)
 
     def get_dict_by_word(self, word):
         """Get the word's dictionary data by it's name.
@@ -281,7 +1024,7 @@ class DictFileReader(object):
         Arguments:
         - `word`: word name.
         Return:
-        The specified word's dictionary data, in form of dict as below:
+        The list of the specified word's dictionary data, as Entry objects, a mapping as below:
         {type_identifier: infomation, ...}
         in which type_identifier can be any character in "mlgtxykwhnrWP".
         """
@@ -289,15 +1032,8 @@ class DictFileReader(object):
         indexes = self._dict_index.get_index_by_word(word)
         if not indexes:
             return result
-        # sametypesequence = m => same type_identifier = m
-        sametypesequence = self._dict_ifo.get_ifo("sametypesequence")
         for index in indexes:
-            self._offset = index[0]
-            size = index[1]
-            if sametypesequence:
-                result.append(self._get_entry_sametypesequence(size))
-            else:
-                result.append(self._get_entry(size))
+            result.append(self._read_entry(index[0], index[1]))
         return result
 
     def get_dict_by_index(self, index):
@@ -306,81 +1042,747 @@ class DictFileReader(object):
         Arguments:
         - `index`: index of a word entrt in .idx file.'
         Return:
-        The specified word's dictionary data, in form of dict as below:
+        The specified word's dictionary data, as an Entry object, a mapping as below:
         {type_identifier: infomation, ...}
         in which type_identifier can be any character in "mlgtxykwhnrWP".
         """
         word, offset, size = self._dict_index.get_index_by_num(index)
-        self._offset = offset
-        sametypesequence = self._dict_ifo.get_ifo("sametypesequence")
-        if sametypesequence:
-            return self._get_entry_sametypesequence(size)
+        return self._read_entry(offset, size)
+
+    def cache_stats(self):
+        """Get the usage counters of the decompressed chunk cache, see LRUCache.stats.
+
+        Return:
+        A dictionary of counters, or None if the .dict data is not read by chunks.
+        """
+        if isinstance(self._dict_file, ChunkedFile):
+            return self._dict_file.cache_stats()
+        return None
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+        Mapped .dict data, of a plain .dict file or of a package, is counted whole.
+
+        """
+        if isinstance(self._dict_file, ChunkedFile):
+            return self._dict_file.get_memory_usage()
+        return get_memory_usage(self._dict_file)
+
+    def get_dicts_by_locations(self, locations):
+        """Get the dictionary data of many entries at once.
+        The entries are read in offset order, and entries close to each other with a single read, so that the
+        .dict file (or the chunks of a .dict.dz file) is read sequentially.
+
+        Arguments:
+        - `locations`: a list of tuples (word_data_offset, word_data_size), as returned by get_index_by_word.
+        Return:
+        The list of the dictionary data of the entries, as Entry objects, in the order of `locations`.
+        """
+        if not isinstance(self._dict_file, ChunkedFile):
+            # The content is in memory: entries reference it
+            return [self._read_entry(offset, size) for offset, size in locations]
+
+        result = [None] * len(locations)
+        order = sorted(range(len(locations)), key=locations.__getitem__)
+        first = 0
+        while first < len(order):
+            # Gather a run of neighbouring entries
+            block_offset, size = locations[order[first]]
+            block_end = block_offset + size
+            last = first + 1
+            while last < len(order):
+                offset, size = locations[order[last]]
+                if offset > block_end + COALESCE_GAP or offset + size - block_offset > COALESCE_MAX_SIZE:
+                    break
+                block_end = max(block_end, offset + size)
+                last += 1
+            block = self._dict_file.read(block_offset, block_end - block_offset)
+            for number in order[first:last]:
+                offset, size = locations[number]
+                start = offset - block_offset
+                # Copy the entry out of the block, so that a kept entry does not keep the whole block
+                result[number] = Entry(block[start:start + size], 0, size, self._layout)
+            first = last
+        return result
+
+
+# Budget in bytes of the cache of the resources read from a res/ directory or decompressed from a res.rdic.dz file
+DEFAULT_RESOURCE_CACHE_SIZE = 4 * 1024 * 1024
+# Size of the pieces a resource is streamed in
+DEFAULT_RESOURCE_CHUNK_SIZE = 64 * 1024
+# Markup fields holding resource references in src attributes
+RESOURCE_MARKUP_TYPES = "gxh"
+SRC_PATTERN = re.compile(r"""\bsrc\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+# An URL scheme, like http: or data:, not a resource name
+URL_SCHEME_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.\-]*:")
+
+
+def get_resource_names(entry):
+    """Get the names of the resources an entry refers to: the files of its resource list (r) and the src
+    attributes of its markup fields, other than URLs.
+
+    Arguments:
+    - `entry`: Entry object.
+    Return:
+    The list of the resource names, without duplicates.
+    """
+    names = []
+    for type_identifier in entry:
+        if type_identifier == "r":
+            # Lines like img:pic/example.jpg
+            candidates = [line.partition(":")[2] for line in entry["r"].splitlines()]
+        elif type_identifier in RESOURCE_MARKUP_TYPES:
+            candidates = [match.group(1) if match.group(1) is not None else match.group(2)
+                          for match in SRC_PATTERN.finditer(entry[type_identifier])]
         else:
-            return self._get_entry(size)
-
-    def _get_entry(self, size):
-        result = {}
-        read_size = 0
-        start_offset = self._offset
-        while read_size < size:
-            type_identifier = struct.unpack("!c")
-            if type_identifier in "mlgtxykwhnr":
-                result[type_identifier] = self._get_entry_field_null_trail()
+            continue
+        for name in candidates:
+            name = name.strip()
+            if name and not URL_SCHEME_PATTERN.match(name) and name not in names:
+                names.append(name)
+    return names
+
+
+class ResourceStorage(object):
+    """Base class of the resource storages of a dictionary: the pictures, sounds and other files its entries
+    refer to by name (see get_resource_names). Names are paths relative to the storage, with "/" separators.
+    Resources of a memory-mapped file are returned as views of the mapping; the ones that have to be read from a
+    file or decompressed are kept in a LRU cache bounded in bytes. iter_chunks streams a resource without holding
+    all of it.
+    """
+
+    def __init__(self, cache_size=DEFAULT_RESOURCE_CACHE_SIZE):
+        self._cache = LRUCache(cache_size) if cache_size else None
+
+    def __contains__(self, name):
+        return self.get_size(name) is not None
+
+    def get_size(self, name):
+        """Get the size of a resource.
+
+        Arguments:
+        - `name`: the resource name.
+        Return:
+        The size in bytes, or None if there is no such resource.
+        """
+        raise NotImplementedError
+
+    def iter_names(self):
+        """Iterate over the names of the resources.
+
+        """
+        raise NotImplementedError
+
+    def _read(self, name):
+        raise NotImplementedError
+
+    def get(self, name):
+        """Get a resource.
+
+        Arguments:
+        - `name`: the resource name.
+        Return:
+        The resource data as a bytes-like object, or None if there is no such resource.
+        """
+        if self._cache is not None:
+            data = self._cache.get(name)
+            if data is not None:
+                return data
+        data, copied = self._read(name)
+        if copied and self._cache is not None:
+            self._cache.put(name, data)
+        return data
+
+    def iter_chunks(self, name, chunk_size=DEFAULT_RESOURCE_CHUNK_SIZE):
+        """Read a resource piece by piece.
+        May raise KeyError if there is no such resource.
+
+        Arguments:
+        - `name`: the resource name.
+        - `chunk_size`: the size of the pieces.
+        Return:
+        An iterator of bytes-like objects.
+        """
+        raise NotImplementedError
+
+    def cache_stats(self):
+        """Get the usage counters of the resource cache, see LRUCache.stats.
+
+        Return:
+        A dictionary of counters, or None if the cache is disabled.
+        """
+        return self._cache.stats() if self._cache is not None else None
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the storage, see get_memory_usage.
+
+        """
+        return {'heap_bytes': self._cache.resident_bytes if self._cache is not None else 0, 'mapped_bytes': 0}
+
+
+class ResourceDirectory(ResourceStorage):
+    """Resources stored as files of a res/ directory.
+
+    """
+
+    def __init__(self, dirpath, cache_size=DEFAULT_RESOURCE_CACHE_SIZE):
+        """Constructor.
+
+        Arguments:
+        - `dirpath`: the res/ directory.
+        - `cache_size`: the budget in bytes of the resource cache.
+        """
+        super().__init__(cache_size)
+        self.dirpath = os.path.abspath(dirpath)
+
+    def _get_filename(self, name):
+        filename = os.path.normpath(os.path.join(self.dirpath, *name.split("/")))
+        # No way out of the directory
+        if not filename.startswith(self.dirpath + os.sep) or not os.path.isfile(filename):
+            return None
+        return filename
+
+    def get_size(self, name):
+        filename = self._get_filename(name)
+        return os.path.getsize(filename) if filename is not None else None
+
+    def iter_names(self):
+        for dirpath, dirnames, filenames in os.walk(self.dirpath):
+            dirnames.sort()
+            relative = os.path.relpath(dirpath, self.dirpath)
+            for filename in sorted(filenames):
+                yield filename if relative == os.curdir else "/".join(relative.split(os.sep) + [filename])
+
+    def _read(self, name):
+        filename = self._get_filename(name)
+        if filename is None:
+            return None, False
+        with open(filename, "rb") as f:
+            return f.read(), True
+
+    def iter_chunks(self, name, chunk_size=DEFAULT_RESOURCE_CHUNK_SIZE):
+        filename = self._get_filename(name)
+        if filename is None:
+            raise KeyError(name)
+        return self._iter_file(filename, chunk_size)
+
+    @staticmethod
+    def _iter_file(filename, chunk_size):
+        with open(filename, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class ResourceIndexReader(CompactWordTable):
+    """Read the res.ridx file of a resource database into compact columns, like CompactIdxFileReader does for
+    the .idx file. The names are sorted byte-wise (strcmp order).
+    """
+    sort_key = staticmethod(bytes)
+
+    def __init__(self, content, index_offset_bits=32):
+        """Constructor.
+
+        Arguments:
+        - `content`: the content of the res.ridx file, decompressed.
+        - `index_offset_bits`: the offset field length in bits.
+        """
+        if index_offset_bits == 32:
+            entry_tail, typecodes = struct.Struct("!II"), ("I", "I")
+        elif index_offset_bits == 64:
+            entry_tail, typecodes = struct.Struct("!QI"), ("Q", "I")
+        else:
+            raise ValueError
+        self._offsets, self._sizes = self._index_content(content, entry_tail, typecodes)
+
+    def __len__(self):
+        return self._count
+
+    def find(self, name):
+        """Find a resource.
+
+        Arguments:
+        - `name`: the resource name.
+        Return:
+        A tuple (offset, size) of the resource in the res.rdic file, or None if there is no such resource.
+        """
+        numbers = self._find_numbers(name.encode("utf-8"))
+        if not numbers:
+            return None
+        return self._offsets[numbers[0]], self._sizes[numbers[0]]
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the reader, see get_memory_usage.
+
+        """
+        return get_memory_usage(*self._get_word_buffers(), self._offsets, self._sizes)
+
+
+class ResourceDatabase(ResourceStorage):
+    """Resources packed in a res.rifo, res.ridx and res.rdic database.
+    The res.ridx file is memory-mapped and binary searched (decompressed once if gzipped); the res.rdic file is
+    memory-mapped, or read by chunks through DictzipFile if dictzipped.
+    """
+
+    def __init__(self, rifo_filename, ridx_filename, rdic_filename, ridx_compressed=False, rdic_compressed=False,
+                 cache_size=DEFAULT_RESOURCE_CACHE_SIZE):
+        """Constructor.
+        May raise IfoFileException if the res.rifo file is invalid.
+
+        Arguments:
+        - `rifo_filename`: the res.rifo filename.
+        - `ridx_filename`: the res.ridx filename.
+        - `rdic_filename`: the res.rdic filename.
+        - `ridx_compressed`: indicate whether the res.ridx file is gzipped.
+        - `rdic_compressed`: indicate whether the res.rdic file is compressed.
+        - `cache_size`: the budget in bytes of the cache of the decompressed resources, and of the decompressed
+        chunk cache of a dictzip file.
+        """
+        super().__init__(cache_size)
+        self.rifo_reader = IfoFileReader(rifo_filename)
+        if ridx_compressed:
+            with gzip.open(ridx_filename, "rb") as ridx_file:
+                content = ridx_file.read()
+        else:
+            content = map_file(ridx_filename)
+        self._index = ResourceIndexReader(content, self.rifo_reader.get_index_offset_bits("ridxoffsetbits"))
+        if rdic_compressed:
+            try:
+                self._data = DictzipFile(rdic_filename, cache_size=cache_size)
+            except DictzipFileException:
+                # Plain gzip file, no random access
+                with gzip.open(rdic_filename, "rb") as rdic_file:
+                    self._data = rdic_file.read()
+        else:
+            self._data = map_file(rdic_filename)
+        if not isinstance(self._data, ChunkedFile):
+            # Resources are views of the content, nothing to cache
+            self._cache = None
+
+    def get_size(self, name):
+        location = self._index.find(name)
+        return location[1] if location is not None else None
+
+    def iter_names(self):
+        return self._index.iter_words()
+
+    def _read(self, name):
+        location = self._index.find(name)
+        if location is None:
+            return None, False
+        offset, size = location
+        if isinstance(self._data, ChunkedFile):
+            return self._data.read(offset, size), True
+        return memoryview(self._data)[offset:offset + size], False
+
+    def iter_chunks(self, name, chunk_size=DEFAULT_RESOURCE_CHUNK_SIZE):
+        location = self._index.find(name)
+        if location is None:
+            raise KeyError(name)
+        return self._iter_range(location[0], location[1], chunk_size)
+
+    def _iter_range(self, offset, size, chunk_size):
+        chunked = isinstance(self._data, ChunkedFile)
+        end = offset + size
+        while offset < end:
+            length = min(chunk_size, end - offset)
+            if chunked:
+                yield self._data.read(offset, length)
             else:
-                result[type_identifier] = self._get_entry_field_size()
-            read_size = self._offset - start_offset
-        return result
+                yield memoryview(self._data)[offset:offset + length]
+            offset += length
 
-    def _get_entry_sametypesequence(self, size):
-        start_offset = self._offset
-        result = {}
-        sametypesequence = self._dict_ifo.get_ifo("sametypesequence")
-        for k in range(0, len(sametypesequence)):
-            if sametypesequence[k] in "mlgtxykwhnr":
-                if k == len(sametypesequence) - 1:
-                    result[sametypesequence[k]] = self._get_entry_field_size(
-                        size - (self._offset - start_offset))
-                else:
-                    result[sametypesequence[k]
-                           ] = self._get_entry_field_null_trail()
-            elif sametypesequence[k] in "WP":
-                if k == len(sametypesequence) - 1:
-                    result[sametypesequence[k]] = self._get_entry_field_size(
-                        size - (self._offset - start_offset))
-                else:
-                    result[sametypesequence[k]] = self._get_entry_field_size()
-        return result
+    def get_memory_usage(self):
+        usage = self._index.get_memory_usage()
+        data_usage = self._data.get_memory_usage() if isinstance(
+            self._data, ChunkedFile) else get_memory_usage(self._data)
+        cache_usage = super().get_memory_usage()
+        return {kind: usage[kind] + data_usage[kind] + cache_usage[kind] for kind in usage}
 
-    def _get_entry_field_null_trail(self):
-        end = self._dict_file.find(b'\x00', self._offset)
-        result = self._dict_file[self._offset:end]
-        self._offset = end + 1
-        return result
 
-    def _get_entry_field_size(self, size=None):
-        if size is None:
-            size = struct.unpack("!I", self._dict_file[
-                                 self._offset:self._offset + 4])
-            self._offset += 4
-        result = self._dict_file[
-            self._offset:self._offset + size]
-        self._offset += size
-        return result
+def open_resource_storage(filepaths, cache_size=DEFAULT_RESOURCE_CACHE_SIZE):
+    """Open the resource storage of a dictionary: its resource database if it has one, or else its res/ directory.
+
+    Arguments:
+    - `filepaths`: the files of the dictionary, as returned by find_dictionary_filepaths.
+    - `cache_size`: the budget in bytes of the resource cache.
+    Return:
+    A ResourceStorage object, or None if the dictionary has no resources.
+    """
+    if 'rifo' in filepaths and 'ridx' in filepaths and 'rdic' in filepaths:
+        return ResourceDatabase(filepaths['rifo'], filepaths['ridx'], filepaths['rdic'],
+                                ridx_compressed=filepaths['ridx.gz'], rdic_compressed=filepaths['rdic.dz'],
+                                cache_size=cache_size)
+    if 'res' in filepaths:
+        return ResourceDirectory(filepaths['res'], cache_size=cache_size)
+    return None
+
+
+PACKAGE_FORMAT = "stardict-package"
+PACKAGE_VERSION = 1
+
+
+def get_package_sources(filepaths):
+    """Get the source files a dictionary package is compiled from.
+
+    Arguments:
+    - `filepaths`: the files of the dictionary, as returned by find_dictionary_filepaths.
+    Return:
+    The list of the .ifo, .idx, .syn and .dict filenames.
+    """
+    return [filepaths[ext] for ext in ('ifo', 'idx', 'syn', 'dict') if ext in filepaths]
+
+
+def read_package(filename, filepaths=None):
+    """Open a dictionary package, see package.py.
+
+    Arguments:
+    - `filename`: the package filename.
+    - `filepaths`: the files of the dictionary, as returned by find_dictionary_filepaths. If the dictionary has
+    StarDict files, the package must have been compiled from them as they are now.
+    Return:
+    A SnapshotFile object, or None if the file is not a package of the current version or is stale.
+    """
+    try:
+        package = SnapshotFile(filename)
+    except (OSError, ValueError, SnapshotFileException):
+        return None
+    key = package.key
+    if (key.get("format") != PACKAGE_FORMAT or key.get("package_version") != PACKAGE_VERSION or
+            key.get("byteorder") != sys.byteorder):
+        return None
+    if filepaths and 'ifo' in filepaths:
+        if key["sources"] != get_source_key(get_package_sources(filepaths))["sources"]:
+            return None
+    return package
+
+
+# Number of entries read at once by Dictionary.iter_entries
+DEFAULT_ITER_BATCH_SIZE = 4096
 
 
 class Dictionary():
 
-    def __init__(self, dictionary_path):
+    def __init__(self, dictionary_path, compact_index=False, dictzip_cache_size=DEFAULT_CACHE_SIZE,
+                 snapshot_dirpath=None, lazy=False, load_semaphore=None, unified_lookup=False, use_package=True,
+                 resource_cache_size=DEFAULT_RESOURCE_CACHE_SIZE):
+        """Constructor.
+
+        Arguments:
+        - `dictionary_path`: directory holding the .ifo, .idx, .dict and optional .syn files, and/or a dictionary
+        package compiled from them; or the filename of a package.
+        - `compact_index`: read the .idx and .syn files with CompactIdxFileReader and CompactSynFileReader
+        instead of IdxFileReader and SynFileReader.
+        - `dictzip_cache_size`: the budget in bytes of the decompressed chunk cache of a .dict.dz file.
+        - `snapshot_dirpath`: directory of the index snapshots. If set, the compact readers are loaded from
+        a snapshot of the parsed .idx and .syn files, which is rebuilt when these files change.
+        - `lazy`: only read the .ifo file; the other files are read by open(), called on the first access
+        to idx_reader, dict_reader or syn_reader.
+        - `load_semaphore`: semaphore held while the files are read, to bound concurrent loads.
+        - `unified_lookup`: with the compact readers, merge the headwords and synonyms into a WordResolver, so that
+        resolve() takes a single search.
+        - `use_package`: read the dictionary from its package, if it has an up to date one. The package holds
+        the compact readers, so `compact_index` and `snapshot_dirpath` do not apply to it.
+        - `resource_cache_size`: the budget in bytes of the cache of the resources, see ResourceStorage.
+        """
         filepaths = find_dictionary_filepaths(dictionary_path)
-        if not filepaths:
+        package = None
+        if filepaths and use_package and 'package' in filepaths:
+            package = read_package(filepaths['package'], filepaths)
+        if not filepaths or (package is None and 'ifo' not in filepaths):
             print('Invalid dictionary')
             raise ValueError
 
-        self.name = os.path.basename(dictionary_path)
-        self.ifo_reader = IfoFileReader(filepaths['ifo'])
-        self.idx_reader = IdxFileReader(filepaths['idx'], compressed=filepaths[
-            'idx.gz'], index_offset_bits=32)
-        self.dict_reader = DictFileReader(
-            filepaths['dict'], self.ifo_reader, self.idx_reader, compressed=filepaths['dict.dz'])
-        self.syn_reader = SynFileReader(
-            filepaths['syn']) if 'syn' in filepaths else None
+        self.name = os.path.basename(os.path.normpath(dictionary_path))
+        self._package = package
+        if package is not None:
+            self.name = package.key["name"] if os.path.isfile(dictionary_path) else self.name
+            self.ifo_reader = IfoFileReader.from_string(
+                package.get_bytes("ifo").decode("utf-8"), filepaths['package'])
+            self.index_offset_bits = self.ifo_reader.get_index_offset_bits()
+            self.source_key = get_source_key(
+                [filepaths['package']], index_offset_bits=self.index_offset_bits)
+        else:
+            self.ifo_reader = IfoFileReader(filepaths['ifo'])
+            self.index_offset_bits = self.ifo_reader.get_index_offset_bits()
+            self.source_key = get_source_key(
+                [filepaths[ext] for ext in ('ifo', 'idx', 'syn') if ext in filepaths],
+                index_offset_bits=self.index_offset_bits)
+        self.load_time = None
+        # Time spent in each loading phase, in seconds
+        self.load_phases = {}
+        self._filepaths = filepaths
+        self._compact_index = compact_index
+        self._dictzip_cache_size = dictzip_cache_size
+        self._snapshot_dirpath = snapshot_dirpath
+        self._load_semaphore = load_semaphore
+        self._unified_lookup = unified_lookup
+        self._resolver = None
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        # (idx_reader, syn_reader, dict_reader, resolver) once loaded, read at once so that a concurrent close()
+        # cannot leave a caller with half of the readers
+        self._readers = None
+        self._resource_cache_size = resource_cache_size
+        self._resources = None
+        # original_word_index: [synonym_word, ...], built by get_synonyms_by_number
+        self._synonyms_by_number = None
+        if not lazy:
+            self.open()
+
+    @property
+    def loaded(self):
+        """Whether the .idx, .dict and .syn files have been read.
+
+        """
+        return self._loaded
+
+    def _get_readers(self):
+        readers = self._readers
+        while readers is None:
+            self.open()
+            readers = self._readers
+        return readers
+
+    @property
+    def idx_reader(self):
+        return self._get_readers()[0]
+
+    @property
+    def dict_reader(self):
+        return self._get_readers()[2]
+
+    @property
+    def syn_reader(self):
+        return self._get_readers()[1]
+
+    @property
+    def has_resources(self):
+        """Whether the dictionary has a resource database or a res/ directory.
+
+        """
+        return any(key in self._filepaths for key in ('rifo', 'res'))
+
+    @property
+    def resources(self):
+        """The ResourceStorage object of the dictionary, opened on first access, or None if it has no resources.
+
+        """
+        resources = self._resources
+        if resources is None and self.has_resources:
+            with self._load_lock:
+                if self._resources is None:
+                    try:
+                        self._resources = open_resource_storage(self._filepaths, self._resource_cache_size)
+                    except (IfoFileException, OSError, ValueError) as e:
+                        print('Cannot open the resources of {}: {}'.format(self.name, e))
+                resources = self._resources
+        return resources
+
+    def open(self):
+        """Read the .idx, .dict and .syn files, if not done yet.
+        The time it took is stored in load_time, in seconds.
+
+        """
+        with self._load_lock:
+            if self._loaded:
+                return
+            if self._load_semaphore is not None:
+                with self._load_semaphore:
+                    self._open()
+            else:
+                self._open()
+
+    def close(self):
+        """Drop the readers, so that their memory can be freed once no lookup uses them any more.
+        They are read again on the next access, cheaply when they come from a package or a snapshot.
+
+        """
+        with self._load_lock:
+            self._resources = None
+            self._synonyms_by_number = None
+            if not self._loaded:
+                return
+            self._readers = None
+            self._loaded = False
+            self._idx_reader = self._syn_reader = self._dict_reader = self._resolver = None
+
+    @contextmanager
+    def _load_phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.load_phases[name] = self.load_phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    def _open(self):
+        start_time = time.perf_counter()
+        self.load_phases = {}
+        filepaths = self._filepaths
+        if self._package is not None:
+            with self._load_phase('package'):
+                self._open_package()
+            self._set_loaded(start_time)
+            return
+        if self._snapshot_dirpath is not None:
+            self._load_indexes_from_snapshot(filepaths)
+        elif self._compact_index:
+            with self._load_phase('idx'):
+                self._idx_reader = CompactIdxFileReader(filepaths['idx'], compressed=filepaths[
+                    'idx.gz'], index_offset_bits=self.index_offset_bits)
+            with self._load_phase('syn'):
+                self._syn_reader = CompactSynFileReader(
+                    filepaths['syn']) if 'syn' in filepaths else None
+            if self._unified_lookup:
+                with self._load_phase('resolver'):
+                    self._resolver = WordResolver(self._idx_reader, self._syn_reader)
+        else:
+            with self._load_phase('idx'):
+                self._idx_reader = IdxFileReader(filepaths['idx'], compressed=filepaths[
+                    'idx.gz'], index_offset_bits=self.index_offset_bits)
+            with self._load_phase('syn'):
+                self._syn_reader = SynFileReader(
+                    filepaths['syn']) if 'syn' in filepaths else None
+        with self._load_phase('dict'):
+            self._dict_reader = DictFileReader(
+                filepaths['dict'], self.ifo_reader, self._idx_reader, compressed=filepaths['dict.dz'],
+                cache_size=self._dictzip_cache_size)
+        self._set_loaded(start_time)
+
+    def _set_loaded(self, start_time):
+        self._readers = (self._idx_reader, self._syn_reader, self._dict_reader, self._resolver)
+        self.load_time = time.perf_counter() - start_time
+        self._loaded = True
+
+    def _open_package(self):
+        package = self._package
+        self._idx_reader = CompactIdxFileReader.from_snapshot(package)
+        self._syn_reader = CompactSynFileReader.from_snapshot(
+            package) if 'syn.word_starts' in package else None
+        if self._unified_lookup:
+            self._resolver = WordResolver(self._idx_reader, self._syn_reader,
+                                          package.get_array('resolve.slots'))
+        self._dict_reader = DictFileReader.from_package(
+            package, self.ifo_reader, self._idx_reader, cache_size=self._dictzip_cache_size)
+
+    def _load_indexes_from_snapshot(self, filepaths):
+        snapshot_filepath = os.path.join(
+            self._snapshot_dirpath, self.name + SNAPSHOT_EXT)
+        with self._load_phase('snapshot'):
+            snapshot = read_snapshot(snapshot_filepath, self.source_key)
+            if snapshot:
+                self._idx_reader = CompactIdxFileReader.from_snapshot(snapshot)
+                self._syn_reader = CompactSynFileReader.from_snapshot(
+                    snapshot) if 'syn' in filepaths else None
+                if not self._unified_lookup:
+                    return
+                if 'resolve.slots' in snapshot:
+                    self._resolver = WordResolver(self._idx_reader, self._syn_reader,
+                                                  snapshot.get_array('resolve.slots'))
+                    return
+        if not snapshot:
+            with self._load_phase('idx'):
+                self._idx_reader = CompactIdxFileReader(filepaths['idx'], compressed=filepaths[
+                    'idx.gz'], index_offset_bits=self.index_offset_bits)
+            with self._load_phase('syn'):
+                self._syn_reader = CompactSynFileReader(
+                    filepaths['syn']) if 'syn' in filepaths else None
+        if self._unified_lookup:
+            with self._load_phase('resolver'):
+                self._resolver = WordResolver(self._idx_reader, self._syn_reader)
+
+        with self._load_phase('snapshot_write'):
+            sections = {}
+            for prefix, reader in (('idx.', self._idx_reader), ('syn.', self._syn_reader),
+                                   ('resolve.', self._resolver)):
+                if reader:
+                    for name, data in reader.get_sections().items():
+                        sections[prefix + name] = data
+            try:
+                write_snapshot(snapshot_filepath, self.source_key, sections)
+            except OSError:
+                print('Cannot write the index snapshot of {}'.format(self.name))
+
+    def get_memory_usage(self):
+        """Estimate the memory used by the readers of the dictionary, see get_memory_usage.
+
+        Return:
+        A dictionary {reader name: usage} for the loaded readers: idx, syn, resolver, dict and resources.
+        """
+        usage = {}
+        for name, reader in zip(('idx', 'syn', 'dict', 'resolver'), self._readers or ()):
+            if reader is not None:
+                usage[name] = reader.get_memory_usage()
+        resources = self._resources
+        if resources is not None:
+            usage['resources'] = resources.get_memory_usage()
+        return usage
+
+    def get_content_key(self, **params):
+        """Identify the state of all the files of the dictionary, the .dict file included, see get_source_key.
+
+        Arguments:
+        - `params`: any other value the key depends on.
+        """
+        if self._package is not None:
+            filenames = [self._filepaths['package']]
+        else:
+            filenames = get_package_sources(self._filepaths)
+        return get_source_key(filenames, **params)
+
+    def resolve(self, word_str):
+        """Get the entries named by a word, as a headword or as a synonym.
+
+        Arguments:
+        - `word_str`: the word.
+        Return:
+        The list of the origin indexes of the entries in .idx file, headword entries first, without duplicates.
+        """
+        idx_reader, syn_reader, dict_reader, resolver = self._get_readers()
+        if resolver is not None:
+            return resolver.resolve(word_str)
+        numbers = idx_reader.get_numbers_by_word(word_str)
+        if syn_reader:
+            numbers.extend(syn_reader.get_syn(word_str))
+        return list(dict.fromkeys(numbers))
+
+    def get_synonyms_by_number(self):
+        """Get the synonyms of each entry, built from the .syn file on the first call and kept until close().
+
+        Return:
+        A dictionary {original_word_index: [synonym_word, ...]} of the entries having synonyms.
+        """
+        synonyms = self._synonyms_by_number
+        if synonyms is None:
+            syn_reader = self._get_readers()[1]
+            synonyms = {}
+            if syn_reader is not None:
+                for synonym_word, index in syn_reader.iter_synonyms():
+                    synonyms.setdefault(index, []).append(synonym_word)
+            self._synonyms_by_number = synonyms
+        return synonyms
+
+    def iter_entries(self, start=0, stop=None, batch_size=DEFAULT_ITER_BATCH_SIZE):
+        """Iterate over the entries in .idx file order, duplicate headwords included.
+        The .dict data is read by batches of entries in offset order (see DictFileReader.get_dicts_by_locations):
+        a .dict file laid out in .idx order, the usual case, is read sequentially, and a .dict.dz file chunk by
+        chunk.
+
+        Arguments:
+        - `start`: the origin index of the first entry.
+        - `stop`: the origin index after the last entry, by default the number of entries.
+        - `batch_size`: the number of entries read at once.
+        Return:
+        An iterator of tuples (original_word_index, word_str, entry, synonyms), entry being an Entry object and
+        synonyms the list of the synonym words naming the entry.
+        """
+        idx_reader, syn_reader, dict_reader, resolver = self._get_readers()
+        synonyms = self.get_synonyms_by_number()
+        stop = len(idx_reader) if stop is None else min(stop, len(idx_reader))
+        for first in range(start, stop, batch_size):
+            indexes = [idx_reader.get_index_by_num(number) for number in range(first, min(first + batch_size, stop))]
+            entries = dict_reader.get_dicts_by_locations([index[1:] for index in indexes])
+            for number, index, entry in zip(range(first, stop), indexes, entries):
+                yield number, index[0], entry, synonyms.get(number, [])
@@ -0,0 +1,135 @@
+"""Stress test of concurrent lookups on one shared StarDict object.
+
+Usage: python stress_test.py [--entries 20000] [--workers 32] [--rounds 4]
+
+Two synthetic dictionaries, one with a plain .dict file and one with a .dict.dz file (see benchmarks/generate.py),
+are looked up first from a single thread, then by many ThreadPoolExecutor workers at once, through
+get_definitions_from_enabled_dictionaries (one word) and lookup_many (batches of words). Every concurrent result
+must be byte-identical to the single-threaded one, for each reader configuration in CONFIGURATIONS.
+"""
+import argparse
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from app import StarDict, DictionarySettings, SETTINGS_FILENAMES, LOAD_LAZY
+from benchmarks.generate import generate_dictionary
+from stardict import Dictionary
+
+DICTIONARIES = (
+    ('plain', dict(sametypesequence='m')),
+    ('dictzip', dict(idx_gz=True, dictzip=True, sametypesequence='tm')),
+)
+# StarDict options of each run: the dictzip chunk cache and the definition cache are shared by the workers
+CONFIGURATIONS = (
+    dict(),
+    dict(compact_index=True),
+    dict(compact_index=True, dictzip_cache_size=64 * 1024, definition_cache_max_items=500),
+    dict(load_mode=LOAD_LAZY, unified_lookup=True),
+)
+BATCH_SIZE = 50
+
+
+def make_fixtures(dirpath, entries):
+    """Write the dictionaries and the settings enabling them.
+
+    Return:
+    A DictionarySettings object.
+    """
+    dicts_dirpath = os.path.join(dirpath, 'dicts')
+    settings_dirpath = os.path.join(dirpath, 'settings')
+    os.makedirs(settings_dirpath)
+    for order, (name, options) in enumerate(DICTIONARIES):
+        generate_dictionary(os.path.join(dicts_dirpath, name), entries, seed=order, **options)
+    for filename in SETTINGS_FILENAMES:
+        with open(os.path.join(settings_dirpath, filename), mode='w', encoding='utf-8') as f:
+            for order, (name, options) in enumerate(DICTIONARIES):
+                f.write('{} 1 {:d}\n'.format(name, order))
+    return DictionarySettings(dicts_dirpath, settings_dirpath)
+
+
+def pick_words(settings, count, seed=0):
+    """Pick headwords, synonyms and missing words of the dictionaries.
+
+    """
+    rng = random.Random(seed)
+    words = []
+    for name, options in DICTIONARIES:
+        dictionary = Dictionary(os.path.join(settings.dicts_dirpath, name))
+        total = len(dictionary.idx_reader)
+        synonyms = [synonym_word for synonym_word, index in dictionary.syn_reader.iter_synonyms()]
+        for i in range(count):
+            word_str = dictionary.idx_reader.get_index_by_num(rng.randrange(total))[0]
+            words.append((word_str, rng.choice(synonyms), word_str + '#')[i % 3])
+    rng.shuffle(words)
+    return words
+
+
+def freeze(dictionaries_definitions):
+    """Turn [(dictionary, definitions), ...] into comparable data: names and entry bytes.
+
+    """
+    return [(dictionary.name, [entry.tobytes() for entry in definitions])
+            for dictionary, definitions in dictionaries_definitions]
+
+
+def lookup(stardict, words):
+    return [freeze(stardict.get_definitions_from_enabled_dictionaries(word_str)) for word_str in words]
+
+
+def lookup_many(stardict, words):
+    results = stardict.lookup_many(words)
+    return [freeze(results[word_str]) for word_str in words]
+
+
+def run(settings, words, workers, rounds, options):
+    stardict = StarDict(settings, **options)
+    batches = [words[i:i + BATCH_SIZE] for i in range(0, len(words), BATCH_SIZE)]
+    expected = {}
+    for batch in batches:
+        for word_str, result in zip(batch, lookup(stardict, batch)):
+            expected[word_str] = result
+        # lookup_many reads the entries in .dict order; the result must not depend on it
+        assert lookup_many(stardict, batch) == [expected[word_str] for word_str in batch]
+
+    # A fresh instance, so that the workers also race on lazy loading and on cold caches
+    stardict = StarDict(settings, **options)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for round_number in range(rounds):
+            for batch in batches:
+                function = lookup if round_number % 2 == 0 else lookup_many
+                futures.append((batch, executor.submit(function, stardict, batch)))
+                # Single words as well, so that the workers interleave finely
+                futures.append((batch[:1], executor.submit(lookup, stardict, batch[:1])))
+        mismatches = 0
+        for batch, future in futures:
+            for word_str, result in zip(batch, future.result()):
+                if result != expected[word_str]:
+                    mismatches += 1
+                    print('Mismatch for {!r} with {}'.format(word_str, options))
+    assert mismatches == 0, '{:d} concurrent results differ from the single-threaded ones'.format(mismatches)
+    return len(futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test concurrent lookups on one StarDict object.')
+    parser.add_argument('--entries', type=int, default=20000,
+                        help='number of entries of each dictionary')
+    parser.add_argument('--words', type=int, default=1000,
+                        help='number of looked up words per dictionary')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        settings = make_fixtures(dirpath, args.entries)
+        words = pick_words(settings, args.words)
+        for options in CONFIGURATIONS:
+            tasks = run(settings, words, args.workers, args.rounds, options)
+            print('{} tasks on {:d} workers match the single-threaded lookups with {}'.format(
+                tasks, args.workers, options or 'the default options'))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,8 +21,10 @@ def test():
             print(dictionary.name)
             for definition in definitions:
                 for k, v in definition.items():
-                    d = v.decode('utf-8', errors='ignore')
-                    d = tuple(d.split('\n', 1))
+                    # Binary fields (sounds, pictures) are not rendered
+                    if not isinstance(v, str):
+                        continue
+                    d = tuple(v.split('\n', 1))
                     text.append(d)
     build_report(text)
 
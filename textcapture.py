@@ -0,0 +1,249 @@
+"""Text capture over whole documents.
+
+TextCapture.capture reads a text stream in chunks, splits it into words, and looks the words up in batches with
+StarDict.lookup_many. It yields (token, position, definitions) as each batch is resolved. Memory stays bounded by
+the chunk, batch and window sizes, whatever the length of the input.
+
+capture_parallel shards the input between worker processes. Each worker loads its own StarDict.
+"""
+import io
+import multiprocessing
+import re
+from collections import OrderedDict, deque
+from app import StarDict, DictionarySettings
+
+# Letters, with inner apostrophes and hyphens: "don't", "E-Mail"
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:['’\-][^\W\d_]+)*")
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WINDOW = 10000
+DEFAULT_SHARD_SIZE = 1024 * 1024
+# A text without whitespace (minified data, CJK text) is cut once its carry reaches this many shard sizes
+MAX_SHARD_FACTOR = 4
+# The last whitespace character (any Unicode whitespace) of a text
+LAST_SPACE_PATTERN = re.compile(r"\s(?=\S*\Z)")
+# The last character that can be neither in a word nor inside one (see WORD_PATTERN)
+LAST_BREAK_PATTERN = re.compile(r"(?:(?!['’\-])[\W\d_])(?=(?:[^\W\d_]|['’\-])*\Z)")
+
+
+def iter_tokens(stream, chunk_size=DEFAULT_CHUNK_SIZE, base=0):
+    """Split a text stream into words, reading it in chunks.
+
+    Arguments:
+    - `stream`: a text file object, or a string.
+    - `chunk_size`: the number of characters read at once.
+    - `base`: the position of the beginning of the stream.
+    Return:
+    An iterator of tuples (token, position), position being the offset of the token in characters.
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        end = len(buffer)
+        for match in WORD_PATTERN.finditer(buffer):
+            if chunk and match.end() >= len(buffer) - 1:
+                # The word may go on in the next chunk
+                end = match.start()
+                break
+            yield match.group(), base + match.start()
+        if not chunk:
+            return
+        base += end
+        buffer = buffer[end:]
+
+
+def get_fallback_words(token):
+    """Get the words looked up for a token missing from the dictionaries.
+
+    Arguments:
+    - `token`: the token.
+    Return:
+    The lowercased and case-folded forms of the token, when they differ from it.
+    """
+    words = []
+    for word in (token.lower(), token.casefold()):
+        if word != token and word not in words:
+            words.append(word)
+    return words
+
+
+class TextCapture(object):
+    """Look up all the words of a text in the dictionaries enabled in text capture mode.
+    A token without definitions is looked up again lowercased, then case-folded ("Haus" at the beginning of
+    a sentence, "STRASSE"). The definitions of the last `window` distinct tokens are kept, so a repeated token is
+    looked up only once.
+    """
+
+    def __init__(self, stardict, batch_size=DEFAULT_BATCH_SIZE, window=DEFAULT_WINDOW, dictionaries=None,
+                 repeats=True, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Constructor.
+
+        Arguments:
+        - `stardict`: StarDict object.
+        - `batch_size`: the number of tokens looked up together.
+        - `window`: the number of distinct tokens whose definitions are kept.
+        - `dictionaries`: the names of the dictionaries to look up, by default the ones enabled in text
+        capture mode.
+        - `repeats`: yield every occurrence of a token. If False, a token is skipped when it already occurred
+        among the last `window` distinct tokens.
+        - `chunk_size`: the number of characters read from the stream at once.
+        """
+        self._stardict = stardict
+        self.batch_size = batch_size
+        self.window = window
+        self.dictionaries = dictionaries
+        self.repeats = repeats
+        self.chunk_size = chunk_size
+        # token: definitions, least recently seen first
+        self._seen = OrderedDict()
+
+    def _lookup(self, words):
+        results = self._stardict.lookup_many(words, dictionaries=self.dictionaries, text_capture_mode=True)
+        found = {}
+        for word_str, dictionaries_definitions in results.items():
+            definitions = [(dictionary.name, entries)
+                           for dictionary, entries in dictionaries_definitions if entries]
+            if definitions:
+                found[word_str] = definitions
+        return found
+
+    def _resolve(self, tokens):
+        found = self._lookup(tokens)
+        fallbacks = {token: get_fallback_words(token) for token in tokens if token not in found}
+        if fallbacks:
+            found_fallbacks = self._lookup([word for words in fallbacks.values() for word in words])
+            for token, words in fallbacks.items():
+                for word_str in words:
+                    if word_str in found_fallbacks:
+                        found[token] = found_fallbacks[word_str]
+                        break
+        return {token: found.get(token, []) for token in tokens}
+
+    def _remember(self, token, definitions):
+        self._seen[token] = definitions
+        self._seen.move_to_end(token)
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+
+    def _flush(self, pending, missing):
+        resolved = self._resolve(list(missing)) if missing else {}
+        for token, position, definitions in pending:
+            if definitions is None:
+                definitions = resolved[token]
+                self._remember(token, definitions)
+            if definitions:
+                yield token, position, definitions
+
+    def capture(self, stream):
+        """Look up the words of a text.
+
+        Arguments:
+        - `stream`: a text file object, or a string.
+        Return:
+        An iterator of tuples (token, position, definitions) for the tokens found in the dictionaries, in text
+        order. definitions is a list [(dictionary name, [Entry, ...]), ...].
+        """
+        pending = []
+        missing = OrderedDict()
+        for token, position in iter_tokens(stream, self.chunk_size):
+            if token in self._seen:
+                self._seen.move_to_end(token)
+                if not self.repeats:
+                    continue
+                pending.append((token, position, self._seen[token]))
+            else:
+                if token in missing:
+                    if not self.repeats:
+                        continue
+                else:
+                    missing[token] = None
+                pending.append((token, position, None))
+            if len(pending) >= self.batch_size:
+                yield from self._flush(pending, missing)
+                pending = []
+                missing = OrderedDict()
+        yield from self._flush(pending, missing)
+
+
+def iter_shards(stream, shard_size=DEFAULT_SHARD_SIZE):
+    """Cut a text stream into shards ending on whitespace, so that no word is cut.
+    Past MAX_SHARD_FACTOR shard sizes without whitespace, a shard ends on the last character that cannot belong to
+    a word, or anywhere if there is none, so that memory stays bounded.
+
+    Arguments:
+    - `stream`: a text file object, or a string.
+    - `shard_size`: the approximate number of characters of a shard.
+    Return:
+    An iterator of tuples (text, position of the text in the stream).
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    position = 0
+    carry = ''
+    while True:
+        chunk = stream.read(shard_size)
+        text = carry + chunk
+        if not chunk:
+            if text:
+                yield text, position
+            return
+        match = LAST_SPACE_PATTERN.search(text)
+        if match is None and len(text) >= shard_size * MAX_SHARD_FACTOR:
+            match = LAST_BREAK_PATTERN.search(text)
+            end = match.end() if match is not None else len(text)
+        elif match is None:
+            carry = text
+            continue
+        else:
+            end = match.end()
+        yield text[:end], position
+        position += end
+        carry = text[end:]
+
+
+# TextCapture object of a worker process
+_worker_capture = None
+
+
+def _init_worker(dicts_dirpath, settings_dirpath, stardict_options, capture_options):
+    global _worker_capture
+    stardict = StarDict(DictionarySettings(dicts_dirpath, settings_dirpath), **stardict_options)
+    _worker_capture = TextCapture(stardict, **capture_options)
+
+
+def _capture_shard(text, position):
+    return [(token, position + offset, definitions)
+            for token, offset, definitions in _worker_capture.capture(text)]
+
+
+def capture_parallel(dicts_dirpath, settings_dirpath, stream, processes=None, shard_size=DEFAULT_SHARD_SIZE,
+                     stardict_options=None, **capture_options):
+    """Look up the words of a text with a pool of worker processes.
+    The text is cut into shards handed to the workers, at most two per worker at once, so that the input is
+    not read ahead of the results. Each worker keeps its own window of seen tokens, so a token repeated in
+    two shards may be yielded twice even when `repeats` is False.
+
+    Arguments:
+    - `dicts_dirpath`: the directory of the installed dictionaries.
+    - `settings_dirpath`: the directory of the settings files.
+    - `stream`: a text file object, or a string.
+    - `processes`: the number of worker processes, by default the number of CPUs.
+    - `shard_size`: the approximate number of characters of a shard.
+    - `stardict_options`: keyword arguments of the StarDict constructor of the workers.
+    - `capture_options`: keyword arguments of the TextCapture constructor of the workers.
+    Return:
+    An iterator of tuples (token, position, definitions) like TextCapture.capture, in text order.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    with multiprocessing.Pool(processes, _init_worker,
+                              (dicts_dirpath, settings_dirpath, stardict_options or {}, capture_options)) as pool:
+        results = deque()
+        for text, position in iter_shards(stream, shard_size):
+            results.append(pool.apply_async(_capture_shard, (text, position)))
+            if len(results) >= processes * 2:
+                yield from results.popleft().get()
+        while results:
+            yield from results.popleft().get()
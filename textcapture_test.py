@@ -0,0 +1,78 @@
+"""Test of the shard boundaries of textcapture.iter_shards.
+
+Usage: python textcapture_test.py
+
+Shards must put the text back together, give the position of each one in the stream, and stay bounded in size.
+A shard ends on whitespace, Unicode whitespace included, or, in text without whitespace, on a character that
+cannot be in a word, so that the words of the shards are the words of the text. Only text without any such
+character is cut anywhere.
+"""
+import io
+import random
+import re
+from textcapture import WORD_PATTERN, MAX_SHARD_FACTOR, iter_shards
+
+SHARD_SIZES = (1, 7, 64, 1000)
+# Runs of characters that can be in words, apostrophes and hyphens included (see textcapture.LAST_BREAK_PATTERN)
+UNBROKEN_PATTERN = re.compile(r"(?:[^\W\d_]|['’\-])+")
+
+
+def make_texts():
+    rng = random.Random(0)
+    words = ['Haus', "don't", 'E-Mail', 'Straße', 'naïve', 'l’été', 'x', 'über' * 20]
+    spaces = [' ', '\n', '\t', ' ', '　', ' ', '  ']
+    breaks = [',', ';', '.', '"', '/', '0', '_', '(']
+    return {
+        'prose': ''.join(rng.choice(words) + rng.choice(spaces) for i in range(3000)),
+        # Minified data: no whitespace, but punctuation
+        'no whitespace': ''.join(rng.choice(words) + rng.choice(breaks) for i in range(3000)),
+        'long words': ' '.join(rng.choice(words) * rng.randrange(1, 40) for i in range(400)),
+    }
+
+
+def get_words(text, base=0):
+    return [(match.group(), base + match.start()) for match in WORD_PATTERN.finditer(text)]
+
+
+def check_shards(name, text, shard_size):
+    shards = list(iter_shards(text, shard_size))
+    assert shards == list(iter_shards(io.StringIO(text), shard_size)), (name, shard_size)
+    assert ''.join(shard for shard, position in shards) == text, (name, shard_size)
+    position = 0
+    for number, (shard, shard_position) in enumerate(shards):
+        assert shard and shard_position == position, (name, shard_size, number)
+        assert len(shard) <= shard_size * (MAX_SHARD_FACTOR + 1), (name, shard_size, number, len(shard))
+        position += len(shard)
+    # A shard is cut past MAX_SHARD_FACTOR shard sizes: on whitespace if the text has no longer run without any,
+    # else on a character out of words if it has no longer run without any, else anywhere
+    max_carry = shard_size * MAX_SHARD_FACTOR
+    if max((len(run) for run in re.findall(r'\S+', text)), default=0) < max_carry:
+        for number, (shard, shard_position) in enumerate(shards[:-1]):
+            assert shard[-1].isspace(), (name, shard_size, number, shard[-20:])
+    if max((len(run) for run in UNBROKEN_PATTERN.findall(text)), default=0) < max_carry:
+        for number, (shard, shard_position) in enumerate(shards[:-1]):
+            following = text[shard_position + len(shard)]
+            assert not WORD_PATTERN.match(shard[-1] + following), (name, shard_size, number, shard[-2:], following)
+        words = [word for shard, shard_position in shards for word in get_words(shard, shard_position)]
+        assert words == get_words(text), (name, shard_size)
+        return True
+    return False
+
+
+def main():
+    texts = make_texts()
+    # Without whitespace or punctuation, shards are cut anywhere, but stay bounded
+    texts['one word'] = 'a' * 5000
+    cases = 0
+    preserved = 0
+    for name, text in texts.items():
+        for shard_size in SHARD_SIZES:
+            preserved += check_shards(name, text, shard_size)
+            cases += 1
+    assert list(iter_shards('')) == []
+    print('{:d} texts cut with shard sizes {}: {:d} of {:d} cases keep every word whole'.format(
+        len(texts), SHARD_SIZES, preserved, cases))
+
+
+if __name__ == '__main__':
+    main()